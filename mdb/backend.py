@@ -0,0 +1,217 @@
+class BackendError(Exception):
+    '''A debugger operation failed.  str() is a message fit for the user.'''
+    pass
+
+# PIC32 (MIPS32) CPU registers, in display order
+PIC32_REGISTERS = (
+    "zero", "at", "v0", "v1", "a0", "a1", "a2", "a3",
+    "t0", "t1", "t2", "t3", "t4", "t5", "t6", "t7",
+    "s0", "s1", "s2", "s3", "s4", "s5", "s6", "s7",
+    "t8", "t9", "k0", "k1", "gp", "sp", "fp", "ra",
+    "pc", "hi", "lo", "status", "cause", "epc")
+
+# PIC32 peripheral registers (SFRs), as (start, length): the KSEG1 virtual
+# addresses and the physical ones.  Reading some of them has side effects,
+# such as popping a UART receive FIFO.
+PIC32_PERIPHERALS = ((0xBF800000, 0x100000), (0x1F800000, 0x100000))
+
+class Backend:
+    '''
+    Everything picdebugger needs from a debug tool and the target behind it.
+
+    picdebugger holds the caches, indexes and user-facing logic; a backend
+    only performs the primitive operations.  MdbBackend drives real hardware
+    through Microchip's mdbcore; SimBackend is an in-process simulated target
+    for testing and benchmarking without hardware.
+
+    Methods raise BackendError when the tool or target fails.  Lookups that
+    simply find nothing return None instead.
+    '''
+    # Target events passed to the listener given to connect()
+    HALT = "halt"
+    RUN = "run"
+
+    # Accesses a data breakpoint can trigger on
+    WRITE = "write"
+    READ = "read"
+    ACCESS = "access"
+
+    # Connection
+    def selectDevice(self, device):
+        '''Set up for the named target device, e.g. PIC32MX150F128B.'''
+        raise NotImplementedError
+
+    def enumerateDevices(self):
+        '''Return a list of identifiers of attached debug tools.'''
+        raise NotImplementedError
+
+    def describeTool(self, tool):
+        '''Return a short name for a tool identifier, for messages.'''
+        return str(tool)
+
+    def selectDebugger(self, tool):
+        '''Use the tool, one of the identifiers from enumerateDevices().'''
+        raise NotImplementedError
+
+    def connect(self, listener):
+        '''Connect to the tool and target.  listener(event) is called with
+        HALT or RUN whenever the target stops or starts, possibly from
+        another thread.'''
+        raise NotImplementedError
+
+    def disconnect(self):
+        raise NotImplementedError
+
+    def hasTarget(self):
+        '''Return False for backends with no live target behind them, such
+        as core files: nothing can be run, programmed or stepped.'''
+        return True
+
+    def deviceFamily(self):
+        raise NotImplementedError
+
+    # Program image
+    def load(self, path):
+        '''Load an ELF file into the host-side image of the target.'''
+        raise NotImplementedError
+
+    def program(self):
+        '''Program the loaded image into the target.'''
+        raise NotImplementedError
+
+    def sourceFiles(self, path):
+        '''Return absolute paths of the compilation units' source files.'''
+        raise NotImplementedError
+
+    # Run control
+    def run(self):
+        raise NotImplementedError
+
+    def halt(self):
+        raise NotImplementedError
+
+    def stepIn(self):
+        raise NotImplementedError
+
+    def stepOver(self):
+        raise NotImplementedError
+
+    def stepInstr(self):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def getPC(self):
+        raise NotImplementedError
+
+    def readRegisters(self):
+        '''Return [(name, value)] for the CPU registers of the halted
+        target, read together in as few transfers as the tool allows.  The
+        default reads just the PC.  Raises BackendError if the tool can't
+        read them.'''
+        return [("pc", self.getPC())]
+
+    def canSamplePC(self):
+        '''Return True if samplePC() works while the target runs.'''
+        return False
+
+    def samplePC(self):
+        '''Read the PC of the running target without stopping it.'''
+        raise NotImplementedError
+
+    # Memory
+    def readMemory(self, addr, length, virtual):
+        '''Read data memory from the target.  Returns a string or None.'''
+        raise NotImplementedError
+
+    def memoryRegions(self):
+        '''
+        Return [(name, start, length)] of the data memory a core dump
+        should hold, as virtual addresses.  The default is the largest PIC32
+        data RAM; parts a device lacks read as unreadable and are left out
+        of the dump.  Peripheral registers are never dumped.
+        '''
+        return [("ram", 0xA0000000, 0x80000)]
+
+    def readProgramMemory(self, addr, length):
+        '''Read program memory from the target.  Returns a string or None.'''
+        raise NotImplementedError
+
+    def readProgramWord(self, addr):
+        '''Return the program memory word at addr from the loaded image.'''
+        raise NotImplementedError
+
+    # Debug information
+    def sourceLineToAddress(self, path, line):
+        '''Return (start, end) addresses of the code for path:line, or None.
+        end is None if unknown.'''
+        raise NotImplementedError
+
+    def addressToSourceLine(self, addr):
+        '''Return (absolute path, line) for the code at addr, or None.'''
+        raise NotImplementedError
+
+    def lineInstructions(self, addr):
+        '''Return [(address, size), ...] for the instructions of the source
+        line at addr, or None if addr has no line.'''
+        raise NotImplementedError
+
+    def disassemble(self, word, nextword, addr):
+        '''Return the text of the instruction made of word (and nextword, for
+        long instructions).  Bit 0 of addr selects the compressed ISA.'''
+        raise NotImplementedError
+
+    def rawSymbol(self, name):
+        '''Return an object with Address(), Type() and ByteLength() for a
+        symbol, or None.'''
+        raise NotImplementedError
+
+    def typeEnum(self):
+        '''Return the enum whose ST_* members give rawSymbol() types.'''
+        raise NotImplementedError
+
+    # Breakpoints
+    def availableBreakpoints(self):
+        '''Return the number of free program breakpoint slots.'''
+        raise NotImplementedError
+
+    def addBreakpoint(self, addr, file, line):
+        '''Install a program breakpoint.  Returns a handle, or None if no
+        slots are free.'''
+        raise NotImplementedError
+
+    def removeBreakpoint(self, handle):
+        '''Remove a program or data breakpoint, freeing its slot.  Raises
+        BackendError if it can't be removed.'''
+        raise NotImplementedError
+
+    def enableBreakpoint(self, handle, enabled):
+        '''Enable or disable a program or data breakpoint.  It keeps its
+        slot while disabled.'''
+        raise NotImplementedError
+
+    def beginBreakpoints(self):
+        '''Start a batch: breakpoint changes until commitBreakpoints() may
+        be sent to the tool together.  Nothing is held open on the tool
+        until the first change.'''
+        pass
+
+    def commitBreakpoints(self):
+        '''Send the changes made since beginBreakpoints().'''
+        pass
+
+    def availableDataBreakpoints(self):
+        '''Return the number of free data breakpoint slots.'''
+        return 0
+
+    def addDataBreakpoint(self, addr, length, access):
+        '''Install a data breakpoint on length bytes at addr, triggering on
+        access (WRITE, READ or ACCESS).  Returns a handle, or None.'''
+        return None
+
+    def dataBreakpointHits(self):
+        '''Return [(handle, access)] for the data breakpoints that triggered
+        the last halt, access being READ or WRITE, or None if the tool
+        can't tell.'''
+        return None
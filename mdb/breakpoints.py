@@ -0,0 +1,81 @@
+'''
+Breakpoints, watchpoints and the table that numbers them.
+
+Numbers are handed out in order and never reused, so deleting one doesn't
+renumber the rest.  Program breakpoints are also indexed by address, which
+is what every stop looks up.
+'''
+
+from mdb.backend import Backend
+
+class Breakpoint:
+    kind = "breakpoint"
+
+    def __init__(self, addr, file, line, handle):
+        self.number = None
+        self.address = addr
+        self.file = file
+        self.line = line
+        self.enabled = True
+        self.handle = handle
+        self.condition = None
+        self.ignoreCount = 0
+        self.hits = 0
+
+class Watchpoint(Breakpoint):
+    '''Data breakpoint on the memory of an expression.  Software
+    watchpoints are checked by single-stepping instead of by the tool.'''
+    KINDS = {Backend.WRITE: "watchpoint", Backend.READ: "read watchpoint",
+             Backend.ACCESS: "access watchpoint"}
+
+    def __init__(self, expr, addr, length, layout, single, access, handle):
+        Breakpoint.__init__(self, addr, None, 0, handle)
+        self.expr = expr
+        self.length = length
+        self.layout = layout
+        self.single = single
+        self.access = access
+        self.kind = self.KINDS[access]
+        self.software = handle is None
+        self.value = None
+
+class BreakpointTable:
+    def __init__(self):
+        self._byNumber = {}
+        self._byAddress = {}
+        self._nextNumber = 0
+
+    def __len__(self):
+        return len(self._byNumber)
+
+    def add(self, bp):
+        '''Number bp and add it.  Returns its number.'''
+        bp.number = self._nextNumber
+        self._nextNumber += 1
+        self._byNumber[bp.number] = bp
+        if not isinstance(bp, Watchpoint):
+            self._byAddress[bp.address] = bp
+        return bp.number
+
+    def remove(self, bp):
+        del self._byNumber[bp.number]
+        if self._byAddress.get(bp.address) is bp:
+            del self._byAddress[bp.address]
+
+    def get(self, number):
+        '''Return breakpoint number, or None.'''
+        return self._byNumber.get(number)
+
+    def atAddress(self, addr):
+        '''Return the program breakpoint at addr, enabled or not, or None.'''
+        return self._byAddress.get(addr)
+
+    def all(self):
+        '''Return every breakpoint and watchpoint, in number order.'''
+        return [self._byNumber[x] for x in sorted(self._byNumber)]
+
+    def watchpoints(self, software=None):
+        '''Return the enabled watchpoints, or just the software or hardware
+        ones.'''
+        return [x for x in self.all() if isinstance(x, Watchpoint)
+                and x.enabled and (software is None or x.software == software)]
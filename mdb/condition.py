@@ -0,0 +1,238 @@
+'''
+Breakpoint conditions, compiled once and evaluated on every hit.
+
+A condition is a C expression over global symbols, e.g.
+'count > 100 && buf[3] != 0'.  It may also use script variables, written
+$name.  Compiling resolves every symbol to its
+address and layout, plans the fewest target reads that cover all of them,
+and turns the expression into a Python function of the decoded values.
+Evaluating then costs one read per planned range and a function call.
+
+The expression is parsed with C's precedence and associativity, and keeps
+C's meaning where Python's differs: comparisons and logical operators give
+0 or 1 and don't chain, and integer division and remainder truncate
+towards zero.
+'''
+
+import re
+
+from mdb.layout import parseExpression
+
+class ConditionError(Exception):
+    pass
+
+_TOKEN = re.compile(r"\s*(?:"
+                    r"(0[xX][0-9a-fA-F]+|\d+\.\d*|\d+)|"
+                    r"\$([A-Za-z_]\w*)|"
+                    r"([A-Za-z_]\w*(?:\s*\[[^\]]*\])?)|"
+                    r"(&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^()]))")
+
+# Binary operators from the loosest binding to the tightest; all are left
+# associative.
+_BINARY = [("||",), ("&&",), ("|",), ("^",), ("&",), ("==", "!="),
+           ("<", "<=", ">", ">="), ("<<", ">>"), ("+", "-"), ("*", "/", "%")]
+_UNARY = ("!", "~", "-", "+")
+
+def _cdiv(a, b):
+    '''C division: integer quotients truncate towards zero.'''
+    if isinstance(a, float) or isinstance(b, float):
+        return a / b
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        return -q
+    return q
+
+def _cmod(a, b):
+    '''C remainder: has the sign of the dividend.'''
+    if isinstance(a, float) or isinstance(b, float):
+        raise TypeError("invalid operands to %")
+    return a - _cdiv(a, b) * b
+
+_GLOBALS = {"__builtins__": {}, "_div": _cdiv, "_mod": _cmod}
+
+class _Parser:
+    '''Turns a token list into Python source with C semantics.  Every
+    subexpression comes out parenthesized, so Python's own precedence never
+    applies.'''
+    def __init__(self, tokens, text):
+        self._tokens = tokens
+        self._text = text
+        self._pos = 0
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, None)
+
+    def _fail(self):
+        if self._pos < len(self._tokens):
+            raise ConditionError("Bad condition at: %s" %
+                                 self._text[self._tokens[self._pos][2]:])
+        raise ConditionError("Bad condition: %s" % self._text)
+
+    def parse(self):
+        source = self._binary(0)
+        if self._pos != len(self._tokens):
+            self._fail()
+        return source
+
+    def _binary(self, level):
+        if level == len(_BINARY):
+            return self._unary()
+        left = self._binary(level + 1)
+        while True:
+            (kind, op) = self._peek()[:2]
+            if kind != "op" or op not in _BINARY[level]:
+                return left
+            self._pos += 1
+            right = self._binary(level + 1)
+            if op == "||":
+                left = "(1 if %s or %s else 0)" % (left, right)
+            elif op == "&&":
+                left = "(1 if %s and %s else 0)" % (left, right)
+            elif op in ("==", "!=", "<", "<=", ">", ">="):
+                left = "(1 if %s %s %s else 0)" % (left, op, right)
+            elif op == "/":
+                left = "_div(%s, %s)" % (left, right)
+            elif op == "%":
+                left = "_mod(%s, %s)" % (left, right)
+            else:
+                left = "(%s %s %s)" % (left, op, right)
+
+    def _unary(self):
+        (kind, value) = self._peek()[:2]
+        if kind == "op" and value in _UNARY:
+            self._pos += 1
+            operand = self._unary()
+            if value == "!":
+                return "(0 if %s else 1)" % operand
+            return "(%s%s)" % (value, operand)
+        if kind == "op" and value == "(":
+            self._pos += 1
+            inner = self._binary(0)
+            if self._peek()[:2] != ("op", ")"):
+                self._fail()
+            self._pos += 1
+            return "(%s)" % inner
+        if kind == "atom":
+            self._pos += 1
+            return value
+        self._fail()
+
+def planReads(resolved, gap):
+    '''
+    Work out the reads for a list of resolved symbols, (address, length,
+    layout, single) each.  Symbols at most gap bytes apart share a read.
+    Returns the merged (address, length) ranges, and for each symbol a slot
+    (range index, offset in the range, length, layout, single).
+    '''
+    ranges = []
+    slots = [None] * len(resolved)
+    order = sorted(range(len(resolved)), key=lambda i: resolved[i][0])
+    for i in order:
+        (addr, length, layout, single) = resolved[i]
+        if ranges:
+            (start, size) = ranges[-1]
+            if addr <= start + size + gap:
+                size = max(size, addr + length - start)
+                ranges[-1] = (start, size)
+                slots[i] = (len(ranges) - 1, addr - start, length, layout,
+                            single)
+                continue
+        ranges.append((addr, length))
+        slots[i] = (len(ranges) - 1, 0, length, layout, single)
+    return (ranges, slots)
+
+class Condition:
+    # Symbols closer together than this are fetched in one read.
+    MERGE_GAP = 32
+
+    def __init__(self, text, resolve):
+        '''
+        Compile text.  resolve(expr) must return (address, length, layout,
+        single) for a symbol expression, as picdebugger._resolveExpression
+        does, or None.  Raises ConditionError.
+        '''
+        self.text = text
+        (source, refs) = self._translate(text)
+        self.symbols = refs
+        resolved = []
+        for ref in refs:
+            r = resolve(ref)
+            if r is None:
+                raise ConditionError("No symbol %s" % ref)
+            resolved.append(r)
+        self._plan(resolved)
+        try:
+            self._fn = eval("lambda v, s: " + source, _GLOBALS)
+        except SyntaxError:
+            raise ConditionError("Bad condition: %s" % text)
+
+    def _translate(self, text):
+        '''Return (python source, symbol expressions), with the n'th symbol
+        replaced by v[n] and variable $x by s["x"].'''
+        tokens = [] # (kind, text, position in text)
+        refs = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if m is None or m.end() == pos:
+                raise ConditionError("Bad condition at: %s" % text[pos:])
+            start = m.start(m.lastindex)
+            pos = m.end()
+            (number, variable, name, op) = m.groups()
+            if number is not None:
+                tokens.append(("atom", number, start))
+            elif variable is not None:
+                tokens.append(("atom", "s[%r]" % variable, start))
+            elif name is not None:
+                name = name.replace(" ", "")
+                if parseExpression(name) is None:
+                    raise ConditionError("Bad symbol: %s" % name)
+                tokens.append(("atom", "v[%d]" % len(refs), start))
+                refs.append(name)
+            else:
+                tokens.append(("op", op, start))
+        if not tokens:
+            raise ConditionError("Empty condition")
+        return (_Parser(tokens, text).parse(), refs)
+
+    def _plan(self, resolved):
+        (self._ranges, self._slots) = planReads(resolved, self.MERGE_GAP)
+
+    def reads(self):
+        '''Return the (address, length) ranges read per evaluation.'''
+        return list(self._ranges)
+
+    def evaluate(self, read, variables=None):
+        '''Return the condition's truth.  read(addr, length) must return the
+        target's bytes as a string, or None.  variables maps names to the
+        values of $names.  Raises ConditionError if memory can't be read.'''
+        return bool(self.value(read, variables))
+
+    def values(self, read):
+        '''Return the values of the symbols in the expression, in order.'''
+        blobs = []
+        for (addr, length) in self._ranges:
+            data = read(addr, length)
+            if data is None or len(data) < length:
+                raise ConditionError("Can't read memory at 0x%X" % addr)
+            blobs.append(data)
+        values = []
+        for (rangeIndex, offset, length, layout, single) in self._slots:
+            value = layout.decode(blobs[rangeIndex][offset:offset+length])
+            if single and isinstance(value, list):
+                value = value[0]
+            values.append(value)
+        return values
+
+    def value(self, read, variables=None):
+        '''Return the expression's value.  Arguments as for evaluate().'''
+        values = self.values(read)
+        try:
+            return self._fn(values, variables or {})
+        except KeyError, e:
+            raise ConditionError("No variable $%s" % e.args[0])
+        except (ArithmeticError, TypeError), e:
+            raise ConditionError("%s: %s" % (self.text, e))
@@ -0,0 +1,160 @@
+'''
+Core files: a snapshot of target data memory for debugging offline.
+
+A core file is a fixed header, the memory contents, then a table of the
+runs of memory they hold and the CPU registers:
+
+    header:     magic, device, ELF path, PC, time, table offset, run count,
+                register count
+    data:       each run's bytes, at 8-byte aligned offsets
+    table:      (region name, start address, length, offset) per run
+    registers:  (name, value) per register
+
+Memory is streamed to the file a chunk at a time while it is read, and the
+table is written last, so nothing is held in memory.  Chunks that can't be
+read are left out, splitting their region into runs.  CoreFile maps the
+file and serves reads from it.
+'''
+
+import bisect
+import struct
+import time
+try:
+    import mmap
+except ImportError:
+    mmap = None # not available under Jython
+
+MAGIC = "PICDBCR\x02"
+_header = struct.Struct("<8s32s256sIdQII")
+_run = struct.Struct("<8sIIQ")
+_register = struct.Struct("<8sI")
+
+class CoreError(Exception):
+    pass
+
+def withoutRanges(regions, excluded):
+    '''Return regions, a list of (name, start, length), with the (start,
+    length) ranges in excluded cut out of them.'''
+    result = list(regions)
+    for (start, size) in excluded:
+        kept = []
+        for (name, rstart, length) in result:
+            if rstart < start:
+                kept.append((name, rstart, min(length, start - rstart)))
+            end = rstart + length
+            if end > start + size:
+                first = max(rstart, start + size)
+                kept.append((name, first, end - first))
+        result = kept
+    return result
+
+def writeCore(path, device, elf, pc, regions, read, registers=(),
+              chunk=0x4000, progress=None):
+    '''
+    Dump memory to a core file.  regions is a list of (name, start,
+    length); read(addr, length) must return target memory as a string, or
+    None if it can't be read.  registers is a list of (name, value).
+    progress(done, total), if given, is called after each chunk.  Returns
+    (bytes written, bytes unreadable).  Raises IOError.
+    '''
+    total = sum([x[2] for x in regions])
+    done = 0
+    missing = 0
+    runs = []
+    f = open(path, "wb")
+    try:
+        f.write("\0" * _header.size)
+        offset = _header.size
+        for (name, start, length) in regions:
+            run = None
+            for addr in range(start, start + length, chunk):
+                n = min(chunk, start + length - addr)
+                data = read(addr, n)
+                if data is None or len(data) != n:
+                    missing += n
+                    run = None
+                else:
+                    if run is None:
+                        pad = -offset % 8
+                        f.write("\0" * pad)
+                        offset += pad
+                        run = [name, addr, 0, offset]
+                        runs.append(run)
+                    f.write(data)
+                    offset += n
+                    run[2] += n
+                done += n
+                if progress is not None:
+                    progress(done, total)
+        tableOffset = offset
+        for run in runs:
+            f.write(_run.pack(*run))
+        for (name, value) in registers:
+            f.write(_register.pack(name, value & 0xFFFFFFFF))
+        f.seek(0)
+        f.write(_header.pack(MAGIC, device or "", elf or "", pc or 0,
+                             time.time(), tableOffset, len(runs),
+                             len(registers)))
+    finally:
+        f.close()
+    return (total - missing, missing)
+
+class CoreFile:
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self._data = None
+            if mmap is not None:
+                try:
+                    self._data = mmap.mmap(f.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+                except (mmap.error, ValueError):
+                    pass
+            if self._data is None:
+                self._data = f.read()
+        finally:
+            f.close()
+        try:
+            if self._data[:len(MAGIC)] != MAGIC:
+                raise CoreError("%s is not a picdb core file, or is from an "
+                                "older picdb" % path)
+            (magic, device, elf, self.pc, self.time, tableOffset, count,
+             nregs) = _header.unpack_from(self._data, 0)
+            self.device = device.rstrip("\0")
+            self.elf = elf.rstrip("\0")
+            self.runs = []
+            for i in range(count):
+                (name, start, length, offset) = _run.unpack_from(
+                    self._data, tableOffset + i * _run.size)
+                self.runs.append((start, length, offset, name.rstrip("\0")))
+            self.registers = []
+            regOffset = tableOffset + count * _run.size
+            for i in range(nregs):
+                (name, value) = _register.unpack_from(
+                    self._data, regOffset + i * _register.size)
+                self.registers.append((name.rstrip("\0"), value))
+        except struct.error:
+            raise CoreError("%s is truncated" % path)
+        self.runs.sort()
+        self._starts = [x[0] for x in self.runs]
+
+    def read(self, addr, length):
+        '''Return length bytes at addr, or None if the core doesn't hold all
+        of them.'''
+        i = bisect.bisect_right(self._starts, addr) - 1
+        if i < 0:
+            return None
+        (start, size, offset, _) = self.runs[i]
+        if addr + length > start + size:
+            return None
+        offset += addr - start
+        return self._data[offset:offset+length]
+
+    def regions(self):
+        '''Return [(name, start, length)] of the runs held.'''
+        return [(x[3], x[0], x[1]) for x in self.runs]
+
+    def close(self):
+        if mmap is not None and isinstance(self._data, mmap.mmap):
+            self._data.close()
@@ -0,0 +1,126 @@
+from mdb.backend import Backend, BackendError
+
+class CoreBackend(Backend):
+    '''
+    Offline backend for a core file written by 'dump core'.
+
+    Memory and the PC come from the core.  Everything learned from the ELF
+    (source lines, symbol types, disassembly) is passed on to info, a
+    backend for the same kind of target that never has to connect: an
+    MdbBackend for the core's device, or a SimBackend.  Nothing can be run,
+    stepped or programmed.
+    '''
+    def __init__(self, core, info):
+        self.core = core
+        self.info = info
+        if core.device:
+            info.selectDevice(core.device)
+
+    def _noTarget(self):
+        raise BackendError("No target: debugging a core file.")
+
+    # Connection
+    def selectDevice(self, device):
+        pass
+
+    def enumerateDevices(self):
+        return []
+
+    def selectDebugger(self, tool):
+        self._noTarget()
+
+    def connect(self, listener):
+        self._noTarget()
+
+    def disconnect(self):
+        self.core.close()
+
+    def hasTarget(self):
+        return False
+
+    def deviceFamily(self):
+        return self.info.deviceFamily()
+
+    # Program image
+    def load(self, path):
+        self.info.load(path)
+
+    def program(self):
+        self._noTarget()
+
+    def sourceFiles(self, path):
+        return self.info.sourceFiles(path)
+
+    # Run control
+    def run(self):
+        self._noTarget()
+
+    def halt(self):
+        self._noTarget()
+
+    def stepIn(self):
+        self._noTarget()
+
+    def stepOver(self):
+        self._noTarget()
+
+    def stepInstr(self):
+        self._noTarget()
+
+    def reset(self):
+        self._noTarget()
+
+    def getPC(self):
+        return self.core.pc
+
+    def readRegisters(self):
+        if not self.core.registers:
+            return Backend.readRegisters(self)
+        return list(self.core.registers)
+
+    # Memory
+    def readMemory(self, addr, length, virtual):
+        if not virtual:
+            return None
+        return self.core.read(addr, length)
+
+    def memoryRegions(self):
+        return self.core.regions()
+
+    def readProgramMemory(self, addr, length):
+        return None
+
+    def readProgramWord(self, addr):
+        return self.info.readProgramWord(addr)
+
+    # Debug information
+    def sourceLineToAddress(self, path, line):
+        return self.info.sourceLineToAddress(path, line)
+
+    def addressToSourceLine(self, addr):
+        return self.info.addressToSourceLine(addr)
+
+    def lineInstructions(self, addr):
+        return self.info.lineInstructions(addr)
+
+    def disassemble(self, word, nextword, addr):
+        return self.info.disassemble(word, nextword, addr)
+
+    def rawSymbol(self, name):
+        return self.info.rawSymbol(name)
+
+    def typeEnum(self):
+        return self.info.typeEnum()
+
+    # Breakpoints
+    def availableBreakpoints(self):
+        return 0
+
+    def addBreakpoint(self, addr, file, line):
+        return None
+
+    def removeBreakpoint(self, handle):
+        pass
+
+    def enableBreakpoint(self, handle, enabled):
+        pass
@@ -0,0 +1,85 @@
+'''
+Disassembly from a snapshot of program memory.
+
+Flash doesn't change while debugging, so the program image is taken once
+at load from the ELF's program segments, and words are read from it rather
+than from the tool.  Decoded instructions are cached by address.
+'''
+
+import bisect
+import struct
+
+class Disassembler:
+    '''
+    readWord(addr) must return the program memory word at addr; it is only
+    used for addresses outside the snapshot.  decode(word, nextword, addr)
+    must return the text of an instruction, as Backend.disassemble() does.
+    '''
+    def __init__(self, readWord, decode):
+        self._readWord = readWord
+        self._decode = decode
+        self._starts = []
+        self._segments = []
+        self._endian = "<"
+        self._cache = {}
+
+    def snapshot(self, segments, endian="<"):
+        '''Replace the program image with segments (objects with vaddr and
+        data) and forget decoded instructions.'''
+        ordered = sorted([(x.vaddr, x.data) for x in segments])
+        self._starts = [x[0] for x in ordered]
+        self._segments = ordered
+        self._endian = endian
+        self._cache = {}
+
+    def read(self, addr, length):
+        '''Return length bytes at addr from the snapshot, or None if they
+        aren't all in one segment of it.'''
+        i = bisect.bisect_right(self._starts, addr) - 1
+        if i < 0:
+            return None
+        (start, data) = self._segments[i]
+        offset = addr - start
+        if offset + length > len(data):
+            return None
+        return data[offset:offset+length]
+
+    def word(self, addr):
+        '''Return the 32-bit program memory word at addr.'''
+        data = self.read(addr, 4)
+        if data is None:
+            return self._readWord(addr)
+        return struct.unpack(self._endian + "I", data)[0]
+
+    def instruction(self, addr, size=4):
+        '''Return the text of the instruction at addr.  size 2 means a
+        compressed (microMIPS) instruction.'''
+        key = addr | (1 if size == 2 else 0)
+        text = self._cache.get(key)
+        if text is None:
+            text = self._decode(self.word(addr), self.word(addr + size), key)
+            self._cache[key] = text
+        return text
+
+    def __len__(self):
+        return len(self._cache)
+
+# MIPS32 loads and stores: opcode -> (bytes accessed, is a store)
+_LOADS_STORES = {
+    0x20: (1, False), 0x21: (2, False), 0x22: (4, False), 0x23: (4, False),
+    0x24: (1, False), 0x25: (2, False), 0x26: (4, False), 0x30: (4, False),
+    0x31: (4, False), 0x35: (8, False),
+    0x28: (1, True), 0x29: (2, True), 0x2a: (4, True), 0x2b: (4, True),
+    0x2e: (4, True), 0x38: (4, True), 0x39: (4, True), 0x3d: (8, True),
+    }
+
+def memoryAccess(word):
+    '''Decode a MIPS32 load or store.  Returns (base register number,
+    offset, bytes accessed, is a store), or None for other instructions.'''
+    found = _LOADS_STORES.get(word >> 26)
+    if found is None:
+        return None
+    offset = word & 0xffff
+    if offset & 0x8000:
+        offset -= 0x10000
+    return ((word >> 21) & 0x1f, offset, found[0], found[1])
@@ -0,0 +1,339 @@
+'''
+Decoder for the DWARF 2-4 .debug_info section, enough to recover the types
+of a program's global variables: base types, structs and unions with their
+members, arrays, and what typedefs and qualifiers stand for.
+'''
+
+from mdb.dwarfline import _Reader
+
+DW_TAG_array_type = 0x01
+DW_TAG_class_type = 0x02
+DW_TAG_enumeration_type = 0x04
+DW_TAG_member = 0x0d
+DW_TAG_pointer_type = 0x0f
+DW_TAG_reference_type = 0x10
+DW_TAG_structure_type = 0x13
+DW_TAG_typedef = 0x16
+DW_TAG_union_type = 0x17
+DW_TAG_subrange_type = 0x21
+DW_TAG_base_type = 0x24
+DW_TAG_const_type = 0x26
+DW_TAG_variable = 0x34
+DW_TAG_volatile_type = 0x35
+DW_TAG_restrict_type = 0x37
+
+DW_AT_name = 0x03
+DW_AT_byte_size = 0x0b
+DW_AT_bit_offset = 0x0c
+DW_AT_bit_size = 0x0d
+DW_AT_upper_bound = 0x2f
+DW_AT_count = 0x37
+DW_AT_data_member_location = 0x38
+DW_AT_declaration = 0x3c
+DW_AT_encoding = 0x3e
+DW_AT_specification = 0x47
+DW_AT_type = 0x49
+DW_AT_data_bit_offset = 0x6b
+
+DW_ATE_boolean = 0x02
+DW_ATE_float = 0x04
+DW_ATE_signed = 0x05
+DW_ATE_signed_char = 0x06
+DW_ATE_unsigned = 0x07
+DW_ATE_unsigned_char = 0x08
+
+DW_OP_plus_uconst = 0x23
+
+# Forms whose values are offsets of another entry in the same unit
+_unitRefs = (0x11, 0x12, 0x13, 0x14, 0x15)
+
+class BaseType:
+    '''An integer, character, float or anything else held like one
+    (pointers, enums).'''
+    def __init__(self, name, size, encoding):
+        self.name = name
+        self.size = size
+        self.encoding = encoding
+
+    def isSigned(self):
+        return self.encoding in (DW_ATE_signed, DW_ATE_signed_char)
+
+    def isChar(self):
+        '''True for plain char, whose arrays are strings.'''
+        return self.size == 1 and self.name == "char"
+
+class Member:
+    '''A struct or union member.  bitSize is 0 unless it is a bit field,
+    which is bits bitShift up of the unsigned storage unit of type's size
+    at offset.'''
+    def __init__(self, name, offset, type, bitSize=0, bitShift=0):
+        self.name = name
+        self.offset = offset
+        self.type = type
+        self.bitSize = bitSize
+        self.bitShift = bitShift
+
+class StructType:
+    '''A struct or union; kind is "struct" or "union".'''
+    def __init__(self, kind, name, size, members):
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.members = members
+
+class ArrayType:
+    def __init__(self, element, count):
+        self.element = element
+        self.count = count
+        self.size = element.size * count
+
+def _abbrevs(data, offset):
+    '''Return {code: (tag, has children, [(attribute, form)])} for the
+    abbreviation table at offset.'''
+    table = {}
+    r = _Reader(data, "<", offset)
+    while True:
+        code = r.uleb()
+        if code == 0:
+            return table
+        tag = r.uleb()
+        children = r.u8()
+        specs = []
+        while True:
+            attr = r.uleb()
+            form = r.uleb()
+            if attr == 0 and form == 0:
+                break
+            specs.append((attr, form))
+        table[code] = (tag, children, specs)
+
+def _formValue(r, form, unit, version, offsize, addrsize, strings):
+    if form == 0x16: # DW_FORM_indirect
+        form = r.uleb()
+    if form == 0x01: # addr
+        return r.unpack("I" if addrsize == 4 else "Q")[0]
+    if form in (0x0b, 0x11, 0x0c): # data1, ref1, flag
+        value = r.u8()
+    elif form in (0x05, 0x12): # data2, ref2
+        value = r.unpack("H")[0]
+    elif form in (0x06, 0x13): # data4, ref4
+        value = r.unpack("I")[0]
+    elif form in (0x07, 0x14, 0x20): # data8, ref8, ref_sig8
+        value = r.unpack("Q")[0]
+    elif form == 0x0d: # sdata
+        value = r.sleb()
+    elif form in (0x0f, 0x15): # udata, ref_udata
+        value = r.uleb()
+    elif form == 0x08: # string
+        value = r.cstring()
+    elif form == 0x0e: # strp
+        off = r.unpack("I" if offsize == 4 else "Q")[0]
+        end = strings.find("\0", off)
+        value = strings[off:end]
+    elif form == 0x10: # ref_addr: an address-sized offset before DWARF 3
+        size = addrsize if version == 2 else offsize
+        return r.unpack("I" if size == 4 else "Q")[0]
+    elif form == 0x17: # sec_offset
+        value = r.unpack("I" if offsize == 4 else "Q")[0]
+    elif form in (0x0a, 0x03, 0x04, 0x09, 0x18): # block1/2/4, block, exprloc
+        if form == 0x0a:
+            size = r.u8()
+        elif form == 0x03:
+            size = r.unpack("H")[0]
+        elif form == 0x04:
+            size = r.unpack("I")[0]
+        else:
+            size = r.uleb()
+        value = r.data[r.pos:r.pos+size]
+        r.pos += size
+    elif form == 0x19: # flag_present
+        value = 1
+    else:
+        raise ValueError("unsupported DWARF form 0x%x" % form)
+    if form in _unitRefs:
+        value += unit
+    return value
+
+def _entries(info, abbrev, strings, endian):
+    '''
+    Return ({offset: (tag, attributes, child offsets)}, [offsets of the
+    entries directly inside each compilation unit], address size).  Units
+    with an unsupported DWARF version are skipped.
+    '''
+    entries = {}
+    top = []
+    addrsize = 4
+    r = _Reader(info, endian)
+    while r.pos < len(info):
+        unit = r.pos
+        (length,) = r.unpack("I")
+        offsize = 4
+        if length == 0xffffffff:
+            (length,) = r.unpack("Q")
+            offsize = 8
+        unitEnd = r.pos + length
+        (version,) = r.unpack("H")
+        if version < 2 or version > 4:
+            r.pos = unitEnd
+            continue
+        (abbrevOffset,) = r.unpack("I" if offsize == 4 else "Q")
+        addrsize = r.u8()
+        table = _abbrevs(abbrev, abbrevOffset)
+        # Entries whose children are being read; the unit entry is depth 1.
+        parents = []
+        while r.pos < unitEnd:
+            offset = r.pos
+            code = r.uleb()
+            if code == 0:
+                if parents:
+                    parents.pop()
+                continue
+            (tag, children, specs) = table[code]
+            attrs = {}
+            for (attr, form) in specs:
+                attrs[attr] = _formValue(r, form, unit, version, offsize,
+                                         addrsize, strings)
+            entries[offset] = (tag, attrs, [])
+            if parents:
+                entries[parents[-1]][2].append(offset)
+                if len(parents) == 1:
+                    top.append(offset)
+            if children:
+                parents.append(offset)
+        r.pos = unitEnd
+    return (entries, top, addrsize)
+
+def _memberOffset(location):
+    '''Return the byte offset given by a DW_AT_data_member_location, which
+    is a constant or, before DWARF 4, often a DW_OP_plus_uconst block.'''
+    if isinstance(location, str):
+        r = _Reader(location, "<")
+        if r.u8() != DW_OP_plus_uconst:
+            return None
+        return r.uleb()
+    return location
+
+class _TypeBuilder:
+    def __init__(self, entries, addrsize):
+        self._entries = entries
+        self._addrsize = addrsize
+        self._types = {}
+
+    def type(self, offset):
+        '''Return the type described by the entry at offset, or None if it
+        is void, incomplete or of a kind that can't be laid out.'''
+        if offset in self._types:
+            return self._types[offset]
+        self._types[offset] = None # guards against cycles
+        entry = self._entries.get(offset)
+        result = None
+        if entry is not None:
+            result = self._build(*entry)
+        self._types[offset] = result
+        return result
+
+    def _build(self, tag, attrs, children):
+        name = attrs.get(DW_AT_name, "")
+        size = attrs.get(DW_AT_byte_size)
+        if tag in (DW_TAG_typedef, DW_TAG_const_type, DW_TAG_volatile_type,
+                   DW_TAG_restrict_type):
+            if DW_AT_type not in attrs:
+                return None
+            return self.type(attrs[DW_AT_type])
+        if tag == DW_TAG_base_type:
+            return BaseType(name, size, attrs.get(DW_AT_encoding))
+        if tag in (DW_TAG_pointer_type, DW_TAG_reference_type):
+            return BaseType("pointer", size or self._addrsize,
+                            DW_ATE_unsigned)
+        if tag == DW_TAG_enumeration_type:
+            return BaseType(name, size, DW_ATE_signed)
+        if tag in (DW_TAG_structure_type, DW_TAG_class_type,
+                   DW_TAG_union_type):
+            if attrs.get(DW_AT_declaration) or size is None:
+                return None
+            kind = "union" if tag == DW_TAG_union_type else "struct"
+            members = []
+            for child in children:
+                member = self._member(*self._entries[child])
+                if member is not None:
+                    members.append(member)
+            return StructType(kind, name, size, members)
+        if tag == DW_TAG_array_type:
+            element = self.type(attrs.get(DW_AT_type))
+            if element is None:
+                return None
+            counts = []
+            for child in children:
+                (ctag, cattrs, _) = self._entries[child]
+                if ctag != DW_TAG_subrange_type:
+                    continue
+                if DW_AT_count in cattrs:
+                    counts.append(cattrs[DW_AT_count])
+                elif DW_AT_upper_bound in cattrs:
+                    counts.append(cattrs[DW_AT_upper_bound] + 1)
+                else:
+                    counts.append(0) # flexible array member
+            for count in reversed(counts or [0]):
+                element = ArrayType(element, count)
+            return element
+        return None
+
+    def _member(self, tag, attrs, children):
+        if tag != DW_TAG_member:
+            return None
+        vartype = self.type(attrs.get(DW_AT_type))
+        if vartype is None:
+            return None
+        name = attrs.get(DW_AT_name, "")
+        offset = _memberOffset(attrs.get(DW_AT_data_member_location, 0))
+        bits = attrs.get(DW_AT_bit_size, 0)
+        if not bits:
+            if offset is None:
+                return None
+            return Member(name, offset, vartype)
+        # Bit fields are read from an unsigned storage unit the size of the
+        # field's type.  Targets are little-endian, so DWARF 2/3's
+        # bit_offset, counted from the unit's most significant bit, is
+        # turned around.
+        unitBits = (attrs.get(DW_AT_byte_size) or vartype.size) * 8
+        if DW_AT_data_bit_offset in attrs:
+            bit = attrs[DW_AT_data_bit_offset]
+            offset = bit // unitBits * (unitBits // 8)
+            shift = bit - offset * 8
+        else:
+            if offset is None:
+                return None
+            shift = unitBits - attrs.get(DW_AT_bit_offset, 0) - bits
+        if shift < 0:
+            return None
+        return Member(name, offset, vartype, bits, shift)
+
+def variableTypes(info, abbrev, strings="", endian="<"):
+    '''
+    Decode .debug_info (with its .debug_abbrev and .debug_str).  Returns
+    {name: type} for the variables at file scope whose types can be laid
+    out.
+    '''
+    (entries, top, addrsize) = _entries(info, abbrev, strings, endian)
+    builder = _TypeBuilder(entries, addrsize)
+    result = {}
+    for offset in top:
+        (tag, attrs, _) = entries[offset]
+        if tag != DW_TAG_variable:
+            continue
+        if DW_AT_specification in attrs:
+            # A definition of an earlier declaration, which has the name
+            # and the type.
+            declared = entries.get(attrs[DW_AT_specification])
+            if declared is not None:
+                merged = dict(declared[1])
+                merged.update(attrs)
+                attrs = merged
+        name = attrs.get(DW_AT_name)
+        if not name or DW_AT_type not in attrs:
+            continue
+        vartype = builder.type(attrs[DW_AT_type])
+        if vartype is not None and (name not in result or
+                                    not attrs.get(DW_AT_declaration)):
+            result[name] = vartype
+    return result
@@ -0,0 +1,170 @@
+'''
+Decoder for the DWARF 2-4 .debug_line section, enough to recover the
+address <-> source line rows of a program without mdbcore.
+'''
+
+import os
+import struct
+
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNS_set_file = 4
+DW_LNS_const_add_pc = 8
+DW_LNS_fixed_advance_pc = 9
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+DW_LNE_define_file = 3
+
+class _Reader:
+    def __init__(self, data, endian, pos=0):
+        self.data = data
+        self.endian = endian
+        self.pos = pos
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(self.endian + fmt, self.data, self.pos)
+        self.pos += struct.calcsize(self.endian + fmt)
+        return values
+
+    def u8(self):
+        self.pos += 1
+        return ord(self.data[self.pos-1])
+
+    def uleb(self):
+        result = 0
+        shift = 0
+        while True:
+            b = self.u8()
+            result |= (b & 0x7f) << shift
+            shift += 7
+            if not b & 0x80:
+                return result
+
+    def sleb(self):
+        result = 0
+        shift = 0
+        while True:
+            b = self.u8()
+            result |= (b & 0x7f) << shift
+            shift += 7
+            if not b & 0x80:
+                if b & 0x40:
+                    result -= 1 << shift
+                return result
+
+    def cstring(self):
+        end = self.data.index("\0", self.pos)
+        s = self.data[self.pos:end]
+        self.pos = end + 1
+        return s
+
+def lineRows(data, endian="<", addrsize=4):
+    '''
+    Decode a .debug_line section.  Returns a list of (addr, path, line, end)
+    rows, where end is the address of the next row in the same sequence.
+    Units with an unsupported DWARF version are skipped.
+    '''
+    rows = []
+    r = _Reader(data, endian)
+    while r.pos < len(data):
+        (length,) = r.unpack("I")
+        offsize = 4
+        if length == 0xffffffff:
+            (length,) = r.unpack("Q")
+            offsize = 8
+        unitEnd = r.pos + length
+        (version,) = r.unpack("H")
+        if version < 2 or version > 4:
+            r.pos = unitEnd
+            continue
+        (headerLength,) = r.unpack("I" if offsize == 4 else "Q")
+        programStart = r.pos + headerLength
+        minInst = r.u8()
+        if version >= 4:
+            r.u8() # maximum operations per instruction; VLIW only
+        defaultIsStmt = r.u8()
+        (lineBase,) = r.unpack("b")
+        lineRange = r.u8()
+        opcodeBase = r.u8()
+        opLengths = [r.u8() for _ in range(opcodeBase - 1)]
+        dirs = [""]
+        while True:
+            d = r.cstring()
+            if not d:
+                break
+            dirs.append(d)
+        files = [None]
+        while True:
+            name = r.cstring()
+            if not name:
+                break
+            diridx = r.uleb()
+            r.uleb() # mtime
+            r.uleb() # length
+            files.append(os.path.join(dirs[diridx], name))
+        r.pos = programStart
+        rows.extend(_runProgram(r, unitEnd, files, dirs, minInst,
+                                defaultIsStmt, lineBase, lineRange,
+                                opcodeBase, opLengths, addrsize))
+        r.pos = unitEnd
+    return rows
+
+def _runProgram(r, end, files, dirs, minInst, defaultIsStmt, lineBase,
+                lineRange, opcodeBase, opLengths, addrsize):
+    result = []
+    sequence = []
+    def reset():
+        return [0, 1, 1, defaultIsStmt] # address, file, line, is_stmt
+    state = reset()
+    def emit():
+        if state[3] and state[1] < len(files):
+            sequence.append((state[0], files[state[1]], state[2]))
+    while r.pos < end:
+        op = r.u8()
+        if op >= opcodeBase:
+            adjusted = op - opcodeBase
+            state[0] += (adjusted // lineRange) * minInst
+            state[2] += lineBase + adjusted % lineRange
+            emit()
+        elif op == 0:
+            size = r.uleb()
+            nextPos = r.pos + size
+            sub = r.u8()
+            if sub == DW_LNE_end_sequence:
+                endAddr = state[0]
+                for (i, (addr, path, line)) in enumerate(sequence):
+                    if i + 1 < len(sequence):
+                        rowEnd = sequence[i+1][0]
+                    else:
+                        rowEnd = endAddr
+                    if rowEnd > addr:
+                        result.append((addr, path, line, rowEnd))
+                sequence = []
+                state = reset()
+            elif sub == DW_LNE_set_address:
+                (state[0],) = r.unpack("I" if addrsize == 4 else "Q")
+            elif sub == DW_LNE_define_file:
+                name = r.cstring()
+                diridx = r.uleb()
+                files.append(os.path.join(dirs[diridx], name))
+            r.pos = nextPos
+        elif op == DW_LNS_copy:
+            emit()
+        elif op == DW_LNS_advance_pc:
+            state[0] += r.uleb() * minInst
+        elif op == DW_LNS_advance_line:
+            state[2] += r.sleb()
+        elif op == DW_LNS_set_file:
+            state[1] = r.uleb()
+        elif op == DW_LNS_const_add_pc:
+            state[0] += ((255 - opcodeBase) // lineRange) * minInst
+        elif op == DW_LNS_fixed_advance_pc:
+            (advance,) = r.unpack("H")
+            state[0] += advance
+        elif op == 6: # DW_LNS_negate_stmt
+            state[3] = not state[3]
+        else:
+            for _ in range(opLengths[op-1]):
+                r.uleb()
+    return result
@@ -0,0 +1,136 @@
+import struct
+
+class ElfError(Exception):
+    pass
+
+class ElfSegment:
+    '''A loadable program header.'''
+    def __init__(self, vaddr, paddr, data, memsize, flags):
+        self.vaddr = vaddr
+        self.paddr = paddr
+        self.data = data
+        self.memsize = memsize
+        self.flags = flags
+
+    def isExecutable(self):
+        return bool(self.flags & ElfFile.PF_X)
+
+    def isWritable(self):
+        return bool(self.flags & ElfFile.PF_W)
+
+class ElfFile:
+    '''
+    Minimal ELF reader: program segments and the symbol table.  Reads the
+    file directly, so it works without going through mdbcore.
+    '''
+    PT_LOAD = 1
+    PF_X = 1
+    PF_W = 2
+    SHT_SYMTAB = 2
+    STT_OBJECT = 1
+    STT_FUNC = 2
+    SHN_UNDEF = 0
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self._data = f.read()
+        finally:
+            f.close()
+        if self._data[:4] != "\x7fELF":
+            raise ElfError("%s is not an ELF file" % path)
+        self.is64 = ord(self._data[4]) == 2
+        self.endian = "<" if ord(self._data[5]) == 1 else ">"
+        if self.is64:
+            fmt = "HHIQQQIHHHHHH"
+        else:
+            fmt = "HHIIIIIHHHHHH"
+        (self.type, self.machine, _, self.entry, self._phoff, self._shoff,
+         self.flags, _, self._phentsize, self._phnum, self._shentsize,
+         self._shnum, self._shstrndx) = struct.unpack_from(
+             self.endian + fmt, self._data, 16)
+        self._sections = None
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self._data, offset)
+
+    def segments(self):
+        '''Return the PT_LOAD segments that have file contents.'''
+        result = []
+        for i in range(self._phnum):
+            off = self._phoff + i * self._phentsize
+            if self.is64:
+                (ptype, flags, offset, vaddr, paddr, filesz, memsz, _) = \
+                    self._unpack("IIQQQQQQ", off)
+            else:
+                (ptype, offset, vaddr, paddr, filesz, memsz, flags, _) = \
+                    self._unpack("IIIIIIII", off)
+            if ptype != self.PT_LOAD or filesz == 0:
+                continue
+            result.append(ElfSegment(vaddr, paddr,
+                                     self._data[offset:offset+filesz],
+                                     memsz, flags))
+        return result
+
+    def programSegments(self):
+        '''Return the loadable segments that end up in program memory.  RAM
+        segments are the writable ones.'''
+        return [x for x in self.segments() if not x.isWritable()]
+
+    def sections(self):
+        '''Return a list of (name, type, flags, addr, offset, size, link).'''
+        if self._sections is not None:
+            return self._sections
+        raw = []
+        for i in range(self._shnum):
+            off = self._shoff + i * self._shentsize
+            if self.is64:
+                (name, stype, flags, addr, offset, size, link, _, _, _) = \
+                    self._unpack("IIQQQQIIQQ", off)
+            else:
+                (name, stype, flags, addr, offset, size, link, _, _, _) = \
+                    self._unpack("IIIIIIIIII", off)
+            raw.append((name, stype, flags, addr, offset, size, link))
+        self._sections = []
+        if not raw:
+            return self._sections
+        strtab = raw[self._shstrndx]
+        for (name, stype, flags, addr, offset, size, link) in raw:
+            self._sections.append((self._string(strtab[4], name), stype, flags,
+                                   addr, offset, size, link))
+        return self._sections
+
+    def section(self, name):
+        '''Return the contents of the named section, or None.'''
+        for s in self.sections():
+            if s[0] == name:
+                return self._data[s[4]:s[4]+s[5]]
+        return None
+
+    def _string(self, tableOffset, index):
+        start = tableOffset + index
+        end = self._data.find("\0", start)
+        return self._data[start:end]
+
+    def symbols(self):
+        '''Return a list of (name, value, size, type) for defined symbols.'''
+        result = []
+        sections = self.sections()
+        for (_, stype, _, _, offset, size, link) in sections:
+            if stype != self.SHT_SYMTAB:
+                continue
+            strOffset = sections[link][4]
+            entsize = 24 if self.is64 else 16
+            for off in range(offset + entsize, offset + size, entsize):
+                if self.is64:
+                    (name, info, _, shndx, value, symsize) = \
+                        self._unpack("IBBHQQ", off)
+                else:
+                    (name, value, symsize, info, _, shndx) = \
+                        self._unpack("IIIBBH", off)
+                if shndx == self.SHN_UNDEF or name == 0:
+                    continue
+                result.append((self._string(strOffset, name), value, symsize,
+                               info & 0xf))
+        return result
@@ -0,0 +1,89 @@
+'''
+Single-threaded event loop for the command interpreter.
+
+Callbacks posted from any thread (user input, target events) and periodic
+timers all run one at a time on the thread that calls run(), so command
+handlers never run concurrently with each other.
+'''
+
+import time
+import heapq
+import Queue
+
+class _Timer:
+    def __init__(self, id, interval, fn, description):
+        self.id = id
+        self.interval = interval
+        self.fn = fn
+        self.description = description
+        self.due = time.time() + interval
+
+class EventLoop:
+    # Longest time to block on the queue.  Keeps the loop responsive to
+    # signals, which Python only handles between bytecodes.
+    POLL_INTERVAL = 0.25
+
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._timers = {}
+        self._heap = []
+        self._nextId = 1
+        self.running = False
+
+    def post(self, fn, *args):
+        '''Run fn(*args) on the loop thread.  Safe from any thread.'''
+        self._queue.put((fn, args))
+
+    def every(self, interval, fn, description=""):
+        '''Run fn() every interval seconds.  Returns the timer's id.'''
+        timer = _Timer(self._nextId, interval, fn, description)
+        self._nextId += 1
+        self._timers[timer.id] = timer
+        heapq.heappush(self._heap, (timer.due, timer.id))
+        return timer.id
+
+    def cancel(self, id):
+        '''Stop a timer.  Returns False if there was no such timer.'''
+        return self._timers.pop(id, None) is not None
+
+    def timers(self):
+        '''Return [(id, interval, description)] for the active timers.'''
+        return [(t.id, t.interval, t.description)
+                for t in sorted(self._timers.values(), key=lambda x: x.id)]
+
+    def stop(self):
+        '''Make run() return once the current callback is done.'''
+        self.running = False
+        self.post(lambda: None)
+
+    def _runTimers(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            (due, id) = heapq.heappop(self._heap)
+            timer = self._timers.get(id)
+            if timer is None or timer.due != due:
+                continue # cancelled
+            # Keep to the original schedule, but don't try to catch up on
+            # runs missed while a long command held the loop.
+            timer.due += timer.interval
+            if timer.due <= now:
+                timer.due = now + timer.interval
+            heapq.heappush(self._heap, (timer.due, timer.id))
+            timer.fn()
+            if not self.running:
+                return
+
+    def run(self):
+        '''Process callbacks and timers until stop() is called.'''
+        self.running = True
+        while self.running:
+            timeout = self.POLL_INTERVAL
+            if self._heap:
+                timeout = max(0, min(timeout, self._heap[0][0] - time.time()))
+            try:
+                (fn, args) = self._queue.get(True, timeout)
+                fn(*args)
+            except Queue.Empty:
+                pass
+            if self.running:
+                self._runTimers()
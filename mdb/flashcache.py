@@ -0,0 +1,90 @@
+import os
+import json
+import hashlib
+import threading
+
+def imageDigest(segments):
+    '''Content hash of a program image: addresses and bytes of each segment.'''
+    h = hashlib.sha1()
+    for seg in sorted(segments, key=lambda x: x.vaddr):
+        h.update("%08X:%d:" % (seg.vaddr, len(seg.data)))
+        h.update(seg.data)
+    return h.hexdigest()
+
+def differingRows(expected, actual, base, rowSize):
+    '''Return the addresses of rowSize-aligned rows where the strings
+    expected and actual (both starting at address base) differ.'''
+    rows = []
+    start = base - (base % rowSize)
+    end = base + len(expected)
+    for row in range(start, end, rowSize):
+        lo = max(row, base) - base
+        hi = min(row + rowSize, end) - base
+        if expected[lo:hi] != actual[lo:hi]:
+            rows.append(row)
+    return rows
+
+class FlashCache:
+    '''
+    Remembers the digest of the image last programmed onto each device from
+    each ELF file, so an unchanged image doesn't need programming again.
+    Stored as JSON in the user's home directory.  Threads must share one
+    instance, whose lock serializes their updates.  Separate processes
+    write through their own temporary files, so at worst one's entry is
+    lost and the image is programmed again.
+    '''
+    DEFAULT_PATH = os.path.join("~", ".picdb", "flashcache.json")
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+    def _key(self, device, elfpath):
+        return "%s|%s" % (device, os.path.abspath(elfpath))
+
+    def _read(self):
+        try:
+            f = open(self.path, "r")
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = "%s.%d.tmp" % (self.path, os.getpid())
+            f = open(tmp, "w")
+            try:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass # only an optimization; programming still works without it
+
+    def lastProgrammed(self, device, elfpath):
+        '''Return the digest last recorded for device and elfpath, or None.'''
+        return self._read().get(self._key(device, elfpath))
+
+    def record(self, device, elfpath, digest):
+        self._lock.acquire()
+        try:
+            entries = self._read()
+            entries[self._key(device, elfpath)] = digest
+            self._write(entries)
+        finally:
+            self._lock.release()
+
+    def forget(self, device, elfpath):
+        self._lock.acquire()
+        try:
+            entries = self._read()
+            if entries.pop(self._key(device, elfpath), None) is not None:
+                self._write(entries)
+        finally:
+            self._lock.release()
@@ -0,0 +1,239 @@
+'''
+Fleet mode: load, program, verify and run a script on every attached debug
+tool at once.
+
+Each tool gets its own command handler, picdebugger and backend (for
+mdbcore, its own assembly), driven by a pool of worker threads.  Output
+from each target is captured separately; the console shows one progress
+line per stage per target and a pass/fail summary at the end.
+'''
+
+import sys
+import time
+import thread
+import threading
+import logging
+import Queue
+
+from mdb.script import Script, ScriptError
+
+class TargetResult:
+    '''Outcome of the fleet job on one tool.'''
+    def __init__(self, index, tool, label):
+        self.index = index
+        self.tool = tool
+        self.label = label
+        self.passed = False
+        self.stage = "waiting"
+        self.message = ""
+        self.elapsed = 0.0
+        self.output = []
+
+class _ThreadRouter:
+    '''
+    File-like object that sends writes from registered threads to their own
+    stream, and writes from anything else to a default stream.
+    '''
+    def __init__(self, default):
+        self._default = default
+        self._streams = {}
+
+    def register(self, stream):
+        self._streams[thread.get_ident()] = stream
+
+    def unregister(self):
+        self._streams.pop(thread.get_ident(), None)
+
+    def write(self, s):
+        self._streams.get(thread.get_ident(), self._default).write(s)
+
+    def flush(self):
+        pass
+
+class _Capture:
+    '''Collects written text into a TargetResult's output lines.'''
+    def __init__(self, result):
+        self._result = result
+        self._partial = ""
+
+    def write(self, s):
+        lines = (self._partial + s).split("\n")
+        self._partial = lines.pop()
+        self._result.output.extend(lines)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._partial:
+            self._result.output.append(self._partial)
+            self._partial = ""
+
+class Fleet:
+    '''
+    Runs a job on every debug tool attached for a device.
+
+    makeHandler() must return a new CommandHandler, with its picdebugger in
+    .dbg.  flashCache, if given, is shared by every target.
+    '''
+    def __init__(self, device, makeHandler, workers=None, flashCache=None,
+                 out=None):
+        self.device = device
+        self._makeHandler = makeHandler
+        self.workers = workers
+        self.flashCache = flashCache
+        self._out = out or sys.stdout
+        self._outLock = threading.Lock()
+        self.log = logging.getLogger("picdb")
+
+    def enumerate(self):
+        '''Return identifiers of the attached tools, using a throwaway
+        handler.'''
+        dbg = self._makeHandler().dbg
+        dbg.selectDevice(self.device)
+        if not dbg.enumerateDevices():
+            return []
+        return list(dbg.devices or [])
+
+    def _progress(self, result, stage):
+        result.stage = stage
+        self._outLock.acquire()
+        try:
+            self._out.write("[%d %s] %s\n" % (result.index, result.label,
+                                              stage))
+            self._out.flush()
+        finally:
+            self._outLock.release()
+
+    def _runTarget(self, result, handler, elf, lines, name, force):
+        '''The job for one target.  Returns None on success, or a message
+        saying what failed.'''
+        dbg = handler.dbg
+        if self.flashCache is not None:
+            dbg.flashCache = self.flashCache
+        try:
+            script = Script(handler, lines, name)
+        except ScriptError, e:
+            return "%s: %s" % (name, e)
+        self._progress(result, "connecting")
+        dbg.selectDevice(self.device)
+        dbg.selectDebugger(result.tool)
+        if not dbg.connect():
+            return "connect failed"
+        try:
+            if elf:
+                self._progress(result, "programming")
+                if not dbg.load(elf, force):
+                    return "load failed"
+                self._progress(result, "verifying")
+                if not dbg.verify(elf):
+                    return "verify failed"
+                dbg.reset()
+            if script.body:
+                self._progress(result, "running %s" % name)
+                dbg.beginBreakpointBatch()
+                try:
+                    # Output is already captured per thread.
+                    outcome = script.run(buffered=False)
+                finally:
+                    dbg.endBreakpointBatch()
+                if outcome.error is not None:
+                    return outcome.error
+                if outcome.failures:
+                    return "%d expectation%s failed" % (
+                        len(outcome.failures),
+                        "s" if len(outcome.failures) > 1 else "")
+        finally:
+            dbg.disconnect()
+        return None
+
+    def _worker(self, jobs, router, elf, script, name, force):
+        while True:
+            try:
+                result = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            capture = _Capture(result)
+            router.register(capture)
+            start = time.time()
+            try:
+                try:
+                    handler = self._makeHandler()
+                    result.message = self._runTarget(result, handler, elf,
+                                                     script, name, force)
+                except Exception, e:
+                    result.message = "error: %s" % e
+            finally:
+                result.elapsed = time.time() - start
+                router.unregister()
+                capture.close()
+            result.passed = result.message is None
+            if result.passed:
+                result.message = ""
+                self._progress(result, "PASS")
+            else:
+                self._progress(result, "FAIL: %s" % result.message)
+
+    def run(self, elf, script=(), force=False, tools=None, name="script"):
+        '''
+        Load and verify elf (if given), then run script, the lines of a
+        debug script called name, on every tool (or the given tools) in
+        parallel.  A target fails if the script doesn't parse, stops on an
+        error or has an expect that fails.  Returns a list of TargetResult,
+        in tool order.
+        '''
+        if tools is None:
+            tools = self.enumerate()
+        describe = self._makeHandler().dbg.backend.describeTool
+        results = [TargetResult(i, tool, describe(tool))
+                   for (i, tool) in enumerate(tools)]
+        if not results:
+            return results
+        jobs = Queue.Queue()
+        for result in results:
+            jobs.put(result)
+
+        # Commands print and log; give each worker thread its own copy.
+        router = _ThreadRouter(sys.stdout)
+        handler = logging.StreamHandler(router)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        oldPropagate = self.log.propagate
+        oldStdout = sys.stdout
+        self.log.addHandler(handler)
+        self.log.propagate = False
+        sys.stdout = router
+        try:
+            nworkers = min(self.workers or len(results), len(results))
+            threads = [threading.Thread(target=self._worker,
+                                        args=(jobs, router, elf, script,
+                                              name, force))
+                       for _ in range(nworkers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.stdout = oldStdout
+            self.log.propagate = oldPropagate
+            self.log.removeHandler(handler)
+        return results
+
+    def summary(self, results, elapsed=None):
+        '''Return the pass/fail summary of results as a list of lines.
+        Output captured from failed targets is included.'''
+        lines = []
+        for r in results:
+            lines.append("%3d  %-24s %-4s %7.2fs  %s" %
+                         (r.index, r.label[:24], "PASS" if r.passed else "FAIL",
+                          r.elapsed, r.message))
+        for r in results:
+            if not r.passed and r.output:
+                lines.append("")
+                lines.append("Output from %d %s:" % (r.index, r.label))
+                lines.extend(["    " + x for x in r.output])
+        passed = len([r for r in results if r.passed])
+        total = "%d passed, %d failed" % (passed, len(results) - passed)
+        if elapsed is not None:
+            total += " in %.2fs" % elapsed
+        lines.append(total)
+        return lines
@@ -0,0 +1,205 @@
+'''
+Timing of every call picdebugger makes into its backend.
+
+InstrumentedBackend wraps a backend and reports each call's latency, and
+the bytes of target memory it read, to a Stats.  Stats keeps count, total
+and maximum time and bytes per operation, overall and per user command,
+and can also write every call to a trace file as a JSON line.  Wrappers
+are made once per method, so a call costs two clock reads and a few dict
+updates on top of the backend's own work.
+
+The wrapper is also where calls from different threads (the prompt, and a
+background 'log') are serialized: mdbcore's Debugger must only be driven
+by one of them at a time.
+'''
+
+import json
+import time
+import threading
+
+class Stats:
+    '''Figures are kept in records: [calls, total seconds, max seconds,
+    bytes].  Calls may be recorded from any thread.  Each thread has its own
+    stack of commands; calls made outside any command by a thread other than
+    the one that made the Stats, such as a 'log' worker, count against
+    BACKGROUND.'''
+    BACKGROUND = "background"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+        self._local = threading.local()
+        self._foreground = threading.currentThread()
+        self._sink = None
+
+    def _commands(self):
+        '''The calling thread's command stack.'''
+        stack = getattr(self._local, "commands", None)
+        if stack is None:
+            stack = self._local.commands = []
+        return stack
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.ops = {}         # op -> record
+            self.byCommand = {}   # command -> {op -> record}
+            self.commandTimes = {} # command -> record of the commands themselves
+            self.since = time.time()
+        finally:
+            self._lock.release()
+
+    def _add(self, table, key, elapsed, nbytes):
+        r = table.get(key)
+        if r is None:
+            r = table[key] = [0, 0.0, 0.0, 0]
+        r[0] += 1
+        r[1] += elapsed
+        if elapsed > r[2]:
+            r[2] = elapsed
+        r[3] += nbytes
+
+    def record(self, op, start, elapsed, nbytes=0):
+        '''Count one call of op, made at time start.'''
+        self._lock.acquire()
+        try:
+            self._add(self.ops, op, elapsed, nbytes)
+            commands = self._commands()
+            if commands:
+                command = commands[-1][0]
+            elif threading.currentThread() is not self._foreground:
+                command = self.BACKGROUND
+            else:
+                command = None
+            if command is not None:
+                ops = self.byCommand.get(command)
+                if ops is None:
+                    ops = self.byCommand[command] = {}
+                self._add(ops, op, elapsed, nbytes)
+            if self._sink is not None:
+                self._sink.write(json.dumps(
+                    {"time": start, "op": op, "ms": elapsed * 1000.0,
+                     "bytes": nbytes, "command": command}) + "\n")
+        finally:
+            self._lock.release()
+
+    def beginCommand(self, name):
+        '''Attribute calls to command name until endCommand().  Commands
+        nest; calls count against the innermost.  Only calls from the
+        calling thread are attributed to it.'''
+        self._commands().append((name, time.time()))
+
+    def endCommand(self):
+        (name, start) = self._commands().pop()
+        self._lock.acquire()
+        try:
+            self._add(self.commandTimes, name, time.time() - start, 0)
+        finally:
+            self._lock.release()
+
+    def traceTo(self, path):
+        '''Write each call to path as a JSON line, or stop if path is None.
+        Raises IOError.'''
+        self._lock.acquire()
+        try:
+            if self._sink is not None:
+                self._sink.close()
+                self._sink = None
+            if path is not None:
+                self._sink = open(path, "a")
+        finally:
+            self._lock.release()
+
+    def report(self, top=10):
+        '''Return the figures as a list of lines.'''
+        self._lock.acquire()
+        try:
+            return self._report(top)
+        finally:
+            self._lock.release()
+
+    def _report(self, top):
+        out = ["Backend calls since %s:" %
+               time.strftime("%H:%M:%S", time.localtime(self.since))]
+        out.extend(self._table(self.ops, top))
+        for (name, r) in sorted(self.commandTimes.items(),
+                                key=lambda x: -x[1][1]):
+            ops = self.byCommand.get(name, {})
+            backend = sum([x[1] for x in ops.values()])
+            out.append("")
+            out.append("%s: %d run%s, %.1f ms total, %.1f ms max, "
+                       "%.1f ms in %d backend calls" %
+                       (name, r[0], "s" if r[0] > 1 else "", r[1] * 1000.0,
+                        r[2] * 1000.0, backend * 1000.0,
+                        sum([x[0] for x in ops.values()])))
+            out.extend(self._table(ops, top))
+        background = self.byCommand.get(self.BACKGROUND)
+        if background and self.BACKGROUND not in self.commandTimes:
+            out.append("")
+            out.append("%s: %.1f ms in %d backend calls" %
+                       (self.BACKGROUND,
+                        sum([x[1] for x in background.values()]) * 1000.0,
+                        sum([x[0] for x in background.values()])))
+            out.extend(self._table(background, top))
+        return out
+
+    def _table(self, ops, top):
+        if not ops:
+            return ["  (none)"]
+        lines = ["  %-24s %8s %10s %9s %9s %10s" %
+                 ("operation", "calls", "total ms", "mean ms", "max ms",
+                  "bytes")]
+        ranked = sorted(ops.items(), key=lambda x: -x[1][1])
+        for (op, r) in ranked[:top]:
+            lines.append("  %-24s %8d %10.2f %9.3f %9.3f %10d" %
+                         (op, r[0], r[1] * 1000.0, r[1] * 1000.0 / r[0],
+                          r[2] * 1000.0, r[3]))
+        if len(ranked) > top:
+            lines.append("  ... %d more" % (len(ranked) - top))
+        return lines
+
+class InstrumentedBackend:
+    '''Wraps a backend, reporting the time taken by each method call to
+    stats.  Calls are made one at a time, whatever thread they come from;
+    the time waiting for another thread's call isn't counted.  Other
+    attributes, and methods that never reach the tool, are passed
+    through.'''
+    # Methods that return target memory, and so count bytes
+    TRANSFERS = ("readMemory", "readProgramMemory")
+    UNTIMED = ("hasTarget", "describeTool", "typeEnum", "canSamplePC",
+               "memoryRegions")
+
+    def __init__(self, backend, stats):
+        self.__dict__["_backend"] = backend
+        self.__dict__["_stats"] = stats
+        # Reentrant, so a ^C handler that halts the target can't deadlock
+        # against a call the interrupted main thread is in.
+        self.__dict__["_lock"] = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if not callable(attr) or name.startswith("_") or name in self.UNTIMED:
+            return attr
+        stats = self._stats
+        lock = self._lock
+        transfer = name in self.TRANSFERS
+        def call(*args):
+            lock.acquire()
+            try:
+                start = time.time()
+                result = None
+                try:
+                    result = attr(*args)
+                    return result
+                finally:
+                    elapsed = time.time() - start
+                    stats.record(name, start, elapsed,
+                                 len(result or "") if transfer else 0)
+            finally:
+                lock.release()
+        # Found by normal lookup from now on.
+        self.__dict__[name] = call
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._backend, name, value)
@@ -0,0 +1,367 @@
+import re
+import sys
+import array
+import struct
+
+from mdb.dwarfinfo import BaseType, StructType, ArrayType, DW_ATE_float
+
+# Target data is little-endian on every supported PIC family.
+TARGET_ENDIAN = "<"
+
+class RawBytes(str):
+    '''Memory that couldn't be given a type; formatted as hex, labelled
+    with what it is (e.g. "struct").'''
+    def __new__(cls, data, what="type"):
+        self = str.__new__(cls, data)
+        self.what = what
+        return self
+
+class StructValue(tuple):
+    '''A decoded struct or union: a list of (member name, value).'''
+    pass
+
+class ScalarLayout:
+    '''A single integer or floating point value.'''
+    def __init__(self, fmt):
+        self.format = fmt
+        self._struct = struct.Struct(TARGET_ENDIAN + fmt)
+        self.size = self._struct.size
+        self.elementSize = self.size
+        self.count = 1
+
+    def decode(self, data):
+        return self._struct.unpack_from(data)[0]
+
+class ArrayLayout:
+    '''
+    A homogeneous array of scalars.  Decoded in one pass, with array.array
+    when the host has a matching type code and a precompiled struct.Struct
+    otherwise.
+    '''
+    _arrayCodes = {"b": "b", "B": "B", "h": "h", "H": "H", "i": "i", "I": "I",
+                   "q": "l", "Q": "L", "f": "f", "d": "d"}
+
+    def __init__(self, fmt, count):
+        self.elementSize = struct.calcsize(TARGET_ENDIAN + fmt)
+        self.count = count
+        self.size = self.elementSize * count
+        self.format = fmt
+        self._arrayCode = None
+        code = self._arrayCodes.get(fmt)
+        for c in (code, fmt):
+            if c and array.array(c).itemsize == self.elementSize:
+                self._arrayCode = c
+                break
+        self._structs = {}
+
+    def _structFor(self, n):
+        s = self._structs.get(n)
+        if s is None:
+            s = struct.Struct("%s%d%s" % (TARGET_ENDIAN, n, self.format))
+            self._structs[n] = s
+        return s
+
+    def decode(self, data):
+        '''Decode as many whole elements as data holds.'''
+        n = len(data) // self.elementSize
+        if self._arrayCode is not None:
+            values = array.array(self._arrayCode)
+            values.fromstring(data[:n*self.elementSize])
+            if sys.byteorder != "little":
+                values.byteswap()
+            return values.tolist()
+        return list(self._structFor(n).unpack_from(data))
+
+class StringLayout:
+    '''A char array, decoded up to the first NUL.'''
+    def __init__(self, count):
+        self.elementSize = 1
+        self.count = count
+        self.size = count
+
+    def decode(self, data):
+        return data.split("\0", 1)[0]
+
+class StructLayout:
+    '''
+    A struct or union, or an array of count of them, laid out from the
+    ELF's debug information.  The members that follow one another are
+    unpacked together with one precompiled struct.Struct for the type;
+    members that overlap, union members after the first and bit fields, are
+    decoded from their own bytes.
+    '''
+    def __init__(self, size, fmt, members, count=1):
+        self._struct = struct.Struct(TARGET_ENDIAN + fmt)
+        self.elementSize = size
+        self.count = count
+        self.size = size * count
+        # (name, fn(unpacked values, data, record offset)), in declaration
+        # order
+        self._members = members
+
+    def _record(self, data, base):
+        values = self._struct.unpack_from(data, base)
+        return StructValue([(name, fn(values, data, base))
+                            for (name, fn) in self._members])
+
+    def decode(self, data):
+        '''Decode as many whole records as data holds; a lone struct is
+        returned as itself rather than in a list.'''
+        records = [self._record(data, i * self.elementSize)
+                   for i in range(len(data) // self.elementSize)]
+        if self.count == 1 and len(records) == 1:
+            return records[0]
+        return records
+
+class BytesLayout:
+    '''
+    Memory that isn't decoded: structs and unions when the ELF has no
+    debug information for them, and types that can't be split by size.
+    what names it for display.
+    '''
+    def __init__(self, size, what="type"):
+        self.elementSize = 1
+        self.count = size
+        self.size = size
+        self.what = what
+
+    def decode(self, data):
+        return RawBytes(data, self.what)
+
+# Fundamental type name -> (struct format, element size on PIC32), used to
+# split arrays into elements.  Looked up by name, since not every mdbcore
+# version defines all of them.
+_typeFormats = [
+    ("ST_CHAR", "b"), ("ST_SCHAR", "b"), ("ST_UCHAR", "B"),
+    ("ST_SHORT", "h"), ("ST_USHORT", "H"),
+    ("ST_INT", "i"), ("ST_UINT", "I"),
+    ("ST_LONG", "i"), ("ST_ULONG", "I"),
+    ("ST_LONGLONG", "q"), ("ST_ULONGLONG", "Q"),
+    ("ST_FLOAT", "f"), ("ST_DOUBLE", "d"),
+    ]
+_stringTypes = ["ST_CHAR"]
+# Aggregate type name -> what it is called when printed undecoded
+_aggregateTypes = [("ST_STRUCT", "struct"), ("ST_UNION", "union")]
+_intFormats = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+class LayoutCompiler:
+    '''
+    Builds a layout for a symbol from its fundamental type and byte length.
+    Layouts are compiled once per (type, length) and reused.
+    '''
+    def __init__(self, typeEnum):
+        self._formats = {}
+        self._strings = set()
+        for (name, fmt) in _typeFormats:
+            t = getattr(typeEnum, name, None)
+            if t is not None:
+                self._formats[t.value()] = fmt
+        for name in _stringTypes:
+            t = getattr(typeEnum, name, None)
+            if t is not None:
+                self._strings.add(t.value())
+        self._aggregates = {}
+        for (name, what) in _aggregateTypes:
+            t = getattr(typeEnum, name, None)
+            if t is not None:
+                self._aggregates[t.value()] = what
+        self._cache = {}
+        self._typeCache = {}
+
+    def isFundamental(self, vartype):
+        '''True if vartype is a fundamental type with a known format.'''
+        return vartype in self._formats
+
+    def layoutFor(self, vartype, length):
+        key = (vartype, length)
+        layout = self._cache.get(key)
+        if layout is None:
+            layout = self._compile(vartype, length)
+            self._cache[key] = layout
+        return layout
+
+    def _compile(self, vartype, length):
+        if vartype in self._aggregates:
+            return BytesLayout(length, self._aggregates[vartype])
+        fmt = self._formats.get(vartype)
+        if fmt is None:
+            if length in _intFormats:
+                return ScalarLayout(_intFormats[length])
+            return BytesLayout(length)
+        size = struct.calcsize(TARGET_ENDIAN + fmt)
+        if length == size:
+            return ScalarLayout(fmt)
+        if fmt in "fd" and length in (4, 8):
+            # double is 32-bit on some compilers
+            return ScalarLayout("f" if length == 4 else "d")
+        if length < size or length % size:
+            return BytesLayout(length)
+        if vartype in self._strings:
+            return StringLayout(length)
+        return ArrayLayout(fmt, length // size)
+
+    def layoutForType(self, vartype):
+        '''Return the layout of a type from the ELF's debug information (see
+        mdb.dwarfinfo), or None if it can't be laid out.  Compiled once per
+        type.'''
+        if vartype not in self._typeCache:
+            self._typeCache[vartype] = self._compileType(vartype)
+        return self._typeCache[vartype]
+
+    def forgetTypes(self):
+        '''Drop the layouts of debug information types; a new ELF has been
+        loaded.'''
+        self._typeCache = {}
+
+    def _compileType(self, vartype):
+        if isinstance(vartype, BaseType):
+            fmt = _baseFormat(vartype)
+            if fmt is None:
+                return BytesLayout(vartype.size)
+            return ScalarLayout(fmt)
+        if isinstance(vartype, StructType):
+            return self._structLayout(vartype, 1)
+        if isinstance(vartype, ArrayType):
+            (element, count) = _flatten(vartype)
+            if count == 0:
+                return None
+            if isinstance(element, StructType):
+                return self._structLayout(element, count)
+            if isinstance(element, BaseType):
+                if element.isChar():
+                    return StringLayout(count)
+                fmt = _baseFormat(element)
+                if fmt is not None:
+                    return ArrayLayout(fmt, count)
+            return BytesLayout(vartype.size)
+        return None
+
+    def _structLayout(self, vartype, count):
+        if not vartype.size:
+            return None
+        fmt = ""
+        members = []
+        pos = 0  # end of the last member in fmt
+        index = 0 # of the next value fmt unpacks
+        for m in vartype.members:
+            if m.bitSize:
+                members.append((m.name, _bitField(m)))
+                continue
+            layout = self.layoutForType(m.type)
+            if layout is None or not layout.size:
+                continue
+            if m.offset < pos:
+                # Overlaps what's packed already: decode it on its own.
+                def fn(values, data, base, layout=layout, offset=m.offset):
+                    start = base + offset
+                    return layout.decode(data[start:start+layout.size])
+                members.append((m.name, fn))
+                continue
+            fmt += "%dx" % (m.offset - pos) if m.offset > pos else ""
+            pos = m.offset + layout.size
+            if isinstance(layout, ScalarLayout):
+                fmt += layout.format
+                fn = lambda values, data, base, i=index: values[i]
+                index += 1
+            elif isinstance(layout, ArrayLayout):
+                fmt += "%d%s" % (layout.count, layout.format)
+                fn = lambda values, data, base, i=index, n=layout.count: \
+                    list(values[i:i+n])
+                index += layout.count
+            else:
+                fmt += "%ds" % layout.size
+                fn = lambda values, data, base, i=index, layout=layout: \
+                    layout.decode(values[i])
+                index += 1
+            members.append((m.name, fn))
+        if pos > vartype.size:
+            return None
+        fmt += "%dx" % (vartype.size - pos) if vartype.size > pos else ""
+        return StructLayout(vartype.size, fmt, members, count)
+
+def _flatten(vartype):
+    '''Return (element type, element count) of a possibly multidimensional
+    array.'''
+    count = 1
+    while isinstance(vartype, ArrayType):
+        count *= vartype.count
+        vartype = vartype.element
+    return (vartype, count)
+
+def _baseFormat(vartype):
+    '''Return the struct format of a base type, or None.'''
+    if vartype.encoding == DW_ATE_float:
+        return {4: "f", 8: "d"}.get(vartype.size)
+    fmt = _intFormats.get(vartype.size)
+    if fmt is not None and not vartype.isSigned():
+        fmt = fmt.upper()
+    return fmt
+
+def _bitField(member):
+    '''Return a StructLayout member function decoding a bit field.'''
+    unit = struct.Struct(TARGET_ENDIAN + _intFormats[member.type.size].upper())
+    mask = (1 << member.bitSize) - 1
+    sign = 1 << (member.bitSize - 1) if member.type.isSigned() else 0
+    def fn(values, data, base):
+        value = unit.unpack_from(data, base + member.offset)[0]
+        value = (value >> member.bitShift) & mask
+        if value & sign:
+            value -= mask + 1
+        return value
+    return fn
+
+_exprRe = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*(?:\[\s*(-?\w*)\s*(:?)\s*(-?\w*)\s*\])?\s*$")
+
+def parseExpression(expr):
+    '''
+    Split 'name', 'name[i]' or 'name[start:stop]' into (name, index) where
+    index is None, an int, or a slice object.  Returns None if expr doesn't
+    parse.
+    '''
+    m = _exprRe.match(expr)
+    if not m:
+        return None
+    (name, start, colon, stop) = m.groups()
+    try:
+        start = int(start, 0) if start else None
+        stop = int(stop, 0) if stop else None
+    except ValueError:
+        return None
+    if colon:
+        return (name, slice(start, stop))
+    if start is None:
+        return (name, None)
+    return (name, start)
+
+def elementRange(layout, index):
+    '''Return (byte offset, byte length, single) of the elements selected by
+    index in layout, or None if index is out of range.'''
+    if index is None:
+        return (0, layout.size, False)
+    if isinstance(index, slice):
+        (start, stop, _) = index.indices(layout.count)
+        if stop <= start:
+            return None
+        return (start * layout.elementSize, (stop - start) * layout.elementSize,
+                False)
+    if index < 0:
+        index += layout.count
+    if not 0 <= index < layout.count:
+        return None
+    return (index * layout.elementSize, layout.elementSize, True)
+
+def formatValue(value):
+    '''Render a decoded value for display.'''
+    if isinstance(value, StructValue):
+        return "{%s}" % ", ".join([("%s = %s" % (name, formatValue(x)))
+                                   if name else formatValue(x)
+                                   for (name, x) in value])
+    if isinstance(value, RawBytes):
+        return "<%s not decoded> %s" % (value.what,
+                                        " ".join(["%02X" % ord(c)
+                                                  for c in value]))
+    if isinstance(value, str):
+        return '"%s"' % value.encode("string_escape")
+    if isinstance(value, list):
+        return "{%s}" % ", ".join([formatValue(x) for x in value])
+    return str(value)
@@ -0,0 +1,36 @@
+import time
+
+from mdb.startup import profile
+
+class JavaClassGroup:
+    '''
+    A set of Java classes imported together on first use.
+
+    Attribute access loads every class in the group, so one subsystem (the
+    loader, the disassembler, ...) costs nothing until something touches it.
+    Load times are recorded in the start-up profile.
+
+        jloader = JavaClassGroup("loader",
+                                 Loader="com.microchip.mplab.mdbcore.loader.Loader")
+        jloader.Loader # imported here
+    '''
+    def __init__(self, name, **classes):
+        self._name = name
+        self._classes = classes
+        self._loaded = False
+
+    def _load(self):
+        start = time.time()
+        for (alias, path) in self._classes.iteritems():
+            (package, cls) = path.rsplit(".", 1)
+            module = __import__(package, globals(), locals(), [cls])
+            setattr(self, alias, getattr(module, cls))
+        self._loaded = True
+        profile.record("load %s classes" % self._name, time.time() - start)
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set yet.
+        if name.startswith("_") or self._loaded or name not in self._classes:
+            raise AttributeError(name)
+        self._load()
+        return getattr(self, name)
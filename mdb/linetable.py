@@ -0,0 +1,123 @@
+import array
+import bisect
+
+class LineTable:
+    '''
+    In-memory address <-> source line index.
+
+    Rows are held in compact parallel arrays.  The address-ordered arrays
+    answer address->file:line with one binary search, and a per-file pair of
+    line-ordered arrays answers file:line->next breakable address the same
+    way.  Add rows with addRow(), then call finalize() before querying.
+    '''
+    # How far past the requested line to look for code, in lines.
+    LINE_SEARCH_WINDOW = 20
+
+    def __init__(self):
+        self.filenames = []
+        self._fileIndex = {}
+        self._rows = []
+        self._addrs = array.array('L')
+        self._ends = array.array('L')
+        self._files = array.array('H')
+        self._lines = array.array('L')
+        self._byFile = {}
+
+    def _indexForFile(self, path):
+        idx = self._fileIndex.get(path)
+        if idx is None:
+            idx = len(self.filenames)
+            self.filenames.append(path)
+            self._fileIndex[path] = idx
+        return idx
+
+    def addRow(self, addr, path, line, endaddr=None):
+        '''Record that source line path:line starts at addr.  endaddr, if
+        known, is the first address past the line's code.'''
+        if endaddr is None:
+            endaddr = 0
+        self._rows.append((addr, self._indexForFile(path), line, endaddr))
+
+    def finalize(self):
+        '''Sort collected rows into the lookup arrays.'''
+        self._rows.sort()
+        self._addrs = array.array('L')
+        self._ends = array.array('L')
+        self._files = array.array('H')
+        self._lines = array.array('L')
+        byFile = {}
+        lastAddr = None
+        for (addr, fidx, line, endaddr) in self._rows:
+            # Several lines can share an address; the lowest line wins, as
+            # that's where the statement starts.
+            if addr != lastAddr:
+                self._addrs.append(addr)
+                self._ends.append(endaddr)
+                self._files.append(fidx)
+                self._lines.append(line)
+                lastAddr = addr
+            byFile.setdefault(fidx, {}).setdefault(line, addr)
+        self._byFile = {}
+        for fidx, lines in byFile.iteritems():
+            keys = sorted(lines.keys())
+            self._byFile[fidx] = (array.array('L', keys),
+                                  array.array('L', [lines[k] for k in keys]))
+
+    def rows(self):
+        '''Return every row as (addr, path, line, endaddr), sorted by address.
+        Feeding them back through addRow() rebuilds the same table.'''
+        return [(addr, self.filenames[fidx], line, endaddr)
+                for (addr, fidx, line, endaddr) in self._rows]
+
+    def __len__(self):
+        return len(self._addrs)
+
+    def hasFile(self, path):
+        return path in self._fileIndex
+
+    def addressToSourceLine(self, addr):
+        '''Return (absolute path, line) of the code containing addr, or None if
+        addr isn't covered by the table.  A row without an end address
+        reaches to the next row; past the last row, only the row's own
+        address is known to be covered.'''
+        i = bisect.bisect_right(self._addrs, addr) - 1
+        if i < 0:
+            return None
+        end = self._ends[i]
+        if end:
+            if addr >= end:
+                return None
+        elif i + 1 < len(self._addrs):
+            if addr >= self._addrs[i + 1]:
+                return None
+        elif addr != self._addrs[i]:
+            return None
+        return (self.filenames[self._files[i]], self._lines[i])
+
+    def addressAfter(self, addr):
+        '''Return the start address of the first row above addr, or None.'''
+        i = bisect.bisect_right(self._addrs, addr)
+        if i >= len(self._addrs):
+            return None
+        return self._addrs[i]
+
+    def sourceLineToAddress(self, path, line, window=None):
+        '''Return the address of the first line with code at or after
+        path:line, searching at most window lines ahead, or None.'''
+        if window is None:
+            window = self.LINE_SEARCH_WINDOW
+        fidx = self._fileIndex.get(path)
+        if fidx is None or fidx not in self._byFile:
+            return None
+        (lines, addrs) = self._byFile[fidx]
+        i = bisect.bisect_left(lines, line)
+        if i >= len(lines) or lines[i] >= line + window:
+            return None
+        return addrs[i]
+
+    def linesInFile(self, path):
+        '''Return the sorted array of lines with code in path.'''
+        fidx = self._fileIndex.get(path)
+        if fidx is None or fidx not in self._byFile:
+            return array.array('L')
+        return self._byFile[fidx][0]
@@ -0,0 +1,253 @@
+'''
+Logging of variables from a running target.
+
+A LiveLog samples a set of symbols at a fixed interval on a worker thread,
+without halting the target and while the prompt stays usable.  Symbols
+close together in memory are read in one transfer, through the same data
+memory path as 'print', and rows are buffered and written to the file in
+blocks.
+
+Sampling keeps to the schedule.  A sample taken late counts towards the
+drift figures; slots that went by while a sample was late are skipped and
+counted as missed, not made up.  Samples whose reads fail are dropped and
+counted too.
+
+Files ending in .csv get a header, then a time column and one column per
+value (one per element for arrays).  Any other file gets compact binary
+records of the raw memory:
+
+    header:  MAGIC, interval and start time (doubles), symbol count,
+             then per symbol: name length, name, address, length
+    record:  time since start (double), each symbol's bytes in order
+
+All little-endian; readLog() reads them back.
+'''
+
+import csv
+import time
+import struct
+import threading
+
+from mdb.condition import planReads
+from mdb.layout import ArrayLayout, StructValue, parseExpression, formatValue
+
+MAGIC = "PICDBLG\x01"
+_header = struct.Struct("<ddI")
+_symbol = struct.Struct("<II")
+
+class LogError(Exception):
+    pass
+
+class _CsvSink:
+    def __init__(self, path, symbols):
+        self._file = open(path, "wb")
+        self._writer = csv.writer(self._file)
+        row = ["time"]
+        self._expand = []
+        for (name, addr, length, layout, single) in symbols:
+            expand = isinstance(layout, ArrayLayout) and not single
+            self._expand.append(expand)
+            if expand:
+                # A column per element, named by its index in the array
+                (base, index) = parseExpression(name)
+                first = 0
+                if isinstance(index, slice):
+                    first = index.indices(layout.count)[0]
+                row.extend(["%s[%d]" % (base, first + i)
+                            for i in range(length // layout.elementSize)])
+            else:
+                row.append(name)
+        self._writer.writerow(row)
+        self._layouts = [(x[3], x[4]) for x in symbols]
+
+    def write(self, rows):
+        out = []
+        for (t, chunks) in rows:
+            row = ["%.6f" % t]
+            for (data, (layout, single), expand) in \
+                    zip(chunks, self._layouts, self._expand):
+                value = layout.decode(data)
+                if expand:
+                    row.extend(value)
+                else:
+                    if single and isinstance(value, list):
+                        value = value[0]
+                    if isinstance(value, (StructValue, list)):
+                        value = formatValue(value)
+                    row.append(value)
+            out.append(row)
+        self._writer.writerows(out)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class _BinarySink:
+    def __init__(self, path, symbols, interval, start):
+        self._file = open(path, "wb")
+        header = [MAGIC, _header.pack(interval, start, len(symbols))]
+        for (name, addr, length, layout, single) in symbols:
+            header.append(struct.pack("<H", len(name)) + name)
+            header.append(_symbol.pack(addr, length))
+        self._file.write("".join(header))
+
+    def write(self, rows):
+        self._file.write("".join([struct.pack("<d", t) + "".join(chunks)
+                                  for (t, chunks) in rows]))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def readLog(path):
+    '''
+    Read a binary log.  Returns (header, rows): header has "interval",
+    "start" and "symbols", a list of (name, address, length); rows are
+    (time since start, [bytes per symbol]).  Raises LogError.
+    '''
+    f = open(path, "rb")
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if data[:len(MAGIC)] != MAGIC:
+        raise LogError("%s is not a picdb log file" % path)
+    try:
+        pos = len(MAGIC)
+        (interval, start, count) = _header.unpack_from(data, pos)
+        pos += _header.size
+        symbols = []
+        for i in range(count):
+            (n,) = struct.unpack_from("<H", data, pos)
+            name = data[pos+2:pos+2+n]
+            pos += 2 + n
+            (addr, length) = _symbol.unpack_from(data, pos)
+            pos += _symbol.size
+            symbols.append((name, addr, length))
+    except struct.error:
+        raise LogError("%s is truncated" % path)
+    size = 8 + sum([x[2] for x in symbols])
+    rows = []
+    while pos + size <= len(data):
+        (t,) = struct.unpack_from("<d", data, pos)
+        pos += 8
+        chunks = []
+        for (name, addr, length) in symbols:
+            chunks.append(data[pos:pos+length])
+            pos += length
+        rows.append((t, chunks))
+    return ({"interval": interval, "start": start, "symbols": symbols}, rows)
+
+class LiveLog:
+    '''
+    Samples symbols to a file every interval seconds.  symbols is a list of
+    (name, address, length, layout, single), as picdebugger resolves them;
+    read(addr, length) must return target memory as a string, or None.
+    Raises IOError if the file can't be created.
+    '''
+    # Symbols closer together than this are fetched in one read.
+    MERGE_GAP = 32
+    # Rows buffered before a write to the file.
+    BLOCK = 256
+
+    def __init__(self, symbols, interval, path, read):
+        self.names = [x[0] for x in symbols]
+        self.interval = interval
+        self.path = path
+        self._read = read
+        (self.ranges, self._slots) = planReads([x[1:] for x in symbols],
+                                               self.MERGE_GAP)
+        self.start = time.time()
+        if path.lower().endswith(".csv"):
+            self._sink = _CsvSink(path, symbols)
+        else:
+            self._sink = _BinarySink(path, symbols, interval, self.start)
+        self._rows = []
+        self.samples = 0
+        self.missed = 0
+        self.failed = 0
+        self.totalDrift = 0.0
+        self.maxDrift = 0.0
+        self.elapsed = 0.0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="picdb log %s" % path)
+        self._thread.setDaemon(True)
+
+    def begin(self):
+        self._thread.start()
+
+    def running(self):
+        return self._thread.isAlive()
+
+    def stop(self):
+        '''Stop sampling, and write out what is buffered.'''
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        interval = self.interval
+        due = self.start
+        try:
+            try:
+                while not self._stop.isSet():
+                    now = time.time()
+                    if due > now:
+                        self._stop.wait(due - now)
+                        continue
+                    self._sample(now, due)
+                    due += interval
+                    behind = int((time.time() - due) / interval)
+                    if behind > 0:
+                        self.missed += behind
+                        due += behind * interval
+            finally:
+                self.elapsed = time.time() - self.start
+                self._flush()
+                self._sink.close()
+        except Exception, e:
+            self.error = str(e)
+
+    def _sample(self, now, due):
+        blobs = []
+        for (addr, length) in self.ranges:
+            data = self._read(addr, length)
+            if data is None or len(data) < length:
+                self.failed += 1
+                return
+            blobs.append(data)
+        drift = now - due
+        self.totalDrift += drift
+        if drift > self.maxDrift:
+            self.maxDrift = drift
+        self._rows.append((now - self.start,
+                           [blobs[i][offset:offset+length] for
+                            (i, offset, length, _, _) in self._slots]))
+        self.samples += 1
+        if len(self._rows) >= self.BLOCK:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            self._sink.write(rows)
+
+    def report(self):
+        '''Return a summary as a list of lines.'''
+        elapsed = self.elapsed if not self.running() else \
+            time.time() - self.start
+        rate = self.samples / elapsed if elapsed else 0.0
+        out = ["%s: %s every %gms, %d read%s per sample" %
+               (self.path, ", ".join(self.names), self.interval * 1000.0,
+                len(self.ranges), "s" if len(self.ranges) > 1 else ""),
+               "%d samples in %.2fs (%.1f Hz), %d missed, %d failed reads" %
+               (self.samples, elapsed, rate, self.missed, self.failed)]
+        if self.samples:
+            out.append("Drift: %.3f ms mean, %.3f ms max" %
+                       (self.totalDrift * 1000.0 / self.samples,
+                        self.maxDrift * 1000.0))
+        if self.error is not None:
+            out.append("Stopped by error: %s" % self.error)
+        return out
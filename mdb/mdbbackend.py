@@ -0,0 +1,369 @@
+import struct
+import jarray
+import java.lang.System as System
+from java.lang import Exception as JavaException
+import com.microchip.mplab.util.observers
+
+from mdb.lazyjava import JavaClassGroup
+from mdb.backend import Backend, BackendError, PIC32_REGISTERS
+
+System.setProperty("crownking.stream.verbosity", "quiet")
+
+# mdbcore classes, grouped by subsystem and imported on first use so that
+# start-up only pays for what a session actually touches.
+MDBCORE = "com.microchip.mplab.mdbcore."
+jconnection = JavaClassGroup("connection",
+    MPLABCommProvider="com.microchip.mplab.comm.MPLABCommProvider",
+    MCAssemblyFactory=MDBCORE + "assemblies.assemblyfactory.MCAssemblyFactory",
+    PlatformToolMetaManager=MDBCORE + "platformtool.PlatformToolMetaManager")
+jdebugger = JavaClassGroup("debugger",
+    Debugger=MDBCORE + "debugger.Debugger",
+    DebugException=MDBCORE + "debugger.DebugException",
+    ToolEvent=MDBCORE + "debugger.ToolEvent")
+jloader = JavaClassGroup("loader",
+    Loader=MDBCORE + "loader.Loader",
+    LoadException=MDBCORE + "loader.LoadException",
+    ProgramFileParsingException=MDBCORE + "objectfileparsing.exception.ProgramFileParsingException",
+    Dwarf=MDBCORE + "objectfileparsing.Dwarf",
+    MDBFileMagic=MDBCORE + "objectfileparsing.MDBFileMagic")
+jtranslator = JavaClassGroup("translator",
+    ITranslator=MDBCORE + "translator.interfaces.ITranslator",
+    TranslatorException=MDBCORE + "translator.exceptions.TranslatorException")
+jdisasm = JavaClassGroup("disassembler",
+    DisAsm=MDBCORE + "disasm.DisAsm")
+jmemory = JavaClassGroup("memory",
+    ProgramMemory=MDBCORE + "memory.memorytypes.ProgramMemory",
+    FileRegisters=MDBCORE + "memory.memorytypes.FileRegisters")
+jregisters = JavaClassGroup("registers",
+    CPURegisters=MDBCORE + "memory.memorytypes.CPURegisters")
+jcontrolpoints = JavaClassGroup("control point",
+    BreakType=MDBCORE + "ControlPointMediator.ControlPoint.BreakType",
+    ControlPointMediator=MDBCORE + "ControlPointMediator.ControlPointMediator")
+jsymbolview = JavaClassGroup("symbol view",
+    SymbolViewProvider=MDBCORE + "symbolview.interfaces.SymbolViewProvider",
+    VarType=MDBCORE + "common.debug.SymbolType.eFundamentalType")
+
+class _ToolObserver(com.microchip.mplab.util.observers.Observer):
+    '''Turns mdbcore tool events into Backend events for a listener.'''
+    def __init__(self, listener):
+        self._listener = listener
+
+    def Update(self, obj):
+        if obj.GetEvent() == jdebugger.ToolEvent.EVENTS.HALT:
+            self._listener(Backend.HALT)
+        elif obj.GetEvent() == jdebugger.ToolEvent.EVENTS.RUN:
+            self._listener(Backend.RUN)
+
+class MdbBackend(Backend):
+    '''Backend for real debug tools, through Microchip's mdbcore.'''
+    def __init__(self):
+        self.mdb = None
+        self.assembly = None
+        self.translator = None
+        self.disassembler = None
+        self.mem = None
+        self._batching = False
+        self._batchStore = None
+
+    def _lookup(self, cls):
+        return self.assembly.getLookup().lookup(cls)
+
+    def selectDevice(self, device):
+        # Register PIC target device
+        self.factory = jconnection.MCAssemblyFactory()
+        self.assembly = self.factory.Create(device)
+        self.provider = jconnection.MPLABCommProvider()
+
+    def enumerateDevices(self):
+        # Enumerate USB debuggers
+        try:
+            return list(self.provider.GetCurrentToolList(None, "USB", "04D8", None) or [])
+        except jdebugger.DebugException:
+            raise BackendError("Failed to enumerate USB devices.")
+
+    def describeTool(self, tool):
+        fields = tool.split(":=")
+        if len(fields) > 6:
+            return fields[6]
+        return tool
+
+    def selectDebugger(self, tool):
+        alltools = jconnection.PlatformToolMetaManager.getAllTools()
+        # Name mangling, because they report stupid strings
+        devname = tool.split(":=")[6] # name is 6th entry in device string
+        if devname.find("PICkit") == 0:
+            devname = devname.replace(" ", "") # damn tools report the wrong name
+        elif devname.lower().find("real ice") >= 0:
+            devname = "Real ICE"
+        platformTool = [x for x in alltools if x.getName() == devname][0]
+        self.factory.ChangeTool(self.assembly,
+                                platformTool.getConfigurationObjectID(),
+                                platformTool.getClassName(),
+                                platformTool.getFlavor(),
+                                tool)
+        self.factory.SetToolProperties(self.assembly,None)
+
+    def connect(self, listener):
+        # Connect to debugger
+        self.assembly.SetHeader("");
+        self.mdb = self._lookup(jdebugger.Debugger)
+        self._observer = _ToolObserver(listener)
+        try:
+            self.mdb.Attach(self._observer, None)
+            self.mdb.Connect(jdebugger.Debugger.CONNECTION_TYPE.DEBUGGER)
+        except jdebugger.DebugException:
+            raise BackendError("Failed to connect to debugger.")
+
+    def disconnect(self):
+        if self.mdb:
+            self.mdb.Disconnect()
+
+    def deviceFamily(self):
+        return self.assembly.GetDevice().getSubFamily()
+
+    def load(self, path):
+        # Load ELF file into the assembly's image of the target
+        self.loader = self._lookup(jloader.Loader)
+        try:
+            self.loader.Load(path)
+        except jdebugger.DebugException:
+            raise BackendError("Failed to load ELF onto target.")
+        except jloader.LoadException:
+            raise BackendError("File not found.")
+        self.mem = self._lookup(jmemory.ProgramMemory).GetVirtualMemory()
+        self.translator = self._lookup(jtranslator.ITranslator)
+        self.disassembler = self._lookup(jdisasm.DisAsm)
+
+    def program(self):
+        try:
+            self.mdb.Program(jdebugger.Debugger.PROGRAM_OPERATION.AUTO_SELECT)
+        except jdebugger.DebugException:
+            raise BackendError("Failed to load ELF onto target.")
+
+    def sourceFiles(self, path):
+        # Get ELF parser to find filenames and paths
+        self.file_magic = jloader.MDBFileMagic(path)
+        self.dwarf = jloader.Dwarf(self.file_magic)
+        self.comp_units = self.dwarf.getCompilationUnits()
+        return [x.getSourceFileAbsolutePath() for x in self.comp_units]
+
+    def _runControl(self, fn):
+        try:
+            fn()
+        except jdebugger.DebugException:
+            raise BackendError("Lost communication with debugger or target!")
+
+    def run(self):
+        self._runControl(self.mdb.Run)
+
+    def halt(self):
+        self._runControl(self.mdb.Halt)
+
+    def stepIn(self):
+        self._runControl(self.mdb.StepIn)
+
+    def stepOver(self):
+        self._runControl(self.mdb.StepOver)
+
+    def stepInstr(self):
+        self._runControl(self.mdb.StepInstr)
+
+    def reset(self):
+        # Reset to main
+        self._runControl(lambda: self.mdb.Reset(True))
+
+    def getPC(self):
+        return self.mdb.GetPC()
+
+    def _registerMemory(self):
+        '''Return the tool's CPU register memory.  Raises BackendError if
+        this mdbcore or tool has none.'''
+        try:
+            registers = self._lookup(jregisters.CPURegisters)
+        except ImportError:
+            raise BackendError("This mdbcore has no CPU register access.")
+        if registers is None:
+            raise BackendError("The debug tool gives no access to the CPU "
+                               "registers.")
+        return registers.GetVirtualMemory()
+
+    def readRegisters(self):
+        # The whole register file, GPRs, PC, HI/LO and the CP0 registers,
+        # is one block of register memory in PIC32_REGISTERS order, so it
+        # comes in one transfer, PC included.
+        size = 4 * len(PIC32_REGISTERS)
+        data = self._read(self._registerMemory(), 0, size)
+        if data is None:
+            raise BackendError("Could not read the CPU registers.")
+        return zip(PIC32_REGISTERS,
+                   struct.unpack("<%dI" % len(PIC32_REGISTERS), data))
+
+    def _read(self, mem, addr, length):
+        data = jarray.zeros(length, "b")
+        mem.RefreshFromTarget(addr, length)
+        if mem.Read(addr, length, data) == length:
+            return data.tostring()
+        return None
+
+    def readMemory(self, addr, length, virtual):
+        fr = self._lookup(jmemory.FileRegisters)
+        if virtual:
+            mem = fr.GetVirtualMemory()
+        else:
+            mem = fr.GetPhysicalMemory()
+        return self._read(mem, addr, length)
+
+    def readProgramMemory(self, addr, length):
+        return self._read(self.mem, addr, length)
+
+    def readProgramWord(self, addr):
+        return self.mem.ReadWord(addr)
+
+    def sourceLineToAddress(self, path, line):
+        try:
+            info = self.translator.sourceLineToAddress(path, line)
+        except jtranslator.TranslatorException:
+            return None
+        if not info:
+            return None
+        # The translator only gives where the line starts; picdebugger
+        # closes the range at the function's end.
+        return (info.lStartAddr, None)
+
+    def addressToSourceLine(self, addr):
+        try:
+            info = self.translator.addressToSourceLine(addr)
+        except jtranslator.TranslatorException:
+            return None
+        return (info.file, info.lLine)
+
+    def lineInstructions(self, addr):
+        try:
+            lines = self.translator.sourceLinesFromAddress(addr, True)
+        except jtranslator.TranslatorException:
+            return None
+        return [(sl.Address(), sl.AddressIncrement()) for sl in lines.result]
+
+    def disassemble(self, word, nextword, addr):
+        ins = self.disassembler.Disassemble(word, nextword, addr,
+                                            jdisasm.DisAsm.OPTIONS.FULL_SYMBOLS,
+                                            None)
+        return ins.instruction
+
+    def rawSymbol(self, name):
+        sv = self._lookup(jsymbolview.SymbolViewProvider)
+        return sv.getRawSymbol(name)
+
+    def typeEnum(self):
+        return jsymbolview.VarType
+
+    # Every change to control points goes through a writable store, which
+    # is a round trip to the tool when committed.  A batch opens one store
+    # at its first change and keeps it for the rest; the store is released
+    # at commit, so none is held while the target runs.
+    def _store(self):
+        if self._batchStore is not None:
+            return self._batchStore
+        self.cpm = self._lookup(jcontrolpoints.ControlPointMediator)
+        wcps = self.cpm.getWritableControlPointStore()
+        if self._batching:
+            self._batchStore = wcps
+        return wcps
+
+    def _release(self, wcps):
+        if wcps is not self._batchStore:
+            self.cpm.commitAndReleaseWritableControlPointStore(wcps)
+
+    def beginBreakpoints(self):
+        self._batching = True
+
+    def commitBreakpoints(self):
+        wcps = self._batchStore
+        self._batching = False
+        self._batchStore = None
+        if wcps is not None:
+            self.cpm.commitAndReleaseWritableControlPointStore(wcps)
+
+    def availableBreakpoints(self):
+        wcps = self._store()
+        try:
+            return wcps.getNumberAvailableProgramControlPoints()
+        finally:
+            self._release(wcps)
+
+    def addBreakpoint(self, addr, file, line):
+        wcps = self._store()
+        bp = None
+        if wcps.getNumberAvailableProgramControlPoints() > 0:
+            bp = wcps.getNewControlPoint()
+            bp.setBreakType(jcontrolpoints.BreakType.PROGRAM)
+            bp.setBreakAddress(addr)
+            bp.setEnabled(True)
+            bp.setFileNameAndLine(file, line)
+        self._release(wcps)
+        return bp
+
+    def _removeControlPoint(self, wcps, cp):
+        '''Delete cp from the store, freeing its slot.  Raises BackendError
+        if the tool won't.'''
+        try:
+            wcps.removeControlPoint(cp)
+        except (AttributeError, JavaException), e:
+            raise BackendError("Could not remove control point: %s" % e)
+
+    def removeBreakpoint(self, handle):
+        wcps = self._store()
+        try:
+            self._removeControlPoint(wcps, handle)
+        finally:
+            self._release(wcps)
+
+    def enableBreakpoint(self, handle, enabled):
+        wcps = self._store()
+        try:
+            handle.setEnabled(enabled)
+        finally:
+            self._release(wcps)
+
+    # Data control points: BreakType.DATA, with the access to break on and
+    # the width of the watched memory.  mdbcore builds from before data
+    # breakpoints were supported lack these; on those tools the calls raise
+    # AttributeError, which is reported as having no data breakpoint slots,
+    # and 'watch' falls back to single-stepping.
+    _DATA_ACCESS = {
+        Backend.WRITE: lambda cp: cp.setDataBreakOnWrite(True),
+        Backend.READ: lambda cp: cp.setDataBreakOnRead(True),
+        Backend.ACCESS: lambda cp: cp.setDataBreakOnReadWrite(True),
+        }
+
+    def availableDataBreakpoints(self):
+        wcps = self._store()
+        try:
+            return wcps.getNumberAvailableDataControlPoints()
+        except AttributeError:
+            return 0
+        finally:
+            self._release(wcps)
+
+    def addDataBreakpoint(self, addr, length, access):
+        wcps = self._store()
+        try:
+            try:
+                if wcps.getNumberAvailableDataControlPoints() <= 0:
+                    return None
+            except AttributeError:
+                return None
+            cp = wcps.getNewControlPoint()
+            try:
+                cp.setBreakType(jcontrolpoints.BreakType.DATA)
+                cp.setBreakAddress(addr)
+                self._DATA_ACCESS[access](cp)
+                cp.setDataLength(length)
+                cp.setEnabled(True)
+            except AttributeError:
+                # Don't commit a half-configured control point.
+                self._removeControlPoint(wcps, cp)
+                return None
+            return cp
+        finally:
+            self._release(wcps)
@@ -0,0 +1,151 @@
+import threading
+
+class MemoryCache:
+    '''
+    Page-granular read cache for target memory.
+
+    fetch(addr, length, virtual) must read length bytes of target memory and
+    return them as a string, or None on failure.  Reads are rounded out to
+    whole pages; runs of consecutive missing pages are fetched in a single
+    transfer.  Pages are evicted least-recently-used first.
+
+    The cache knows nothing about the target running, so the owner has to
+    call invalidate() whenever target memory may have changed.  That may be
+    done from another thread, such as the debugger's event thread.
+
+    uncached is a list of (start, length) address ranges, such as
+    peripheral registers, where reads have side effects or values change
+    by themselves.  Reads touching them fetch exactly the bytes asked for,
+    every time.
+    '''
+    PAGE_SIZE = 256
+    MAX_PAGES = 256
+    # Missing runs separated by at most this many cached pages are fetched
+    # as one transfer; re-reading a page is cheaper than another round trip.
+    MERGE_GAP = 2
+
+    def __init__(self, fetch, pageSize=PAGE_SIZE, maxPages=MAX_PAGES,
+                 uncached=()):
+        self._fetch = fetch
+        self.pageSize = pageSize
+        self.maxPages = maxPages
+        self._uncached = list(uncached)
+        self._pages = {}
+        self._lastUse = {}
+        self._clock = 0
+        self.transfers = 0
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        '''Drop every cached page.'''
+        self._lock.acquire()
+        try:
+            self._pages = {}
+            self._lastUse = {}
+        finally:
+            self._lock.release()
+
+    def _isUncached(self, addr, length):
+        for (start, size) in self._uncached:
+            if addr < start + size and start < addr + length:
+                return True
+        return False
+
+    def _pageRange(self, addr, length):
+        first = addr - (addr % self.pageSize)
+        last = (addr + length - 1) - ((addr + length - 1) % self.pageSize)
+        return range(first, last + 1, self.pageSize)
+
+    def _touch(self, key):
+        self._clock += 1
+        self._lastUse[key] = self._clock
+
+    def _evict(self):
+        excess = len(self._pages) - self.maxPages
+        if excess <= 0:
+            return
+        oldest = sorted(self._lastUse.iteritems(), key=lambda x: x[1])
+        for (key, _) in oldest[:excess]:
+            del self._pages[key]
+            del self._lastUse[key]
+
+    def _fetchRun(self, start, npages, virtual):
+        data = self._fetch(start, npages * self.pageSize, virtual)
+        self.transfers += 1
+        if data is None:
+            return False
+        for i in range(npages):
+            key = (virtual, start + i * self.pageSize)
+            self._pages[key] = data[i*self.pageSize:(i+1)*self.pageSize]
+            self._touch(key)
+        return True
+
+    def prefetch(self, ranges, virtual=False):
+        '''Make sure every (addr, length) in ranges is cached.  Missing pages
+        of all ranges are merged, so adjacent or overlapping ranges cost one
+        transfer.  Uncached ranges are skipped.  Returns False if any
+        transfer failed.'''
+        self._lock.acquire()
+        try:
+            return self._prefetch(ranges, virtual)
+        finally:
+            self._lock.release()
+
+    def _prefetch(self, ranges, virtual):
+        missing = set()
+        for (addr, length) in ranges:
+            if length <= 0 or self._isUncached(addr, length):
+                continue
+            for page in self._pageRange(addr, length):
+                if (virtual, page) in self._pages:
+                    # Keep wanted pages from being evicted below.
+                    self._touch((virtual, page))
+                else:
+                    missing.add(page)
+        ok = True
+        runStart = None
+        runLen = 0
+        for page in sorted(missing):
+            if runStart is not None:
+                gap = (page - (runStart + runLen * self.pageSize)) // self.pageSize
+                if gap <= self.MERGE_GAP:
+                    runLen += gap + 1
+                    continue
+            if runStart is not None:
+                ok = self._fetchRun(runStart, runLen, virtual) and ok
+            runStart = page
+            runLen = 1
+        if runStart is not None:
+            ok = self._fetchRun(runStart, runLen, virtual) and ok
+        self._evict()
+        return ok
+
+    def read(self, addr, length, virtual=False):
+        '''Return length bytes at addr as a string, or None on failure.'''
+        if length <= 0:
+            return ""
+        if self._isUncached(addr, length):
+            self.transfers += 1
+            return self._fetch(addr, length, virtual)
+        pages = self._pageRange(addr, length)
+        if len(pages) > self.maxPages:
+            # Too big to cache; don't flush everything else for it.
+            self.transfers += 1
+            return self._fetch(addr, length, virtual)
+        self._lock.acquire()
+        try:
+            if self._prefetch([(addr, length)], virtual):
+                chunks = []
+                for page in pages:
+                    key = (virtual, page)
+                    self._touch(key)
+                    chunks.append(self._pages[key])
+                data = "".join(chunks)
+                offset = addr - pages[0]
+                return data[offset:offset+length]
+        finally:
+            self._lock.release()
+        # Rounding out to whole pages may have reached memory that can't be
+        # read, such as the unmapped space past the end of a region.
+        self.transfers += 1
+        return self._fetch(addr, length, virtual)
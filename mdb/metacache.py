@@ -0,0 +1,219 @@
+'''
+On-disk cache of what load() learns from an ELF file: compilation unit
+paths, the line table, the symbol table and symbol-view type info.  Lets a
+later session on the same image start without parsing DWARF.
+
+The file lives next to the ELF.  It is a fixed header, a section table, and
+sections holding little-endian arrays at 8-byte aligned offsets, so it can
+be read with one mmap and array.fromstring() per section:
+
+    header:   magic, mtime, size, sha1 of ELF, type enum signature,
+              section count
+    sections: (tag, offset, length) each
+
+Symbol types are stored as the backend's type codes, which only mean
+something to the type enum they came from, so that enum's signature is part
+of the key: a cache written through one backend is not used by another
+whose codes differ.
+'''
+
+import os
+import sys
+import array
+import struct
+import hashlib
+try:
+    import mmap
+except ImportError:
+    mmap = None # not available under Jython
+
+from mdb.linetable import LineTable
+from mdb.symbols import Symbol, SymbolIndex
+
+MAGIC = "PICDBMC\x03"
+_header = struct.Struct("<8sqQ20s20sI")
+_section = struct.Struct("<4sQQ")
+_kinds = [Symbol.FUNCTION, Symbol.OBJECT, Symbol.OTHER]
+
+def cachePath(elfpath):
+    return elfpath + ".picdb-cache"
+
+def typeSignature(typeEnum):
+    '''Return a sha1 of the ST_* names and codes of a backend's type enum.'''
+    h = hashlib.sha1()
+    for name in sorted(dir(typeEnum)):
+        if name.startswith("ST_"):
+            h.update("%s=%d;" % (name, getattr(typeEnum, name).value()))
+    return h.digest()
+
+def fingerprint(elfpath, typeEnum):
+    '''Return (mtime, size, sha1, type signature) identifying the contents
+    of elfpath and what its cached symbol types mean.'''
+    st = os.stat(elfpath)
+    h = hashlib.sha1()
+    f = open(elfpath, "rb")
+    try:
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                break
+            h.update(chunk)
+    finally:
+        f.close()
+    return (int(st.st_mtime), st.st_size, h.digest(),
+            typeSignature(typeEnum))
+
+class SymbolInfo:
+    '''Stand-in for the symbol view's raw symbol info, restored from cache.'''
+    def __init__(self, address, vartype, length):
+        self._address = address
+        self._type = vartype
+        self._length = length
+
+    def Address(self):
+        return self._address
+
+    def Type(self):
+        return self._type
+
+    def ByteLength(self):
+        return self._length
+
+class Metadata:
+    def __init__(self, filenames, lineTable, symbols, symbolInfos):
+        self.filenames = filenames
+        self.lineTable = lineTable
+        self.symbols = symbols
+        # name -> object with Address()/Type()/ByteLength(), or None
+        self.symbolInfos = symbolInfos
+
+def _u32(values):
+    return array.array('I', values)
+
+def _toLittle(arr):
+    if sys.byteorder != "little":
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tostring()
+
+def _fromLittle(typecode, data):
+    arr = array.array(typecode)
+    arr.fromstring(data)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+def save(elfpath, fp, meta):
+    '''Write meta for the ELF identified by fp.  Failures are ignored; the
+    cache is only an optimization.'''
+    strings = []
+    stringIndex = {}
+    def intern(s):
+        if s not in stringIndex:
+            stringIndex[s] = len(strings)
+            strings.append(s)
+        return stringIndex[s]
+
+    rows = meta.lineTable.rows()
+    syms = meta.symbols.allSymbols()
+    infos = sorted([(k, v) for (k, v) in meta.symbolInfos.iteritems() if v])
+    sections = [
+        ("FILE", _u32([intern(x) for x in meta.filenames])),
+        ("LADR", _u32([x[0] for x in rows])),
+        ("LFIL", _u32([intern(x[1]) for x in rows])),
+        ("LLIN", _u32([x[2] for x in rows])),
+        ("LEND", _u32([x[3] for x in rows])),
+        ("SNAM", _u32([intern(x.name) for x in syms])),
+        ("SADR", _u32([x.address for x in syms])),
+        ("SSIZ", _u32([x.size for x in syms])),
+        ("SKND", array.array('B', [_kinds.index(x.kind) for x in syms])),
+        ("TNAM", _u32([intern(x[0]) for x in infos])),
+        ("TADR", _u32([x[1].Address() for x in infos])),
+        ("TTYP", _u32([x[1].Type() for x in infos])),
+        ("TLEN", _u32([x[1].ByteLength() for x in infos])),
+        ]
+    blobs = [("STRS", "\0".join(strings))]
+    blobs += [(tag, _toLittle(arr)) for (tag, arr) in sections]
+
+    offset = _header.size + _section.size * len(blobs)
+    table = []
+    for (tag, data) in blobs:
+        offset += -offset % 8
+        table.append((tag, offset, len(data)))
+        offset += len(data)
+    path = cachePath(elfpath)
+    tmp = path + ".tmp"
+    try:
+        f = open(tmp, "wb")
+        try:
+            f.write(_header.pack(MAGIC, fp[0], fp[1], fp[2], fp[3], len(blobs)))
+            for entry in table:
+                f.write(_section.pack(*entry))
+            pos = _header.size + _section.size * len(blobs)
+            for ((tag, data), (_, off, _)) in zip(blobs, table):
+                f.write("\0" * (off - pos))
+                f.write(data)
+                pos = off + len(data)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+def _mapFile(path):
+    f = open(path, "rb")
+    try:
+        if mmap is not None:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                pass
+        return f.read()
+    finally:
+        f.close()
+
+def load(elfpath, fp):
+    '''Return the cached Metadata for the ELF identified by fp, or None if
+    there is no valid cache for it.'''
+    try:
+        data = _mapFile(cachePath(elfpath))
+    except (IOError, OSError):
+        return None
+    try:
+        if len(data) < _header.size:
+            return None
+        (magic, mtime, size, sha, types, count) = _header.unpack_from(data, 0)
+        if magic != MAGIC or (mtime, size, sha, types) != fp:
+            return None
+        blobs = {}
+        for i in range(count):
+            (tag, off, length) = _section.unpack_from(
+                data, _header.size + i * _section.size)
+            blobs[tag] = data[off:off+length]
+    except struct.error:
+        return None
+    finally:
+        if mmap is not None and isinstance(data, mmap.mmap):
+            data.close()
+
+    for tag in ["STRS", "FILE", "LADR", "LFIL", "LLIN", "LEND", "SNAM", "SADR",
+                "SSIZ", "SKND", "TNAM", "TADR", "TTYP", "TLEN"]:
+        if tag not in blobs:
+            return None
+    strings = blobs["STRS"].split("\0")
+    arr = dict([(tag, _fromLittle('B' if tag == "SKND" else 'I', blob))
+                for (tag, blob) in blobs.iteritems() if tag != "STRS"])
+
+    filenames = [strings[i] for i in arr["FILE"]]
+    table = LineTable()
+    for (addr, fidx, line, end) in zip(arr["LADR"], arr["LFIL"], arr["LLIN"],
+                                       arr["LEND"]):
+        table.addRow(addr, strings[fidx], line, end)
+    table.finalize()
+    symbols = SymbolIndex([Symbol(strings[n], a, s, _kinds[k])
+                           for (n, a, s, k) in zip(arr["SNAM"], arr["SADR"],
+                                                   arr["SSIZ"], arr["SKND"])])
+    infos = {}
+    for (n, a, t, l) in zip(arr["TNAM"], arr["TADR"], arr["TTYP"], arr["TLEN"]):
+        infos[strings[n]] = SymbolInfo(a, t, l)
+    return Metadata(filenames, table, symbols, infos)
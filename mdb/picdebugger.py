@@ -2,293 +2,1021 @@ import os
 import sys
 import time
 import struct
-import jarray
-import java.lang.String
-import java.lang.System as System
-import com.microchip.mplab.util.observers
-import com.microchip.mplab.mdbcore.debugger.Debugger
-from com.microchip.mplab.comm import MPLABCommProvider
-from com.microchip.mplab.mdbcore.assemblies.assemblyfactory import MCAssemblyFactory
-from com.microchip.mplab.mdbcore.debugger import Debugger
-from com.microchip.mplab.mdbcore.debugger import DebugException
-from com.microchip.mplab.mdbcore.debugger import ToolEvent
-from com.microchip.mplab.mdbcore.loader import Loader
-from com.microchip.mplab.mdbcore.loader import LoadException
-from com.microchip.mplab.mdbcore.translator.interfaces import ITranslator
-from com.microchip.mplab.mdbcore.translator.exceptions import TranslatorException
-from com.microchip.mplab.mdbcore.disasm import DisAsm
-from com.microchip.mplab.mdbcore.memory.memorytypes import ProgramMemory
-from com.microchip.mplab.mdbcore.memory.memorytypes import FileRegisters
-from com.microchip.mplab.mdbcore.objectfileparsing.exception import ProgramFileParsingException
-from com.microchip.mplab.mdbcore.platformtool import PlatformToolMetaManager
-from com.microchip.mplab.mdbcore.symbolview.interfaces import SymbolViewProvider
-from com.microchip.mplab.mdbcore.common.debug.SymbolType import eFundamentalType as VarType
-from com.microchip.mplab.mdbcore.objectfileparsing import Dwarf
-from com.microchip.mplab.mdbcore.objectfileparsing import MDBFileMagic
-
-from com.microchip.mplab.mdbcore.ControlPointMediator.ControlPoint import BreakType
-from com.microchip.mplab.mdbcore.ControlPointMediator import ControlPointMediator
-
-System.setProperty("crownking.stream.verbosity", "quiet")
-
-class picdebugger(com.microchip.mplab.util.observers.Observer):
+import threading
+
+from mdb.backend import Backend, BackendError, PIC32_PERIPHERALS, \
+    PIC32_REGISTERS
+from mdb.linetable import LineTable
+from mdb.dwarfline import lineRows
+from mdb.dwarfinfo import variableTypes
+from mdb.memcache import MemoryCache
+from mdb.layout import LayoutCompiler, ScalarLayout, parseExpression, elementRange
+from mdb.symbols import Symbol, SymbolIndex
+from mdb.elf import ElfFile, ElfError
+from mdb.flashcache import FlashCache, imageDigest, differingRows
+from mdb.condition import Condition, ConditionError
+from mdb.disasm import Disassembler, memoryAccess
+from mdb.sources import SourceCache, PathIndex
+from mdb.core import writeCore, withoutRanges
+from mdb.instrument import Stats, InstrumentedBackend
+from mdb.breakpoints import Breakpoint, Watchpoint, BreakpointTable
+from mdb.livelog import LiveLog, LogError
+from mdb import metacache
+
+class picdebugger:
     class StepType:
         IN = 0
         OVER = 1
         INSTR = 2
     
-    def __init__(self):
-        self.mdb = None
-        self._breakpoints = []
+    # Granularity of the halt wait.  Bounds how long a cancelWait() or ^C
+    # can go unnoticed; the wait itself wakes as soon as HALT arrives.
+    HALT_WAIT_SLICE = 0.1
+
+    def __init__(self, backend=None):
+        if backend is None:
+            # Only real hardware needs Java, so import it on demand.
+            from mdb.mdbbackend import MdbBackend
+            backend = MdbBackend()
+        # Every backend call is timed; see 'stats'.
+        self.stats = Stats()
+        self.backend = InstrumentedBackend(backend, self.stats)
+        backend = self.backend
+        self.devices = []
+        self._breakpoints = BreakpointTable()
+        self._breakpointBatch = 0
         self.isHalted = True
+        self._haltEvent = threading.Event()
+        self._haltEvent.set()
+        self._waitCancelled = False
+        self.lineTable = LineTable()
+        # SFRs are read as asked, every time: see PIC32_PERIPHERALS.
+        self.memCache = MemoryCache(self._readTargetMemory,
+                                    uncached=PIC32_PERIPHERALS)
+        # The PC and register file of the current stop, read on first use
+        self._pc = None
+        self._pcSettled = False
+        self._registers = None
+        self.disasm = Disassembler(backend.readProgramWord,
+                                   backend.disassemble)
+        self._layouts = None
+        # name -> type of the loaded ELF's globals, from its debug
+        # information; read on first use
+        self._variableTypes = None
+        self.symbols = SymbolIndex()
+        self._rawSymbols = {}
+        self.flashCache = FlashCache()
+        self.deviceName = None
+        self.tool = None
+        self.filenames = []
+        self._paths = PathIndex()
+        self.sources = SourceCache()
+        self._elfFile = None
+        self._elfFingerprint = None
+        self._savedSymbolInfos = 0
+        self._listeners = []
+        # [(watchpoint, old bytes, new bytes)] for the last stop
+        self.watchHits = []
+        # The LiveLog sampling in the background, if any
+        self.liveLog = None
 
-    def Update(self, obj):
-        if obj.GetEvent() == ToolEvent.EVENTS.HALT:
+    def addListener(self, fn):
+        '''Call fn(event) with Backend.HALT or Backend.RUN after each target
+        event.  Called on the backend's thread.'''
+        self._listeners.append(fn)
+
+    def Update(self, event):
+        if event == Backend.HALT:
+            self.memCache.invalidate()
+            self._forgetRegisters()
             self.isHalted = True
-        elif obj.GetEvent() == ToolEvent.EVENTS.RUN:
+            self._haltEvent.set()
+        elif event == Backend.RUN:
             self.isHalted = False
+            self._haltEvent.clear()
+            self.memCache.invalidate()
+            self._forgetRegisters()
+        for fn in self._listeners:
+            fn(event)
 
-    def waitForHalt(self):
-        while not self.isHalted:
-            pass
+    def waitForHalt(self, timeout=None):
+        '''Block until the target halts.  Returns True if it halted, False if
+        the timeout expired or the wait was cancelled with cancelWait().'''
+        self._waitCancelled = False
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not self._haltEvent.isSet():
+            if self._waitCancelled:
+                return False
+            wait = self.HALT_WAIT_SLICE
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            self._haltEvent.wait(wait)
+        return True
+
+    def cancelWait(self):
+        '''Make a pending waitForHalt() return False.'''
+        self._waitCancelled = True
+
+    def waitForSettledPC(self, timeout=1.0, interval=0.005):
+        '''Read the PC until two consecutive reads agree, and return it.
+
+        Right after a HALT the debugger can report a stale PC.  Rather than
+        sleeping for a fixed time, poll with a growing interval and stop as
+        soon as the value is stable.  Gives up after timeout seconds and
+        returns the last value read.'''
+        deadline = time.time() + timeout
+        pc = self.backend.getPC()
+        while time.time() < deadline:
+            time.sleep(interval)
+            newpc = self.backend.getPC()
+            if newpc == pc:
+                break
+            pc = newpc
+            interval = min(interval * 2, 0.1)
+        self._forgetRegisters()
+        self._pc = pc
+        self._pcSettled = True
+        return pc
+
+    def settledPC(self):
+        '''Return the PC of the current stop, settled as by
+        waitForSettledPC() unless that has been done since the target
+        stopped.'''
+        if self._pcSettled and self.isHalted:
+            return self._pc
+        return self.waitForSettledPC()
+
+    def _forgetRegisters(self):
+        self._pc = None
+        self._pcSettled = False
+        self._registers = None
 
     def getPC(self):
-        return self.mdb.GetPC()
-        
+        '''Return the PC.  While the target is halted it is read once per
+        stop, or taken from the register snapshot.'''
+        if not self.isHalted:
+            return self.backend.getPC()
+        if self._pc is None:
+            self._pc = self.backend.getPC()
+        return self._pc
+
+    def registers(self):
+        '''
+        Return [(name, value)] for the CPU registers.  While the target is
+        halted they are read in one go on first use after each stop and kept
+        until it moves; while it runs they are read every time.
+        '''
+        if not self.isHalted:
+            return self.backend.readRegisters()
+        if self._registers is None:
+            self._registers = self.backend.readRegisters()
+            for (name, value) in self._registers:
+                if name == "pc":
+                    self._pc = value
+        return self._registers
+
+    def register(self, name):
+        '''Return the value of the named CPU register, or None.'''
+        name = name.lower()
+        if name == "pc":
+            return self.getPC()
+        for (reg, value) in self.registers():
+            if reg == name:
+                return value
+        return None
+
+    # How long a halt-sample-resume sample waits for the target to stop.
+    SAMPLE_HALT_TIMEOUT = 1.0
+
+    def samplePC(self):
+        '''Return the PC of the running target, or None if it couldn't be
+        read.  Read live if the tool can; otherwise the target is halted,
+        its PC read and the target resumed.'''
+        try:
+            if self.backend.canSamplePC():
+                return self.backend.samplePC()
+            if not self.halt() or \
+                    not self.waitForHalt(self.SAMPLE_HALT_TIMEOUT):
+                return None
+            pc = self.waitForSettledPC(timeout=0.05, interval=0.001)
+            self.run()
+            return pc
+        except BackendError, e:
+            print e
+            return None
+
     def selectDevice(self, devstr):
         # Register PIC target device
-        self.factory = MCAssemblyFactory()
-        self.assembly = self.factory.Create(devstr)
-        self.provider = MPLABCommProvider()
+        self.deviceName = devstr
+        self.backend.selectDevice(devstr)
 
     def enumerateDevices(self):
-        # Enumerate USB debuggers
         try:
-            self.devices = self.provider.GetCurrentToolList(None, "USB","04D8", None)
+            self.devices = self.backend.enumerateDevices()
             if not self.devices:
                 print "No USB debugger found."
-        except DebugException:
-            print "Failed to enumerate USB devices."
+        except BackendError, e:
+            print e
             return False
         return True
 
     def run(self):
-        self.mdb.Run()
+        # Clear before starting so a waitForHalt() issued before the RUN
+        # event arrives doesn't see the previous halt.
+        self.isHalted = False
+        self._haltEvent.clear()
+        self.memCache.invalidate()
+        self._forgetRegisters()
+        self.watchHits = []
+        self._syncBreakpoints()
+        self.backend.run()
+
+    def halt(self):
+        '''Ask the target to halt.  The HALT event follows.'''
+        try:
+            self.backend.halt()
+        except BackendError, e:
+            print e
+            return False
+        return True
+
+    def beginBreakpointBatch(self):
+        '''
+        Send the breakpoint changes made until endBreakpointBatch() to the
+        tool in one go, rather than one round trip each.  Batches nest.
+        Running or stepping sends what has been changed so far.
+        '''
+        self._breakpointBatch += 1
+        if self._breakpointBatch == 1:
+            self.backend.beginBreakpoints()
+
+    def endBreakpointBatch(self):
+        self._breakpointBatch -= 1
+        if self._breakpointBatch == 0:
+            self.backend.commitBreakpoints()
+
+    def _syncBreakpoints(self):
+        '''Send batched breakpoint changes before the target moves.  The
+        batch goes on, but the backend only takes the tool's breakpoint
+        store again at the next change.'''
+        if self._breakpointBatch:
+            self.backend.commitBreakpoints()
+            self.backend.beginBreakpoints()
 
     def setBreakpoint(self, addr):
-        self.cpm = self.assembly.getLookup().lookup(ControlPointMediator)
-        wcps = self.cpm.getWritableControlPointStore()
-        if wcps.getNumberAvailableProgramControlPoints() > 0:
-            bp = wcps.getNewControlPoint()
-            bp.setBreakType(BreakType.PROGRAM)
-            bp.setBreakAddress(addr)
-            bp.setEnabled(True)
-            (file,line) = self.addressToSourceLine(addr)
-            bp.setFileNameAndLine(file, line)
-            self._breakpoints.append(bp)
-            self.cpm.commitAndReleaseWritableControlPointStore(wcps)
+        if self._breakpoints.atAddress(addr) is not None:
+            return False
+        (file,line) = self.addressToSourceLine(addr)
+        handle = self.backend.addBreakpoint(addr, file, line)
+        if handle is None:
+            return False
+        self._breakpoints.add(Breakpoint(addr, file, line, handle))
+        return True
+
+    def deleteBreakpoint(self, bp):
+        '''Remove a breakpoint or watchpoint, freeing its slot.  Raises
+        BackendError, and keeps the breakpoint, if the tool can't remove
+        it.'''
+        if bp.handle is not None:
+            self.backend.removeBreakpoint(bp.handle)
+        self._breakpoints.remove(bp)
+
+    def enableBreakpoint(self, bp, enabled=True):
+        '''Enable or disable a breakpoint or watchpoint.  A disabled one
+        keeps its slot.'''
+        if bp.enabled == enabled:
+            return
+        if bp.handle is not None:
+            self.backend.enableBreakpoint(bp.handle, enabled)
+        bp.enabled = enabled
+        if enabled and isinstance(bp, Watchpoint):
+            # Changes while disabled aren't hits.
+            bp.value = self._readTargetMemory(bp.address, bp.length, True)
+
+    def setWatchpoint(self, expr, access=Backend.WRITE, software=False):
+        '''
+        Watch the memory of expr for the given access.  Uses a hardware data
+        breakpoint unless software is set, or a write watchpoint can't get
+        one, in which case 'continue' single-steps and compares the memory
+        after each step (writes only).  Returns the new watchpoint's number,
+        or an error message string.
+        '''
+        if expr.startswith("*"):
+            try:
+                (addr, length, layout, single) = (int(expr[1:], 0), 4,
+                                                  ScalarLayout("I"), True)
+            except ValueError:
+                return "Bad address %s" % expr[1:]
+        else:
+            resolved = self._resolveExpression(expr)
+            if resolved is None:
+                return "No symbol %s" % expr
+            (addr, length, layout, single) = resolved
+        handle = None
+        if software and access != Backend.WRITE:
+            return "Only write watchpoints can be done in software."
+        if not software and self.backend.availableDataBreakpoints() > 0:
+            handle = self.backend.addDataBreakpoint(addr, length, access)
+        if handle is None and access != Backend.WRITE:
+            return "No hardware watchpoint available."
+        wp = Watchpoint(expr, addr, length, layout, single, access, handle)
+        wp.value = self._readTargetMemory(addr, length, True)
+        return self._breakpoints.add(wp)
+
+    def _watchpoints(self, software=None):
+        return self._breakpoints.watchpoints(software)
+
+    def _checkWatchpoints(self, pc=None):
+        '''
+        Record in watchHits the watchpoints that made the target stop, as
+        (watchpoint, old bytes, new bytes, access).  A watched value that
+        changed was written.  Reads, and writes of the same value, are
+        matched against the data breakpoints the tool says triggered or, if
+        it can't say, against the load or store at the stop address pc.
+        Without pc, while single-stepping, only changes count.
+        '''
+        self.watchHits = []
+        for wp in self._watchpoints():
+            data = self._readTargetMemory(wp.address, wp.length, True)
+            if data is not None and data != wp.value:
+                self.watchHits.append((wp, wp.value, data, Backend.WRITE))
+                wp.value = data
+                wp.hits += 1
+        changed = [x[0] for x in self.watchHits]
+        hardware = [x for x in self._watchpoints(software=False)
+                    if x not in changed]
+        if not hardware or pc is None:
+            return
+        fired = self.backend.dataBreakpointHits()
+        if fired is not None:
+            fired = [(wp, access) for (handle, access) in fired
+                     for wp in hardware if wp.handle is handle]
+        else:
+            fired = self._accessAt(pc, hardware)
+        for (wp, access) in fired:
+            if wp.access != Backend.ACCESS and wp.access != access:
+                continue
+            if wp in [x[0] for x in self.watchHits]:
+                continue
+            self.watchHits.append((wp, wp.value, wp.value, access))
+            wp.hits += 1
+
+    def _accessAt(self, pc, watchpoints):
+        '''
+        Return [(watchpoint, access)] for those of watchpoints touched by
+        the load or store at pc, or the one before it for tools that halt
+        after the access.  Not for stops at breakpoints, nor microMIPS code.
+        '''
+        bp = self._breakpoints.atAddress(pc)
+        if (bp is not None and bp.enabled) or pc & 1:
+            return []
+        try:
+            registers = dict(self.registers())
+        except BackendError:
+            return []
+        for addr in (pc, pc - 4):
+            found = memoryAccess(self.disasm.word(addr))
+            if found is None:
+                continue
+            (base, offset, size, store) = found
+            if PIC32_REGISTERS[base] not in registers:
+                return []
+            start = (registers[PIC32_REGISTERS[base]] + offset) & \
+                0x1FFFFFFF # compare physical addresses, whatever the segment
+            access = Backend.WRITE if store else Backend.READ
+            return [(wp, access) for wp in watchpoints
+                    if start < (wp.address & 0x1FFFFFFF) + wp.length and
+                    (wp.address & 0x1FFFFFFF) < start + size]
+        return []
+
+    def getBreakpoint(self, number):
+        '''Return breakpoint number number, or None.'''
+        return self._breakpoints.get(number)
+
+    def breakpointAt(self, addr):
+        '''Return the program breakpoint at addr, enabled or not, or None.'''
+        return self._breakpoints.atAddress(addr)
+
+    def compileCondition(self, text):
+        '''Compile a breakpoint condition.  Raises ConditionError.'''
+        return Condition(text, self._resolveExpression)
+
+    def _shouldStop(self, bp):
+        '''Decide whether a hit on bp stops.  A false condition doesn't
+        count as a hit; an ignored hit does.'''
+        if bp.condition is not None:
+            try:
+                read = lambda addr, length: \
+                    self._readTargetMemory(addr, length, True)
+                if not bp.condition.evaluate(read):
+                    return False
+            except ConditionError, e:
+                print "Error in condition: %s" % e
+                return True
+        bp.hits += 1
+        if bp.ignoreCount > 0:
+            bp.ignoreCount -= 1
+            return False
+        return True
+
+    def checkStop(self):
+        '''
+        Call after the target halts.  If it stopped at a breakpoint whose
+        condition is false or whose hit is ignored, resume it at once and
+        return False; otherwise return True, meaning the stop is real.
+        '''
+        pc = self.waitForSettledPC(interval=0.001)
+        if self._watchpoints():
+            self._checkWatchpoints(pc)
+            if self.watchHits:
+                return True
+        bp = self._breakpoints.atAddress(pc)
+        if bp is None or not bp.enabled or self._shouldStop(bp):
             return True
+        self.run()
+        return False
+
+    def continueToStop(self):
+        '''Run until the target makes a real stop (see checkStop()).
+        Returns False if the wait was cancelled.'''
+        if self.continueSteps():
+            return self._softwareContinue()
+        self.run()
+        while True:
+            if not self.waitForHalt():
+                return False
+            if self.checkStop():
+                return True
+
+    def continueSteps(self):
+        '''True if continueToStop() single-steps, for software
+        watchpoints, rather than running the target.'''
+        return bool(self._watchpoints(software=True))
+
+    def _softwareContinue(self):
+        '''
+        continueToStop() with software watchpoints: step one instruction at a
+        time, reading one window of memory that covers every software
+        watchpoint after each step and comparing its hash with the last
+        one.  Hardware watchpoints don't trigger while stepping, so they are
+        checked the same way.  Also stops at breakpoints.  Returns False if
+        cancelled with cancelWait().
+        '''
+        watched = self._watchpoints()
+        start = min([x.address for x in watched])
+        length = max([x.address + x.length for x in watched]) - start
+        window = self._readTargetMemory(start, length, True)
+        lastHash = hash(window)
+        self.watchHits = []
+        self._waitCancelled = False
+        while not self._waitCancelled:
+            pc = self.stepRaw(self.StepType.INSTR)
+            if pc is None:
+                return False
+            window = self._readTargetMemory(start, length, True)
+            if hash(window) != lastHash:
+                self._checkWatchpoints()
+                if self.watchHits:
+                    return True
+                lastHash = hash(window)
+            bp = self._breakpoints.atAddress(pc)
+            if bp is not None and bp.enabled and self._shouldStop(bp):
+                return True
         return False
 
+    def breakpointIndex(self, bp):
+        return bp.number
+
     def breakpointIndexForAddress(self, addr):
-        result = -1
-        for i,bp in enumerate(self._breakpoints):
-            if bp.getBreakAddress() == addr:
-                result = i
-                break
-        return result
+        '''Return the number of the enabled breakpoint at addr, or -1.'''
+        bp = self._breakpoints.atAddress(addr)
+        if bp is None or not bp.enabled:
+            return -1
+        return bp.number
 
     def allBreakpoints(self):
-        return [(i,bp.getBreakAddress(),bp.getFileName(),
-                 bp.getFileLine(), bp.getEnabled())
-                for (i,bp) in enumerate(self._breakpoints)]
-
-    def selectDebugger(self):
-        # Select PICkit3 debugger
-        alltools = PlatformToolMetaManager.getAllTools()
-        # Name mangling, because they report stupid strings
-        devname = self.devices[0].split(":=")[6] # name is 6th entry in device string
-        if devname.find("PICkit") == 0:
-            devname = devname.replace(" ", "") # damn tools report the wrong name
-        elif devname.lower().find("real ice") >= 0:
-            devname = "Real ICE"
-        tool = [x for x in alltools if x.getName() == devname][0]
-        self.factory.ChangeTool(self.assembly,
-                                tool.getConfigurationObjectID(),
-                                tool.getClassName(),
-                                tool.getFlavor(),
-                                self.devices[0])
-        self.factory.SetToolProperties(self.assembly,None)
+        return [(bp.number,bp.address,bp.file,bp.line,bp.enabled)
+                for bp in self._breakpoints.all()]
 
-    def connect(self):
-        # Connect to debugger
-        self.assembly.SetHeader("");
-        self.mdb = self.assembly.getLookup().lookup(Debugger)
+    def selectDebugger(self, tool=None):
+        # Select the given debugger, or the first one found
+        if tool is None:
+            tool = self.devices[0]
+        self.tool = tool
+        self.backend.selectDebugger(tool)
+
+    def _flashTarget(self):
+        '''Flash cache key for the target: the device behind this tool.'''
+        return "%s|%s" % (self.deviceName, self.tool)
 
+    def connect(self):
         print "Connecting to debugger..."
         try:
-            self.mdb.Attach(self, None)
-            self.mdb.Connect(Debugger.CONNECTION_TYPE.DEBUGGER)
-        except DebugException:
-            print "Failed to connect to debugger."
+            self.backend.connect(self.Update)
+        except BackendError, e:
+            print e
             return False
         return True
 
-    def load(self, file):
-        # Load ELF file onto target
-        self.loader = self.assembly.getLookup().lookup(Loader)
-        try:
-            self.loader.Load(file)
-            self.mdb.Program(Debugger.PROGRAM_OPERATION.AUTO_SELECT)
-            self.translator = self.assembly.getLookup().lookup(ITranslator)
-            self.disassembler = self.assembly.getLookup().lookup(DisAsm)
-            self.mem = self.assembly.getLookup().lookup(ProgramMemory).GetVirtualMemory()
-
-            # Get ELF parser to find filenames and paths
-            self.file_magic = MDBFileMagic(file)
-            self.dwarf = Dwarf(self.file_magic)
-            self.comp_units = self.dwarf.getCompilationUnits()
-            self.filenames = [x.getSourceFileAbsolutePath() for x in self.comp_units]
-            
-            
-        except DebugException:
-            print "Failed to load ELF onto target."
+    # Granularity used to report which parts of flash differ.
+    FLASH_ROW_SIZE = 512
+
+    def _readProgramMemory(self, addr, length):
+        '''Read program memory from the target as a string, or None.'''
+        return self.backend.readProgramMemory(addr, length)
+
+    def _targetHasImage(self, segments):
+        '''Return True if the target flash holds the given segments.'''
+        total = 0
+        changed = 0
+        for seg in segments:
+            actual = self._readProgramMemory(seg.vaddr, len(seg.data))
+            if actual is None:
+                return False
+            rows = differingRows(seg.data, actual, seg.vaddr,
+                                 self.FLASH_ROW_SIZE)
+            total += (len(seg.data) + self.FLASH_ROW_SIZE - 1) // self.FLASH_ROW_SIZE
+            changed += len(rows)
+        if changed:
+            print "%d of %d flash rows differ from image." % (changed, total)
             return False
-        except LoadException:
-            print "File not found."
+        return True
+
+    def load(self, file, force=False):
+        '''Load ELF file onto target.  Programming is skipped if the target
+        flash already matches the image, unless force is set.'''
+        try:
+            elf = ElfFile(file)
+        except (ElfError, IOError):
+            print "Could not read ELF file; flash cache disabled."
+            elf = None
+        try:
+            self.backend.load(file)
+            if not self.backend.hasTarget():
+                self._loadImage(file, elf)
+                return True
+            digest = None
+            if elf is not None:
+                segments = elf.programSegments()
+                digest = imageDigest(segments)
+            # The cache says what we last programmed, but something else may
+            # have programmed the device since, so verify before skipping.
+            upToDate = False
+            if not force and digest and digest == \
+                    self.flashCache.lastProgrammed(self._flashTarget(), file):
+                upToDate = self._targetHasImage(segments)
+                if not upToDate:
+                    # Verifying pulled target flash into the loaded image.
+                    self.backend.load(file)
+            if upToDate:
+                print "Target flash matches image, skipping programming."
+            else:
+                self.flashCache.forget(self._flashTarget(), file)
+                self.backend.program()
+                if digest:
+                    self.flashCache.record(self._flashTarget(), file, digest)
+            self._loadImage(file, elf)
+        except BackendError, e:
+            print e
             return False
         return True
 
+    def _loadImage(self, file, elf):
+        '''Take the program memory snapshot and the debug information for
+        file once it's loaded.'''
+        if elf is not None:
+            self.disasm.snapshot(elf.programSegments(), elf.endian)
+        else:
+            self.disasm.snapshot([])
+        self._loadMetadata(file, elf)
+
+    def verify(self, file):
+        '''Return True if the target flash holds file's program image.'''
+        try:
+            segments = ElfFile(file).programSegments()
+        except (ElfError, IOError):
+            print "Could not read ELF file."
+            return False
+        try:
+            return self._targetHasImage(segments)
+        except BackendError, e:
+            print e
+            return False
+
+    def _loadMetadata(self, file, elf):
+        '''Fill in source files, line table and symbols for file, from the
+        on-disk cache if it matches, otherwise by parsing the ELF.'''
+        self.saveMetadata()
+        meta = None
+        try:
+            fp = metacache.fingerprint(file, self.backend.typeEnum())
+            meta = metacache.load(file, fp)
+        except (IOError, OSError):
+            fp = None
+        if meta is not None:
+            self.filenames = meta.filenames
+            self.lineTable = meta.lineTable
+            self.symbols = meta.symbols
+            self._rawSymbols = dict(meta.symbolInfos)
+        else:
+            self.filenames = self.backend.sourceFiles(file)
+            self.sources.clear()
+            self._rawSymbols = {}
+            if elf is not None:
+                self.symbols = SymbolIndex.fromElf(elf)
+            else:
+                self.symbols = SymbolIndex()
+            self.lineTable = self._buildLineTable(self.filenames, elf)
+        self._paths = PathIndex(self.filenames)
+        self._variableTypes = None
+        if self._layouts is not None:
+            self._layouts.forgetTypes()
+        self._elfFile = file
+        self._elfFingerprint = fp
+        self._savedSymbolInfos = -1 if meta is None else len(self._rawSymbols)
+        self.saveMetadata()
+
+    def saveMetadata(self):
+        '''Write the metadata cache for the loaded ELF, if anything was learned
+        since it was last written.'''
+        if self._elfFingerprint is None:
+            return
+        if len(self._rawSymbols) == self._savedSymbolInfos:
+            return
+        meta = metacache.Metadata(self.filenames, self.lineTable, self.symbols,
+                                  self._rawSymbols)
+        metacache.save(self._elfFile, self._elfFingerprint, meta)
+        self._savedSymbolInfos = len(self._rawSymbols)
+
     def findFile(self, filename):
-        abspaths = [x for x in self.filenames if x.rfind(filename) >= 0]
-        for path in abspaths:
-            if os.path.exists(path):
-                return path
-        return None
+        '''Return the absolute path of the source file filename, or None.'''
+        return self._paths.find(filename)
+
+    def _buildLineTable(self, filenames, elf):
+        '''
+        Index every line with code, once per load, so later lookups don't
+        go through the translator.  The rows come from the ELF's DWARF line
+        program, which costs no round trips and doesn't need the sources on
+        this host.  Only if the ELF has none is the translator asked about
+        each line of each source file that can be read.
+        '''
+        table = LineTable()
+        rows = self._dwarfLineRows(elf, filenames)
+        if rows:
+            for (addr, path, line, end) in rows:
+                table.addRow(addr, path, line, end)
+        else:
+            for path in filenames:
+                source = self.sources.get(path)
+                if source is None:
+                    continue
+                for line in range(1, len(source)+1):
+                    found = self.backend.sourceLineToAddress(path, line)
+                    if found:
+                        end = found[1]
+                        if end is None:
+                            # Don't let the line run on past its function.
+                            bounds = self.functionBounds(found[0])
+                            if bounds is not None:
+                                end = bounds[2]
+                        table.addRow(found[0], path, line, end)
+        table.finalize()
+        return table
+
+    def _dwarfLineRows(self, elf, filenames):
+        '''Return the (addr, path, line, end) rows of the ELF's .debug_line,
+        with paths given as the backend names the compilation units, or []
+        if it has none.'''
+        if elf is None:
+            return []
+        data = elf.section(".debug_line")
+        if not data:
+            return []
+        try:
+            rows = lineRows(data, elf.endian, 8 if elf.is64 else 4)
+        except (struct.error, IndexError, ValueError):
+            return []
+        # File names in the line program may be relative to the compilation
+        # directory; match them to the units' absolute paths by their ends.
+        paths = {}
+        def unitPath(path):
+            found = paths.get(path)
+            if found is None:
+                found = os.path.normpath(path)
+                if not os.path.isabs(path):
+                    for name in filenames:
+                        if name.endswith("/" + found):
+                            found = name
+                            break
+                paths[path] = found
+            return found
+        return [(addr, unitPath(path), line, end)
+                for (addr, path, line, end) in rows]
 
     def findBreakableAddressInFile(self, filename, line):
         fullpath = self.findFile(filename)
         if fullpath is None:
             print "File not found."
             return None
-        addr = None
-        for i in range(20):
-            try:
-                info = self.translator.sourceLineToAddress(fullpath, line+i)
-                if info:
-                    break
-            except TranslatorException:
-                continue
-        addr = info.lStartAddr
-        return addr
+        if self.lineTable.hasFile(fullpath):
+            return self.lineTable.sourceLineToAddress(fullpath, line)
+        # Not indexed at load (source missing then); ask the backend.
+        for i in range(LineTable.LINE_SEARCH_WINDOW):
+            found = self.backend.sourceLineToAddress(fullpath, line+i)
+            if found:
+                return found[0]
+        return None
 
     def testSourceLookup(self):
         sourcefile = "/path/to/MainDemo.c"
         line = 248
-        info = self.translator.sourceLineToAddress(sourcefile, line)
-        print "%s:%d ==> 0x%X" % (sourcefile.split("/")[-1], line, info.lStartAddr)
+        (addr, end) = self.backend.sourceLineToAddress(sourcefile, line)
+        print "%s:%d ==> 0x%X" % (sourcefile.split("/")[-1], line, addr)
 
     def reset(self):
         # Reset to main
-        self.mdb.Reset(True)
+        try:
+            self.backend.reset()
+        except BackendError, e:
+            print e
+        self.memCache.invalidate()
+        self._forgetRegisters()
 
     def disconnect(self):
-        if self.mdb:
-            self.mdb.Disconnect()
+        self.stopLog()
+        self.saveMetadata()
+        self.backend.disconnect()
 
     def getDeviceFamily(self):
-        bits = assembly.GetDevice().getFamilyCode()
-        return assembly.GetDevice().getSubFamily()
+        return self.backend.deviceFamily()
+
+    def _readTargetMemory(self, addr, length, virtual):
+        '''Read data memory straight from the target, bypassing the cache.'''
+        return self.backend.readMemory(addr, length, virtual)
+
+    def dumpCore(self, path, progress=None):
+        '''
+        Write the target's data memory, the backend's memoryRegions(), to a
+        core file, with the CPU registers and the loaded ELF's path.
+        Peripheral registers are left out, since reading some of them has
+        side effects.  The target must be halted.  Returns (bytes written,
+        bytes unreadable).  Raises IOError or BackendError.
+        '''
+        registers = self.registers()
+        regions = withoutRanges(self.backend.memoryRegions(),
+                                PIC32_PERIPHERALS)
+        return writeCore(path, self.deviceName, self._elfFile, self.getPC(),
+                         regions,
+                         lambda addr, length:
+                             self._readTargetMemory(addr, length, True),
+                         registers, progress=progress)
 
     def getMemoryContents(self, addr, length, virtual=False):
-        fr = self.assembly.getLookup().lookup(FileRegisters)
-        data = jarray.zeros(length, "b")
-        if virtual:
-            mem = fr.GetVirtualMemory()
-        else:
-            mem = fr.GetPhysicalMemory()
-        mem.RefreshFromTarget(addr, length)
-        if mem.Read(addr, length, data) == length:
-            return data        
-        return None
+        '''Return length bytes of data memory at addr as a string, or None.
+        Served from memCache while the target stays halted.'''
+        return self.memCache.read(addr, length, virtual)
 
     def getFunctionAddress(self, funcname):
-        sv = self.assembly.getLookup().lookup(SymbolViewProvider)
-        info = sv.getRawSymbol(funcname)
+        sym = self.symbols.lookup(funcname)
+        if sym is not None:
+            if sym.kind != Symbol.FUNCTION:
+                return None
+            return sym.address
+        info = self._symbolInfo(funcname)
         if not info or info.Type() != 64: # 64 is magic number found by inspection
             return None
         return info.Address()
+
+    def symbolForAddress(self, addr):
+        '''Return (name, offset) of the symbol containing addr, or None.'''
+        found = self.symbols.symbolForAddress(addr)
+        if found is None:
+            return None
+        return (found[0].name, found[1])
     
 
-    def getSymbolValue(self, symbol):
-        sv = self.assembly.getLookup().lookup(SymbolViewProvider)
-        info = sv.getRawSymbol(symbol)
+    def _symbolInfo(self, symbol):
+        '''Return the symbol view's raw info for symbol.  Looked up through
+        the symbol view once per load, then cached.'''
+        if symbol in self._rawSymbols:
+            return self._rawSymbols[symbol]
+        info = self.backend.rawSymbol(symbol)
+        self._rawSymbols[symbol] = info
+        return info
+
+    def _resolveExpression(self, expr):
+        '''Return (address, length, layout, single) of the memory selected by
+        expr ('name', 'name[i]' or 'name[start:stop]'), or None.'''
+        parsed = parseExpression(expr)
+        if parsed is None:
+            return None
+        (name, index) = parsed
+        info = self._symbolInfo(name)
         if not info:
             return None
-        vartype = info.Type()
-        varlength = info.ByteLength()
-        data = self.getMemoryContents(info.Address(), varlength, virtual=True)
-        if not data:
+        if self._layouts is None:
+            self._layouts = LayoutCompiler(self.backend.typeEnum())
+        layout = None
+        if not self._layouts.isFundamental(info.Type()):
+            # Structs, unions and anything else the symbol view can't
+            # describe are laid out from the ELF's debug information.
+            vartype = self._variableType(name)
+            if vartype is not None:
+                layout = self._layouts.layoutForType(vartype)
+            if layout is not None and layout.size != info.ByteLength():
+                layout = None
+        if layout is None:
+            layout = self._layouts.layoutFor(info.Type(), info.ByteLength())
+        selected = elementRange(layout, index)
+        if selected is None:
             return None
+        (offset, length, single) = selected
+        return (info.Address() + offset, length, layout, single)
 
-        # Unpack array into variable based on type
-        fmtMap = {1: "b", 2: "h", 4: "i", 8: "q"}
-        # TODO: fill out map of types and their signedness
-        signMap = {VarType.ST_ULONG.value(): False,
-                   VarType.ST_LONG.value(): True,
-                   }
-        if varlength > 8:
-            # TODO: Handle complex symbols.  Struct or string or something.
-            print "Symbol type not handled!"
-            return None
-        fmt = fmtMap[varlength]
-        if vartype in signMap:
-            fmt = fmt.lower() if signMap[vartype] else fmt.upper()
-        # Special cases:
-        if vartype == VarType.ST_FLOAT:
-            fmt = "f"
-        elif vartype == VarType.ST_DOUBLE:
-            fmt = "d"
-        return struct.unpack(fmt, data.tostring())[0]
-        
-        
+    def _variableType(self, name):
+        '''Return the type of global name from the loaded ELF's
+        .debug_info, or None.  The section is decoded once per load.'''
+        if self._variableTypes is None:
+            self._variableTypes = {}
+            try:
+                elf = ElfFile(self._elfFile)
+                info = elf.section(".debug_info")
+                abbrev = elf.section(".debug_abbrev")
+                if info and abbrev:
+                    self._variableTypes = variableTypes(
+                        info, abbrev, elf.section(".debug_str") or "",
+                        elf.endian)
+            except (ElfError, IOError, TypeError, struct.error, IndexError,
+                    KeyError, ValueError):
+                pass
+        return self._variableTypes.get(name)
+
+    def prepareExpressions(self, exprs):
+        '''Look up the symbols in exprs now, so later reads of them don't
+        have to.  Returns the ones that can't be found.'''
+        return [x for x in exprs if self._resolveExpression(x) is None]
+
+    def startLog(self, exprs, interval, path):
+        '''
+        Start sampling exprs (as for getSymbolValues()) every interval
+        seconds into path, on a worker thread, until stopLog().  Reads go
+        straight to the target, not through the memory cache.  Returns the
+        LiveLog.  Raises LogError or IOError.
+        '''
+        if self.liveLog is not None and self.liveLog.running():
+            raise LogError("Already logging to %s." % self.liveLog.path)
+        symbols = []
+        for expr in exprs:
+            r = self._resolveExpression(expr)
+            if r is None:
+                raise LogError("%s: Symbol not found." % expr)
+            symbols.append((expr,) + r)
+        self.liveLog = LiveLog(symbols, interval, path,
+                               lambda addr, length:
+                                   self._readTargetMemory(addr, length, True))
+        self.liveLog.begin()
+        return self.liveLog
+
+    def stopLog(self):
+        '''Stop the background log, if any, and return it.'''
+        log = self.liveLog
+        if log is not None:
+            log.stop()
+        return log
+
+    def getSymbolValue(self, symbol):
+        return self.getSymbolValues([symbol])[0]
+
+    def getSymbolValues(self, exprs):
+        '''Return a list with the value of each expression, or None for
+        ones that can't be found or read.  Expressions are symbol names,
+        optionally indexed or sliced: 'buf[3]', 'buf[100:200]'.  All of them
+        are fetched from the target together, in as few transfers as their
+        addresses allow.'''
+        if not self.isHalted:
+            # Live read: nothing cached is current while the target runs.
+            self.memCache.invalidate()
+        resolved = [self._resolveExpression(x) for x in exprs]
+        ranges = [(x[0], x[1]) for x in resolved if x]
+        self.memCache.prefetch(sorted(ranges), virtual=True)
+        values = []
+        for r in resolved:
+            value = None
+            if r:
+                (addr, length, layout, single) = r
+                data = self.getMemoryContents(addr, length, virtual=True)
+                if data:
+                    value = layout.decode(data)
+                    if single and isinstance(value, list):
+                        value = value[0]
+            values.append(value)
+        return values
 
     def addressToSourceLine(self, addr, stripdir=True):
-        try:
-            info = self.translator.addressToSourceLine(addr)
-            f = info.file
-            if stripdir:
-                f = info.file.split("/")[-1]                
-            return (f, info.lLine)
-        except TranslatorException:
-            return ("unknown",0)
+        found = self.lineTable.addressToSourceLine(addr)
+        if found is None:
+            found = self.backend.addressToSourceLine(addr)
+            if found is None:
+                return ("unknown",0)
+        (f, line) = found
+        if stripdir:
+            f = f.split("/")[-1]
+        return (f, line)
 
-    def step(self, type=StepType.OVER):
+    def stepRaw(self, type=StepType.OVER):
+        '''Step once without printing anything.  Returns the new PC, or None
+        if the step failed.'''
+        self._syncBreakpoints()
         try:
             if type == self.StepType.OVER:
-                self.mdb.StepOver()
+                self.backend.stepOver()
             elif type == self.StepType.IN:
-                self.mdb.StepIn()
+                self.backend.stepIn()
             else:
-                self.mdb.StepInstr()
-        except DebugException:
-            print "Lost communication with debugger or target!"
+                self.backend.stepInstr()
+        except BackendError, e:
+            print e
+            return None
+        finally:
+            self.memCache.invalidate()
+            self._forgetRegisters()
+        return self.getPC()
+
+    def disassemble(self, addr, size=4):
+        '''Return the text of the instruction at addr in the loaded image.'''
+        return self.disasm.instruction(addr, size)
+
+    def instructions(self, start, end=None, count=None):
+        '''
+        Return [(addr, size)] for the instructions from start up to end, or
+        the first count of them.  Sizes come from the line information;
+        addresses without any are taken as 4-byte instructions.
+        '''
+        result = []
+        addr = start
+        while (end is None or addr < end) and \
+                (count is None or len(result) < count):
+            found = [x for x in self.backend.lineInstructions(addr) or []
+                     if x[0] >= addr]
+            if not found:
+                found = [(addr, 4)]
+            for (a, size) in found:
+                if (end is not None and a >= end) or \
+                        (count is not None and len(result) >= count):
+                    break
+                result.append((a, size))
+            addr = found[-1][0] + max(found[-1][1], 2)
+        return result
+
+    def readMemory(self, addr, length):
+        '''Return length bytes at addr, from the program image snapshot if
+        they're in it, otherwise from data memory.  None if unreadable.'''
+        data = self.disasm.read(addr, length)
+        if data is None:
+            data = self.getMemoryContents(addr, length, virtual=True)
+        return data
+
+    def functionBounds(self, addr):
+        '''Return (name, start, end) of the function containing addr, or
+        None.'''
+        found = self.symbols.symbolForAddress(addr)
+        if found is None:
+            return None
+        sym = found[0]
+        return (sym.name, sym.address, sym.address + max(sym.size, 1))
+
+    def step(self, type=StepType.OVER):
+        pc = self.stepRaw(type)
+        if pc is None:
             return
-        pc = self.mdb.GetPC()
+        self.printLocation(pc)
+
+    def printLocation(self, pc):
+        '''Print pc with its source line and the line's instructions.'''
         print "PC: 0x%X" % pc,
-        try:
-            info = self.translator.addressToSourceLine(pc)
-            print " (%s:%d)" % (info.file.split("/")[-1], info.lLine),
-            lines = self.translator.sourceLinesFromAddress(pc, True)
-            for sl in lines.result:
-                ins = self.disassembler.Disassemble(
-                    self.mem.ReadWord(sl.Address()),
-                    self.mem.ReadWord(sl.Address() + sl.AddressIncrement()),
-                    sl.Address() | (1 if sl.AddressIncrement() == 2 else 0),
-                    DisAsm.OPTIONS.FULL_SYMBOLS,
-                    None)
-                print " (%s)" % ins.instruction,
-        except TranslatorException:
+        instructions = self.backend.lineInstructions(pc)
+        if instructions is None:
             print " Unknown line.",
+        else:
+            (file, line) = self.addressToSourceLine(pc)
+            print " (%s:%d)" % (file, line),
+            for (addr, size) in instructions:
+                print " (%s)" % self.disassemble(addr, size),
         print
+        text = self.sourceText(pc)
+        if text is not None:
+            print "%d\t%s" % text
 
+    def sourceText(self, addr):
+        '''Return (line, text) of the source line of addr, or None if the
+        source isn't available.'''
+        (path, line) = self.addressToSourceLine(addr, stripdir=False)
+        text = self.sources.line(path, line)
+        if text is None:
+            return None
+        return (line, text)
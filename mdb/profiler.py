@@ -0,0 +1,102 @@
+'''
+Statistical PC-sampling profiler.
+
+Samples are kept as raw PCs in an array.  Reports are built afterwards:
+the distinct PCs are counted, then each one is looked up once in the
+address-ordered symbol index and the line table.
+'''
+
+import time
+import array
+
+class Profile:
+    def __init__(self):
+        self.pcs = array.array('L')
+        self.missed = 0
+        self.elapsed = 0.0
+        self.live = True
+
+    def add(self, pc):
+        if pc is None:
+            self.missed += 1
+        else:
+            self.pcs.append(pc)
+
+    def counts(self):
+        '''Return {pc: samples}.'''
+        counts = {}
+        for pc in self.pcs:
+            counts[pc] = counts.get(pc, 0) + 1
+        return counts
+
+def sample(samplePC, seconds, hz, interrupted=lambda: False):
+    '''
+    Call samplePC() hz times a second for seconds seconds, or until
+    interrupted() returns True.  Returns a Profile.  Sampling keeps to the
+    schedule; samples that fall behind are taken at once, not made up.
+    '''
+    profile = Profile()
+    interval = 1.0 / hz
+    start = time.time()
+    end = start + seconds
+    due = start
+    while not interrupted():
+        now = time.time()
+        if now >= end:
+            break
+        if due > now:
+            time.sleep(min(due, end) - now)
+            continue
+        profile.add(samplePC())
+        due += interval
+        if due < now:
+            due = now
+    profile.elapsed = time.time() - start
+    return profile
+
+def histograms(profile, symbolForAddress, addressToSourceLine):
+    '''Return ({function: samples}, {(file, line): samples}).  Addresses
+    with no symbol count against "?".'''
+    functions = {}
+    lines = {}
+    for (pc, n) in profile.counts().iteritems():
+        found = symbolForAddress(pc)
+        name = found[0] if found else "?"
+        functions[name] = functions.get(name, 0) + n
+        key = addressToSourceLine(pc)
+        lines[key] = lines.get(key, 0) + n
+    return (functions, lines)
+
+def report(profile, functions, lines, top=15):
+    '''Return the text report as a list of lines.'''
+    total = len(profile.pcs)
+    rate = total / profile.elapsed if profile.elapsed else 0.0
+    out = ["%d samples in %.2fs (%.1f Hz, %s)%s" %
+           (total, profile.elapsed, rate,
+            "live" if profile.live else "halt-sample-resume",
+            ", %d missed" % profile.missed if profile.missed else "")]
+    if not total:
+        return out
+    for (title, counts, fmt) in [
+            ("Functions", functions, lambda k: k),
+            ("Lines", lines, lambda k: "%s:%d" % k)]:
+        out.append("%s:" % title)
+        ranked = sorted(counts.items(), key=lambda x: (-x[1], x[0]))
+        for (key, n) in ranked[:top]:
+            out.append("  %7d %5.1f%%  %s" % (n, 100.0 * n / total, fmt(key)))
+    return out
+
+def writeCollapsed(f, profile, symbolForAddress, addressToSourceLine):
+    '''
+    Write samples in collapsed-stack format, one "function;file:line count"
+    line per source line, for flamegraph.pl and similar tools.  Only the PC
+    is sampled, so each stack is the function and its line.
+    '''
+    stacks = {}
+    for (pc, n) in profile.counts().iteritems():
+        found = symbolForAddress(pc)
+        (file, line) = addressToSourceLine(pc)
+        stack = "%s;%s:%d" % (found[0] if found else "?", file, line)
+        stacks[stack] = stacks.get(stack, 0) + n
+    for stack in sorted(stacks):
+        f.write("%s %d\n" % (stack, stacks[stack]))
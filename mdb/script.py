@@ -0,0 +1,412 @@
+'''
+Compiled debug scripts, for --script and 'source'.
+
+A script is parsed into statements before anything runs: each command is
+looked up once, so a typo is reported with its line number before the
+target is touched.  Expressions are resolved as soon as the ELF's symbols
+are known: at once if it is loaded already, otherwise right after the
+script's 'load'.  The locations given to 'break' and 'until' are resolved
+when the command first runs, since a bare line number means a line of the
+file the PC is in then, and are looked up again after a 'load'.  Running
+the script then only does the target operations.
+
+Besides debugger commands, scripts have:
+
+    set $name = <expression>
+    if <expression> ... [else ...] end
+    while <expression> ... end
+    repeat <count> ... end
+    expect <expression>     report a failure if false, and carry on
+    echo <text>
+
+Expressions are as for breakpoint conditions: C operators over global
+symbols and $variables.  ${name} in a command or echo is replaced by the
+variable's value.  Each command's output is buffered and written when it
+finishes.
+'''
+
+import re
+import sys
+import time
+import logging
+import StringIO
+
+from mdb.condition import Condition, ConditionError
+
+class ScriptError(Exception):
+    pass
+
+_VARIABLE = re.compile(r"\$\{([A-Za-z_]\w*)\}")
+_NAME = re.compile(r"\$([A-Za-z_]\w*)")
+_SET = re.compile(r"\$([A-Za-z_]\w*)\s*=\s*(.+)$")
+
+class ScriptResult:
+    def __init__(self):
+        self.failures = []   # (line number, message)
+        self.error = None
+        self.commands = 0
+        self.elapsed = 0.0
+
+    def passed(self):
+        return self.error is None and not self.failures
+
+class _Expression:
+    def __init__(self, text, lineno):
+        self.text = text
+        self.lineno = lineno
+        self._compiled = None
+        # Check the syntax now; symbols are resolved later.
+        try:
+            Condition(text, lambda expr: (0, 0, None, True))
+        except ConditionError, e:
+            raise ScriptError("line %d: %s" % (lineno, e))
+
+    def forget(self):
+        self._compiled = None
+
+    def resolve(self, dbg):
+        if self._compiled is None:
+            self._compiled = dbg.compileCondition(self.text)
+        return self._compiled
+
+    def value(self, script):
+        try:
+            return self.resolve(script.dbg).value(script.read,
+                                                  script.variables)
+        except ConditionError, e:
+            raise ScriptError("line %d: %s" % (self.lineno, e))
+
+    def describe(self, script):
+        '''Return "name = value, ..." for the symbols and variables in the
+        expression.'''
+        compiled = self.resolve(script.dbg)
+        try:
+            values = zip(compiled.symbols, compiled.values(script.read))
+        except ConditionError:
+            values = []
+        for name in sorted(set(_NAME.findall(self.text))):
+            if name in script.variables:
+                values.append(("$" + name, script.variables[name]))
+        return ", ".join(["%s = %s" % x for x in values])
+
+class _Command:
+    # Commands whose first argument is a location, resolved when first run
+    LOCATIONS = ("break", "until")
+    # Commands whose arguments are symbol expressions to look up ahead
+    EXPRESSIONS = ("print", "display")
+
+    def __init__(self, lineno, cmd, fn, args):
+        self.lineno = lineno
+        self.cmd = cmd
+        self.fn = fn
+        self.args = args
+        self._substitute = "${" in args
+        # args with the location turned into *<address>, once resolved
+        self._located = None
+
+    def resolve(self, script):
+        if self._substitute:
+            return
+        if self.cmd in self.EXPRESSIONS:
+            script.dbg.prepareExpressions(
+                [x for x in self.args.replace(",", " ").split()
+                 if not x.startswith("$")])
+
+    def forget(self):
+        '''Drop the resolved location; the ELF has changed.'''
+        self._located = None
+
+    def _locate(self, script):
+        '''Return args with the location resolved to an address.  Kept
+        for later runs, except for a bare line number, which is in the file
+        of the PC at the time.'''
+        if self._located is not None:
+            return self._located
+        (location, sep, rest) = self.args.partition(" if ")
+        location = location.strip()
+        if not location or location.startswith("*"):
+            return self.args
+        addr = script.handler.resolveLocation(location)
+        if addr is None:
+            return self.args # the command says it failed
+        located = "*0x%X%s%s" % (addr, sep, rest)
+        if not location[0].isdigit():
+            self._located = located
+        return located
+
+    def run(self, script):
+        args = self.args
+        if self._substitute:
+            args = script.substitute(args, self.lineno)
+        elif self.cmd in self.LOCATIONS:
+            args = self._locate(script)
+        script.runCommand(self, args)
+        if self.cmd == "load":
+            script.resolve()
+
+class _Set:
+    def __init__(self, lineno, name, expr):
+        self.lineno = lineno
+        self.name = name
+        self.expr = expr
+
+    def run(self, script):
+        script.variables[self.name] = self.expr.value(script)
+
+class _Echo:
+    def __init__(self, lineno, text):
+        self.lineno = lineno
+        self.text = text
+
+    def run(self, script):
+        script.write(script.substitute(self.text, self.lineno) + "\n")
+
+class _Expect:
+    def __init__(self, lineno, expr):
+        self.lineno = lineno
+        self.expr = expr
+
+    def run(self, script):
+        if self.expr.value(script):
+            return
+        detail = self.expr.describe(script)
+        message = "expect %s failed%s" % (self.expr.text,
+                                          " (%s)" % detail if detail else "")
+        script.fail(self.lineno, message)
+
+class _If:
+    def __init__(self, lineno, expr):
+        self.lineno = lineno
+        self.expr = expr
+        self.body = []
+        self.orelse = []
+
+    def run(self, script):
+        if self.expr.value(script):
+            script.runBlock(self.body)
+        else:
+            script.runBlock(self.orelse)
+
+class _While:
+    def __init__(self, lineno, expr):
+        self.lineno = lineno
+        self.expr = expr
+        self.body = []
+
+    def run(self, script):
+        while self.expr.value(script):
+            script.runBlock(self.body)
+
+class _Repeat:
+    def __init__(self, lineno, expr):
+        self.lineno = lineno
+        self.expr = expr
+        self.body = []
+
+    def run(self, script):
+        for _ in xrange(int(self.expr.value(script))):
+            script.runBlock(self.body)
+
+class _Buffer:
+    '''Stands in for sys.stdout while a script runs.'''
+    def __init__(self):
+        self.buf = StringIO.StringIO()
+
+    def write(self, s):
+        self.buf.write(s)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        s = self.buf.getvalue()
+        self.buf = StringIO.StringIO()
+        return s
+
+class Script:
+    '''
+    A compiled script.  handler is the CommandHandler whose commands the
+    script runs.  Raises ScriptError for syntax errors and unknown
+    commands.
+    '''
+    def __init__(self, handler, lines, name="script"):
+        self.handler = handler
+        self.dbg = handler.dbg
+        self.name = name
+        self.variables = {}
+        self._expressions = []
+        self._commands = []
+        self.body = self._parse(lines)
+        self._result = None
+        self._out = None
+        self._buffer = None
+
+    def _expression(self, text, lineno):
+        if not text:
+            raise ScriptError("line %d: missing expression" % lineno)
+        expr = _Expression(text, lineno)
+        self._expressions.append(expr)
+        return expr
+
+    def _parse(self, lines):
+        body = []
+        # Open blocks: (statement, the list being filled)
+        stack = []
+        current = body
+        for (i, line) in enumerate(lines):
+            lineno = i + 1
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            (word, _, rest) = line.partition(" ")
+            rest = rest.strip()
+            if word == "end":
+                if not stack:
+                    raise ScriptError("line %d: 'end' without a block" %
+                                      lineno)
+                current = stack.pop()[1]
+                continue
+            if word == "else":
+                if not stack or not isinstance(stack[-1][0], _If) or \
+                        current is stack[-1][0].orelse:
+                    raise ScriptError("line %d: 'else' without 'if'" % lineno)
+                current = stack[-1][0].orelse
+                continue
+            if word in ("if", "while", "repeat"):
+                cls = {"if": _If, "while": _While, "repeat": _Repeat}[word]
+                statement = cls(lineno, self._expression(rest, lineno))
+                current.append(statement)
+                stack.append((statement, current))
+                current = statement.body
+                continue
+            if word == "set":
+                m = _SET.match(rest)
+                if m is None:
+                    raise ScriptError("line %d: usage: set $name = "
+                                      "<expression>" % lineno)
+                statement = _Set(lineno, m.group(1),
+                                 self._expression(m.group(2), lineno))
+            elif word == "expect":
+                statement = _Expect(lineno, self._expression(rest, lineno))
+            elif word == "echo":
+                statement = _Echo(lineno, rest)
+            else:
+                found = self.handler.lookupCommand(line)
+                if found is None:
+                    raise ScriptError("line %d: unknown command: %s" %
+                                      (lineno, line))
+                statement = _Command(lineno, *found)
+                self._commands.append(statement)
+            current.append(statement)
+        if stack:
+            raise ScriptError("line %d: block has no 'end'" %
+                              stack[-1][0].lineno)
+        return body
+
+    def resolve(self):
+        '''
+        Resolve the symbols of expressions, if the ELF is loaded, and forget
+        resolved locations.  Called before running and after each 'load' in
+        the script.  Raises ScriptError if an expression names a symbol the
+        ELF doesn't have.
+        '''
+        for expr in self._expressions:
+            expr.forget()
+        for command in self._commands:
+            command.forget()
+        if not len(self.dbg.symbols):
+            return
+        for expr in self._expressions:
+            try:
+                expr.resolve(self.dbg)
+            except ConditionError, e:
+                raise ScriptError("line %d: %s" % (expr.lineno, e))
+        for command in self._commands:
+            command.resolve(self)
+
+    def read(self, addr, length):
+        if not self.dbg.isHalted:
+            self.dbg.memCache.invalidate()
+        return self.dbg.getMemoryContents(addr, length, virtual=True)
+
+    def substitute(self, text, lineno):
+        def value(m):
+            if m.group(1) not in self.variables:
+                raise ScriptError("line %d: No variable $%s" %
+                                  (lineno, m.group(1)))
+            return str(self.variables[m.group(1)])
+        return _VARIABLE.sub(value, text)
+
+    def write(self, s):
+        self._out.write(s)
+
+    def fail(self, lineno, message):
+        self._result.failures.append((lineno, message))
+        self.write("%s:%d: %s\n" % (self.name, lineno, message))
+
+    def runCommand(self, command, args):
+        self.handler.reportPendingStop()
+        try:
+            self.handler.runCommand(command.cmd, command.fn, args)
+        finally:
+            if self._buffer is not None:
+                self._out.write(self._buffer.take())
+                self._out.flush()
+        self._result.commands += 1
+
+    def runBlock(self, statements):
+        for statement in statements:
+            try:
+                statement.run(self)
+            except ScriptError:
+                raise
+            except Exception, e:
+                raise ScriptError("line %d: %s" % (statement.lineno, e))
+
+    def run(self, out=None, buffered=True):
+        '''
+        Run the script, writing its output to out (default stdout).  Returns
+        a ScriptResult; a runtime error stops the script and is recorded in
+        it rather than raised.
+
+        Buffering swaps sys.stdout and the "picdb" logger's output, which
+        are shared by every thread; pass buffered=False where the caller
+        already captures output per thread, as fleet mode does.
+        '''
+        self._result = ScriptResult()
+        self._out = out or sys.stdout
+        start = time.time()
+        # Buffer command output, unless an enclosing script already is.
+        if buffered and not isinstance(sys.stdout, _Buffer):
+            self._buffer = _Buffer()
+        if self._buffer is not None:
+            # The buffer replaces wherever the log went (the console, or a
+            # server client's socket) until the script ends.
+            log = self.handler.log
+            logHandler = logging.StreamHandler(self._buffer)
+            logHandler.setFormatter(logging.Formatter("%(message)s"))
+            oldHandlers = log.handlers[:]
+            oldPropagate = log.propagate
+            oldStdout = sys.stdout
+            for h in oldHandlers:
+                log.removeHandler(h)
+            log.addHandler(logHandler)
+            log.propagate = False
+            sys.stdout = self._buffer
+        try:
+            try:
+                self.resolve()
+                self.runBlock(self.body)
+            except ScriptError, e:
+                self._result.error = str(e)
+                self.write("%s: %s\n" % (self.name, e))
+        finally:
+            if self._buffer is not None:
+                sys.stdout = oldStdout
+                log.propagate = oldPropagate
+                log.removeHandler(logHandler)
+                for h in oldHandlers:
+                    log.addHandler(h)
+                self._buffer = None
+        self._result.elapsed = time.time() - start
+        return self._result
@@ -0,0 +1,176 @@
+'''
+Resident debugger server.
+
+Keeps one CommandInterpreter (and with it the JVM and the attached
+debugger) alive, and runs commands sent over a local socket.  The protocol
+is line based: the client sends one command per line, the server streams
+back the command's output and then a line holding only END_MARKER.  Lines
+starting with '!' are directives to the server rather than debugger
+commands:
+
+    !quiet      only report warnings and errors, as --script does
+    !verbose    report everything, as the interactive prompt does
+    !status     send the exit status of the last script run by 'source':
+                0 passed, 1 failed, 2 didn't parse, empty if none has run
+    !shutdown   disconnect from the target and stop the server
+    !token T    authenticate; when the server has a token, this must be the
+                client's first line
+
+'quit' ends the client's session but leaves the server running; in a
+script run with 'source' it is ignored.  'debug' is refused, since it would
+hand a Python prompt to whoever is connected.
+
+A plain path is a Unix socket; host:port (or :port) is a TCP socket on the
+given interface.  Jython has no Unix sockets, so use TCP there.  Anyone who
+can connect can drive the target, so listening on anything but the
+loopback interface needs a token.
+'''
+
+import os
+import sys
+import socket
+import logging
+
+END_MARKER = "\x04"
+
+# Environment variable holding the token, for the server and the client
+TOKEN_VARIABLE = "PICDB_TOKEN"
+
+class ServerError(Exception):
+    pass
+
+def parseAddress(address):
+    '''Return (family, address) for a socket path or [host]:port string.'''
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (socket.AF_INET, (host or "127.0.0.1", int(port)))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("Unix sockets not supported here; use host:port")
+    return (socket.AF_UNIX, address)
+
+def isLoopback(family, address):
+    '''True if a parseAddress() address only accepts local connections.'''
+    if family != socket.AF_INET:
+        return True # Unix sockets are guarded by file permissions
+    host = address[0]
+    return host == "localhost" or host.startswith("127.")
+
+class _SocketWriter:
+    '''File-like object that streams writes straight to a client.'''
+    def __init__(self, conn):
+        self._conn = conn
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            return
+        try:
+            self._conn.sendall(data)
+        except socket.error:
+            self.closed = True
+
+    def flush(self):
+        pass
+
+class DebugServer:
+    def __init__(self, interp, address, token=None):
+        '''token, if given, must be sent by each client with !token before
+        anything else.  Raises ServerError if address isn't loopback and
+        there is no token.'''
+        self._interp = interp
+        (self._family, self._address) = parseAddress(address)
+        self._token = token or None
+        if self._token is None and not isLoopback(self._family, self._address):
+            raise ServerError("Listening on %s needs a token (set %s)" %
+                              (self._address[0], TOKEN_VARIABLE))
+        self.log = logging.getLogger("picdb")
+
+    def _listen(self):
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        if self._family == getattr(socket, "AF_UNIX", None):
+            if os.path.exists(self._address):
+                os.unlink(self._address) # stale socket from an earlier run
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self._address)
+        sock.listen(1)
+        return sock
+
+    def serve(self):
+        '''Serve clients, one at a time, until a client sends !shutdown.'''
+        sock = self._listen()
+        self.log.warning("picdb server listening on %s" % (self._address,))
+        self._interp.running = True
+        self._interp.disableDebug()
+        try:
+            while self._interp.running:
+                (conn, _) = sock.accept()
+                try:
+                    self._serveClient(conn)
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+            if self._family == getattr(socket, "AF_UNIX", None) and \
+                    os.path.exists(self._address):
+                os.unlink(self._address)
+
+    def _serveClient(self, conn):
+        infile = conn.makefile("rb")
+        out = _SocketWriter(conn)
+        level = logging.INFO
+        if self._token is not None:
+            if infile.readline().strip() != "!token " + self._token:
+                self.log.warning("Refused a client with a bad token")
+                out.write("Error: bad or missing token\n" + END_MARKER + "\n")
+                infile.close()
+                return
+            out.write(END_MARKER + "\n")
+        while self._interp.running and not out.closed:
+            line = infile.readline()
+            if not line:
+                break
+            line = line.strip()
+            if line == "!quiet":
+                level = logging.WARNING
+            elif line == "!verbose":
+                level = logging.INFO
+            elif line == "!status":
+                status = self._interp.scriptStatus()
+                out.write("%s\n" % ("" if status is None else status))
+            elif line == "!shutdown":
+                self._interp.stopInputLoop()
+            elif line.startswith("!token"):
+                pass # already authenticated, or no token needed
+            elif line == "quit":
+                out.write(END_MARKER + "\n")
+                break
+            elif line:
+                self._execute(line, out, level)
+                if not self._interp.running:
+                    # 'quit' in a sourced script doesn't stop the server.
+                    self._interp.running = True
+            out.write(END_MARKER + "\n")
+        infile.close()
+
+    def _execute(self, line, out, level):
+        '''Run one command with its output sent to out.'''
+        handler = logging.StreamHandler(out)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        oldLevel = self.log.level
+        oldPropagate = self.log.propagate
+        oldStdout = sys.stdout
+        self.log.addHandler(handler)
+        self.log.propagate = False
+        self.log.setLevel(level)
+        sys.stdout = out
+        try:
+            try:
+                self._interp.executeCommand(line)
+            except Exception, e:
+                out.write("Error: %s\n" % e)
+        finally:
+            sys.stdout = oldStdout
+            self.log.setLevel(oldLevel)
+            self.log.propagate = oldPropagate
+            self.log.removeHandler(handler)
@@ -0,0 +1,794 @@
+import os
+import time
+import struct
+import threading
+
+from mdb.backend import Backend, BackendError, PIC32_REGISTERS
+from mdb.elf import ElfFile, ElfError
+from mdb.symbols import SymbolIndex
+from mdb.linetable import LineTable
+from mdb.dwarfline import lineRows
+from mdb.dwarfinfo import variableTypes, BaseType, StructType, ArrayType, \
+    DW_ATE_float
+
+'''
+Simulated target, for testing and benchmarking picdebugger without hardware.
+
+SimBackend runs in-process.  It loads a real ELF file: program segments go
+into a simulated flash, writable segments into RAM, symbols come from the
+ELF symbol table and source lines from its DWARF line table.  Every probe
+transaction (run control, PC and memory reads, breakpoint commits,
+programming) costs a configurable latency, so the host-side work of a
+command can be measured against a realistic number of round trips.
+
+The simulated CPU doesn't execute instructions.  Stepping moves the PC to
+the next line or instruction, and running moves it to the next enabled
+breakpoint after the PC (or the next address from a scripted list of stops)
+after runTime seconds, with RUN and HALT events sent as real tools do.
+'''
+
+class _SimType:
+    def __init__(self, code):
+        self._code = code
+
+    def value(self):
+        return self._code
+
+class SimTypes:
+    '''Stand-in for mdbcore's eFundamentalType enum.'''
+    ST_CHAR = _SimType(1)
+    ST_UCHAR = _SimType(2)
+    ST_SHORT = _SimType(3)
+    ST_USHORT = _SimType(4)
+    ST_INT = _SimType(5)
+    ST_UINT = _SimType(6)
+    ST_LONG = _SimType(7)
+    ST_ULONG = _SimType(8)
+    ST_FLOAT = _SimType(9)
+    ST_DOUBLE = _SimType(10)
+    ST_STRUCT = _SimType(11)
+    ST_UNION = _SimType(12)
+    ST_LONGLONG = _SimType(13)
+    ST_ULONGLONG = _SimType(14)
+
+# (size, signed) -> integer SimTypes member
+_intTypes = {
+    (1, True): SimTypes.ST_CHAR, (1, False): SimTypes.ST_UCHAR,
+    (2, True): SimTypes.ST_SHORT, (2, False): SimTypes.ST_USHORT,
+    (4, True): SimTypes.ST_INT, (4, False): SimTypes.ST_UINT,
+    (8, True): SimTypes.ST_LONGLONG, (8, False): SimTypes.ST_ULONGLONG,
+    }
+
+def _simType(vartype):
+    '''Return the SimTypes member for a dwarfinfo type, or None.  Arrays
+    have their element's type, as mdbcore reports them.'''
+    while isinstance(vartype, ArrayType):
+        vartype = vartype.element
+    if isinstance(vartype, StructType):
+        if vartype.kind == "union":
+            return SimTypes.ST_UNION
+        return SimTypes.ST_STRUCT
+    if isinstance(vartype, BaseType):
+        if vartype.encoding == DW_ATE_float:
+            return {4: SimTypes.ST_FLOAT, 8: SimTypes.ST_DOUBLE}.get(
+                vartype.size)
+        return _intTypes.get((vartype.size, vartype.isSigned()))
+    return None
+
+def elfSymbolTypes(elf):
+    '''Return name -> SimTypes member for the globals described by an
+    ElfFile's .debug_info, as mdbcore's symbol view would give them.'''
+    info = elf.section(".debug_info")
+    abbrev = elf.section(".debug_abbrev")
+    if not info or not abbrev:
+        return {}
+    try:
+        found = variableTypes(info, abbrev, elf.section(".debug_str") or "",
+                              elf.endian)
+    except (TypeError, struct.error, IndexError, KeyError, ValueError):
+        return {}
+    types = {}
+    for (name, vartype) in found.iteritems():
+        simType = _simType(vartype)
+        if simType is not None:
+            types[name] = simType
+    return types
+
+class _SimSymbol:
+    def __init__(self, address, vartype, length):
+        self._address = address
+        self._type = vartype
+        self._length = length
+
+    def Address(self):
+        return self._address
+
+    def Type(self):
+        return self._type
+
+    def ByteLength(self):
+        return self._length
+
+class _SimBreakpoint:
+    def __init__(self, address):
+        self.address = address
+        self.enabled = True
+
+class _SimDataBreakpoint:
+    def __init__(self, address, length, access, value):
+        self.address = address
+        self.length = length
+        self.access = access
+        self.value = value
+        self.enabled = True
+
+class SparseMemory:
+    '''Byte-addressable memory, allocated a page at a time.'''
+    PAGE_SIZE = 4096
+
+    def __init__(self, fill="\0"):
+        self._pages = {}
+        self._fill = fill * self.PAGE_SIZE
+
+    def read(self, addr, length):
+        chunks = []
+        while length > 0:
+            page = addr - addr % self.PAGE_SIZE
+            offset = addr - page
+            n = min(length, self.PAGE_SIZE - offset)
+            chunks.append(self._pages.get(page, self._fill)[offset:offset+n])
+            addr += n
+            length -= n
+        return "".join(chunks)
+
+    def write(self, addr, data):
+        while data:
+            page = addr - addr % self.PAGE_SIZE
+            offset = addr - page
+            n = min(len(data), self.PAGE_SIZE - offset)
+            old = self._pages.get(page, self._fill)
+            self._pages[page] = old[:offset] + data[:n] + old[offset+n:]
+            addr += n
+            data = data[n:]
+
+    def copy(self):
+        other = SparseMemory()
+        other._pages = dict(self._pages)
+        other._fill = self._fill
+        return other
+
+class SimBackend(Backend):
+    '''
+    In-process simulated target.
+
+    latency       seconds added to every probe transaction
+    runTime       seconds a 'run' takes before reaching its stop
+    stops         optional list of addresses successive runs halt at,
+                  instead of the next breakpoint
+    breakpointSlots  number of hardware program breakpoints
+    symbolTypes   optional name -> SimTypes member, for symbols the loaded
+                  ELF's debug information doesn't describe
+    onRun         optional callable(backend) invoked every runTime seconds
+                  while the target runs, and on every step, to change RAM
+                  as firmware would
+    dataBreakpointSlots  number of hardware data breakpoints, triggered
+                  by RAM changes and by accesses onRun reports with
+                  cpuAccess()
+    tools         number of debug tools to report as attached
+    liveSampling  whether the PC can be read while running, or profiling
+                  has to halt the target for each sample
+    ramSize       bytes of data RAM at RAM_BASE, for core dumps
+    '''
+    INSTRUCTION_SIZE = 4
+    RAM_BASE = 0xA0000000
+
+    def __init__(self, latency=0.0, runTime=0.001, stops=None,
+                 breakpointSlots=6, symbolTypes=None, onRun=None, tools=1,
+                 liveSampling=True, dataBreakpointSlots=2, ramSize=0x8000):
+        self.latency = latency
+        self.runTime = runTime
+        self._stops = list(stops or [])
+        self.breakpointSlots = breakpointSlots
+        self._givenTypes = symbolTypes or {}
+        self._symbolTypes = dict(self._givenTypes)
+        self.onRun = onRun
+        self.tools = tools
+        self.liveSampling = liveSampling
+        self.transactions = 0
+        self.bytesRead = 0
+        self.runs = 0
+        self.pc = 0
+        # The other CPU registers, for tests to set as firmware would
+        self.registers = dict([(x, 0) for x in PIC32_REGISTERS if x != "pc"])
+        self.registers["sp"] = self.RAM_BASE + ramSize
+        self.ram = SparseMemory()
+        self.flash = SparseMemory("\xff")
+        self._image = SparseMemory("\xff")
+        self._imageSegments = []
+        self._entry = 0
+        self._symbols = SymbolIndex()
+        self._lines = LineTable()
+        self._breakpoints = []
+        self.dataBreakpointSlots = dataBreakpointSlots
+        self.ramSize = ramSize
+        self._dataBreakpoints = []
+        # CPU accesses since the last tick, and the data breakpoints that
+        # triggered the last halt
+        self._accesses = []
+        self._dataHits = []
+        self._batch = False
+        self._batchChanged = False
+        self._listener = None
+        self._running = False
+        self._haltRequest = threading.Event()
+        self._lock = threading.Lock()
+
+    def _transaction(self, nbytes=0):
+        self.transactions += 1
+        self.bytesRead += nbytes
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _notify(self, event):
+        if self._listener is not None:
+            self._listener(event)
+
+    # Connection
+    def selectDevice(self, device):
+        self.device = device
+
+    def enumerateDevices(self):
+        if self.tools == 1:
+            return ["simulator"]
+        return ["simulator%d" % i for i in range(self.tools)]
+
+    def selectDebugger(self, tool):
+        pass
+
+    def connect(self, listener):
+        self._transaction()
+        self._listener = listener
+
+    def disconnect(self):
+        if self._running:
+            self.halt()
+        self._listener = None
+
+    def deviceFamily(self):
+        return "SIM"
+
+    # Program image
+    def load(self, path):
+        try:
+            elf = ElfFile(path)
+        except (ElfError, IOError):
+            raise BackendError("File not found.")
+        self._image = SparseMemory("\xff")
+        self._imageSegments = []
+        for seg in elf.segments():
+            if seg.isWritable():
+                self.ram.write(seg.vaddr, seg.data)
+            else:
+                self._image.write(seg.vaddr, seg.data)
+                self._imageSegments.append(seg)
+        self._entry = elf.entry
+        self._symbols = SymbolIndex.fromElf(elf)
+        self._symbolTypes = elfSymbolTypes(elf)
+        self._symbolTypes.update(self._givenTypes)
+        self._lines = LineTable()
+        debugLine = elf.section(".debug_line")
+        if debugLine:
+            for (addr, path, line, end) in lineRows(debugLine, elf.endian,
+                                                    8 if elf.is64 else 4):
+                self._lines.addRow(addr, os.path.abspath(path), line, end)
+        self._lines.finalize()
+
+    def program(self):
+        # Flash takes roughly one transaction per 4KB written
+        nbytes = sum([len(x.data) for x in self._imageSegments])
+        for _ in range(max(1, nbytes // 4096)):
+            self._transaction()
+        self.flash = self._image.copy()
+
+    def sourceFiles(self, path):
+        return list(self._lines.filenames)
+
+    # Run control
+    def run(self):
+        self._transaction()
+        self._lock.acquire()
+        try:
+            if self._running:
+                return
+            self._running = True
+            self._haltRequest.clear()
+            self._accesses = []
+            self._dataHits = []
+        finally:
+            self._lock.release()
+        self._notify(self.RUN)
+        t = threading.Thread(target=self._execute)
+        t.setDaemon(True)
+        t.start()
+
+    def _nextStop(self):
+        if self._stops:
+            return self._stops.pop(0)
+        addrs = sorted([x.address for x in self._breakpoints if x.enabled])
+        if not addrs:
+            return None
+        later = [x for x in addrs if x > self.pc]
+        if later:
+            return later[0]
+        return addrs[0]
+
+    def _execute(self):
+        # Run a tick at a time until halted, at a data breakpoint, or at the
+        # next stop.  Free running moves on a line every tick so the PC can
+        # be sampled.
+        stop = self._nextStop()
+        while True:
+            self._haltRequest.wait(self.runTime)
+            if self._haltRequest.isSet():
+                break
+            if self.onRun is not None:
+                self.onRun(self)
+            if self._dataBreakpointHit():
+                break
+            if stop is not None:
+                self.pc = stop
+                break
+            self.pc = self._nextLineAddress()
+        self.runs += 1
+        self._running = False
+        self._notify(self.HALT)
+
+    def halt(self):
+        self._transaction()
+        self._haltRequest.set()
+
+    def isRunning(self):
+        return self._running
+
+    def canSamplePC(self):
+        return self.liveSampling
+
+    def samplePC(self):
+        self._transaction()
+        return self.pc
+
+    def _step(self, nextpc):
+        self._transaction()
+        if self._running:
+            raise BackendError("Target is running.")
+        self.pc = nextpc
+        if self.onRun is not None:
+            self.onRun(self)
+
+    def _nextLineAddress(self):
+        addr = self._lines.addressAfter(self.pc)
+        if addr is None:
+            return self._entry
+        return addr
+
+    def stepIn(self):
+        self._step(self._nextLineAddress())
+
+    def stepOver(self):
+        self._step(self._nextLineAddress())
+
+    def stepInstr(self):
+        self._step(self.pc + self.INSTRUCTION_SIZE)
+
+    def reset(self):
+        self._transaction()
+        self.pc = self._entry
+
+    def getPC(self):
+        self._transaction()
+        return self.pc
+
+    def readRegisters(self):
+        self._transaction(4 * len(PIC32_REGISTERS))
+        return [(x, self.pc if x == "pc" else self.registers[x])
+                for x in PIC32_REGISTERS]
+
+    # Memory
+    def readMemory(self, addr, length, virtual):
+        self._transaction(length)
+        return self.ram.read(addr, length)
+
+    def memoryRegions(self):
+        return [("ram", self.RAM_BASE, self.ramSize)]
+
+    def writeMemory(self, addr, data):
+        '''Change simulated RAM, as firmware would.  Not a Backend method.'''
+        self.ram.write(addr, data)
+
+    def readProgramMemory(self, addr, length):
+        self._transaction(length)
+        return self.flash.read(addr, length)
+
+    def readProgramWord(self, addr):
+        return struct.unpack("<I", self._image.read(addr, 4))[0]
+
+    # Debug information
+    def sourceLineToAddress(self, path, line):
+        addr = self._lines.sourceLineToAddress(path, line, window=1)
+        if addr is None:
+            return None
+        return (addr, None)
+
+    def addressToSourceLine(self, addr):
+        return self._lines.addressToSourceLine(addr)
+
+    def lineInstructions(self, addr):
+        if self._lines.addressToSourceLine(addr) is None:
+            return None
+        return [(addr, self.INSTRUCTION_SIZE)]
+
+    def disassemble(self, word, nextword, addr):
+        return ".word 0x%08X" % word
+
+    def rawSymbol(self, name):
+        sym = self._symbols.lookup(name)
+        if sym is None:
+            return None
+        vartype = self._symbolTypes.get(name)
+        return _SimSymbol(sym.address, vartype.value() if vartype else 0,
+                          sym.size)
+
+    def typeEnum(self):
+        return SimTypes
+
+    # Breakpoints
+    def availableBreakpoints(self):
+        return self.breakpointSlots - len(self._breakpoints)
+
+    def _storeChanged(self):
+        # A breakpoint change costs a transaction, or one per batch.
+        if self._batch:
+            self._batchChanged = True
+        else:
+            self._transaction()
+
+    def beginBreakpoints(self):
+        self._batch = True
+        self._batchChanged = False
+
+    def commitBreakpoints(self):
+        if self._batchChanged:
+            self._transaction()
+        self._batch = False
+        self._batchChanged = False
+
+    def addBreakpoint(self, addr, file, line):
+        self._storeChanged()
+        if self.availableBreakpoints() <= 0:
+            return None
+        bp = _SimBreakpoint(addr)
+        self._breakpoints.append(bp)
+        return bp
+
+    def removeBreakpoint(self, handle):
+        self._storeChanged()
+        for bps in (self._breakpoints, self._dataBreakpoints):
+            if handle in bps:
+                bps.remove(handle)
+                return
+        raise BackendError("No such breakpoint")
+
+    def enableBreakpoint(self, handle, enabled):
+        self._storeChanged()
+        handle.enabled = enabled
+        if isinstance(handle, _SimDataBreakpoint):
+            handle.value = self.ram.read(handle.address, handle.length)
+
+    def availableDataBreakpoints(self):
+        return self.dataBreakpointSlots - len(self._dataBreakpoints)
+
+    def addDataBreakpoint(self, addr, length, access):
+        self._storeChanged()
+        if self.availableDataBreakpoints() <= 0:
+            return None
+        bp = _SimDataBreakpoint(addr, length, access,
+                                self.ram.read(addr, length))
+        self._dataBreakpoints.append(bp)
+        return bp
+
+    def cpuAccess(self, addr, length, data=None):
+        '''For onRun: the firmware reads length bytes at addr, or writes
+        data there.  Data breakpoints on them trigger even if a write
+        doesn't change the value.'''
+        if data is not None:
+            self.ram.write(addr, data)
+        self._accesses.append((addr, length, data is not None))
+
+    def dataBreakpointHits(self):
+        return list(self._dataHits)
+
+    def _dataBreakpointHit(self):
+        hits = []
+        for bp in self._dataBreakpoints:
+            if not bp.enabled:
+                continue
+            for (addr, length, write) in self._accesses:
+                if addr < bp.address + bp.length and \
+                        bp.address < addr + length and \
+                        (bp.access == self.ACCESS or
+                         bp.access == (self.WRITE if write else self.READ)):
+                    hits.append((bp, self.WRITE if write else self.READ))
+                    break
+            value = self.ram.read(bp.address, bp.length)
+            if value != bp.value:
+                bp.value = value
+                if bp.access != self.READ and \
+                        not [x for x in hits if x[0] is bp]:
+                    hits.append((bp, self.WRITE))
+        self._accesses = []
+        self._dataHits = hits
+        return bool(hits)
+
+def _elf32(sections, segments, entry):
+    '''
+    Build a little-endian 32-bit MIPS ELF image.  sections is a list of
+    (name, type, flags, addr, data, link, info, entsize), starting with the
+    null section; segments is a list of (section index, vaddr, paddr, flags).
+    '''
+    shstrtab = "\0"
+    nameOffsets = []
+    for name in [x[0] for x in sections] + [".shstrtab"]:
+        nameOffsets.append(len(shstrtab))
+        shstrtab += name + "\0"
+    sections = sections + [(".shstrtab", 3, 0, 0, shstrtab, 0, 0, 0)]
+
+    ehsize = 52
+    phoff = ehsize
+    offset = phoff + 32 * len(segments)
+    offsets = []
+    body = ""
+    for s in sections:
+        pad = -offset % 4
+        body += "\0" * pad
+        offset += pad
+        offsets.append(offset)
+        body += s[4]
+        offset += len(s[4])
+    offset += -offset % 4
+    body += "\0" * (offset - ehsize - 32 * len(segments) - len(body))
+    shoff = offset
+
+    out = struct.pack("<4sBBBB8sHHIIIIIHHHHHH", "\x7fELF", 1, 1, 1, 0, "\0" * 8,
+                      2, 8, 1, entry, phoff, shoff, 0, ehsize, 32,
+                      len(segments), 40, len(sections), len(sections) - 1)
+    for (index, vaddr, paddr, flags) in segments:
+        data = sections[index][4]
+        out += struct.pack("<IIIIIIII", 1, offsets[index], vaddr, paddr,
+                           len(data), len(data), flags, 4)
+    out += body
+    for (i, s) in enumerate(sections):
+        (name, stype, flags, addr, data, link, info, entsize) = s
+        out += struct.pack("<IIIIIIIIII", nameOffsets[i], stype, flags, addr,
+                           offsets[i], len(data), link,
+                           info, 4, entsize)
+    return out
+
+def _uleb(value):
+    out = ""
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out += chr(b | 0x80)
+        else:
+            return out + chr(b)
+
+def _sleb(value):
+    out = ""
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if (value == 0 and not b & 0x40) or (value == -1 and b & 0x40):
+            return out + chr(b)
+        out += chr(b | 0x80)
+
+def _debugLine(directory, filename, rows, endAddr):
+    '''Encode (addr, line) rows as a DWARF 2 line program.'''
+    header = struct.pack("<BBbBB", 1, 1, -5, 14, 10)
+    header += "".join([chr(x) for x in [0, 1, 1, 1, 1, 0, 0, 0, 1]])
+    header += directory + "\0\0"
+    header += filename + "\0" + _uleb(1) + _uleb(0) + _uleb(0) + "\0"
+    program = "\0" + _uleb(5) + "\x02" + struct.pack("<I", rows[0][0])
+    (addr, line) = (rows[0][0], 1)
+    for (rowAddr, rowLine) in rows:
+        program += "\x02" + _uleb(rowAddr - addr)
+        program += "\x03" + _sleb(rowLine - line)
+        program += "\x01"
+        (addr, line) = (rowAddr, rowLine)
+    program += "\x02" + _uleb(endAddr - addr)
+    program += "\0\x01\x01"
+    unit = struct.pack("<HI", 2, len(header)) + header + program
+    return struct.pack("<I", len(unit)) + unit
+
+# Abbreviations used by _debugInfo: code -> (tag, children, [(attr, form)])
+_ABBREVS = {
+    1: (0x11, 1, [(0x03, 0x08)]),                            # compile unit
+    2: (0x24, 0, [(0x03, 0x08), (0x0b, 0x0b), (0x3e, 0x0b)]), # base type
+    3: (0x13, 1, [(0x03, 0x08), (0x0b, 0x0b)]),               # struct
+    4: (0x17, 1, [(0x03, 0x08), (0x0b, 0x0b)]),               # union
+    5: (0x0d, 0, [(0x03, 0x08), (0x49, 0x13), (0x38, 0x0a)]), # member
+    6: (0x0d, 0, [(0x03, 0x08), (0x49, 0x13), (0x0b, 0x0b),   # bit field
+                  (0x0d, 0x0b), (0x0c, 0x0b), (0x38, 0x0a)]),
+    7: (0x01, 1, [(0x49, 0x13)]),                             # array
+    8: (0x21, 0, [(0x2f, 0x0f)]),                             # subrange
+    9: (0x34, 0, [(0x03, 0x08), (0x49, 0x13)]),               # variable
+    }
+
+def _debugInfo(variables):
+    '''
+    Encode [(name, type)] as a DWARF 2 .debug_info unit, returning it and
+    its .debug_abbrev.  A type is ("base", name, size, encoding),
+    ("struct" or "union", name, size, [member]) with each member
+    (name, offset, type) or (name, offset, type, bits, shift), or
+    ("array", type, count).
+    '''
+    abbrev = ""
+    for code in sorted(_ABBREVS):
+        (tag, children, specs) = _ABBREVS[code]
+        abbrev += _uleb(code) + _uleb(tag) + chr(children)
+        for (attr, form) in specs:
+            abbrev += _uleb(attr) + _uleb(form)
+        abbrev += "\0\0"
+    abbrev += "\0"
+
+    header = 11 # unit length, version, abbrev offset, address size
+    body = [_uleb(1) + "synthetic.c\0"]
+    offsets = {}
+    def size():
+        return header + sum([len(x) for x in body])
+    def location(offset):
+        op = chr(0x23) + _uleb(offset) # DW_OP_plus_uconst
+        return chr(len(op)) + op
+    def emit(t):
+        # Types are emitted before their users, so references go back.
+        if t in offsets:
+            return offsets[t]
+        if t[0] == "base":
+            offset = size()
+            body.append(_uleb(2) + t[1] + "\0" + chr(t[2]) + chr(t[3]))
+        elif t[0] in ("struct", "union"):
+            types = [emit(m[2]) for m in t[3]]
+            offset = size()
+            body.append(_uleb(3 if t[0] == "struct" else 4) + t[1] + "\0" +
+                        chr(t[2]))
+            for (m, ref) in zip(t[3], types):
+                if len(m) == 3:
+                    body.append(_uleb(5) + m[0] + "\0" +
+                                struct.pack("<I", ref) + location(m[1]))
+                else:
+                    # DWARF 2 counts bit offsets from the unit's top bit.
+                    unitBits = m[2][2] * 8
+                    body.append(_uleb(6) + m[0] + "\0" +
+                                struct.pack("<I", ref) + chr(m[2][2]) +
+                                chr(m[3]) + chr(unitBits - m[4] - m[3]) +
+                                location(m[1]))
+            body.append("\0")
+        else:
+            ref = emit(t[1])
+            offset = size()
+            body.append(_uleb(7) + struct.pack("<I", ref))
+            body.append(_uleb(8) + _uleb(t[2] - 1) + "\0")
+        offsets[t] = offset
+        return offset
+    for (name, t) in variables:
+        ref = emit(t)
+        body.append(_uleb(9) + name + "\0" + struct.pack("<I", ref))
+    body.append("\0")
+    unit = struct.pack("<HIB", 2, 0, 4) + "".join(body)
+    return (struct.pack("<I", len(unit)) + unit, abbrev)
+
+def makeSyntheticProgram(directory, functions=64, linesPerFunction=16,
+                         globals=40, sampleCount=2048):
+    '''
+    Write a generated C source file and a matching ELF file (code, data,
+    symbols, line table and the types of the globals, no real instructions)
+    into directory.  Returns (elf path, symbolTypes) for SimBackend; the
+    same types are in the ELF's debug information.
+    '''
+    TEXT = 0x9D000000
+    DATA = 0xA0000000
+    source = ["/* Generated by picdb's simulator. */"]
+    symbols = [] # (name, value, size, info, section)
+    types = {}
+    described = [] # (name, type) for .debug_info
+    data = ""
+    def addGlobal(name, decl, size, vartype, dwarfType, init=""):
+        symbols.append((name, DATA + len(data), size, 0x11, 2))
+        types[name] = vartype
+        described.append((name, dwarfType))
+        source.append(decl)
+        return init + "\0" * (size - len(init))
+    INT = ("base", "int", 4, 5)
+    UINT = ("base", "unsigned int", 4, 7)
+    SHORT = ("base", "short int", 2, 5)
+    CHAR = ("base", "char", 1, 6)
+    UCHAR = ("base", "unsigned char", 1, 8)
+    data += addGlobal("counter", "volatile int counter;", 4, SimTypes.ST_INT,
+                      INT)
+    for i in range(globals):
+        data += addGlobal("var_%d" % i, "volatile int var_%d;" % i, 4,
+                          SimTypes.ST_INT, INT, struct.pack("<i", i))
+    data += addGlobal("message", 'char message[32] = "hello, simulator";', 32,
+                      SimTypes.ST_CHAR, ("array", CHAR, 32),
+                      "hello, simulator")
+    data += addGlobal("samples", "short samples[%d];" % sampleCount,
+                      2 * sampleCount, SimTypes.ST_SHORT,
+                      ("array", SHORT, sampleCount),
+                      struct.pack("<%dh" % sampleCount,
+                                  *[(x * 37) % 2000 - 1000
+                                    for x in range(sampleCount)]))
+    aggregates = [
+        ("config", "struct config { int baud; short flags; char name[6]; "
+         "unsigned mode : 3; unsigned enabled : 1; } config;",
+         ("struct", "config", 16,
+          (("baud", 0, INT), ("flags", 4, SHORT),
+           ("name", 6, ("array", CHAR, 6)),
+           ("mode", 12, UINT, 3, 0), ("enabled", 12, UINT, 1, 3))),
+         SimTypes.ST_STRUCT,
+         struct.pack("<ih6sI", 115200, 3, "uart1", 5 | 1 << 3)),
+        ("points", "struct point { short x; short y; } points[3];",
+         ("array", ("struct", "point", 4, (("x", 0, SHORT), ("y", 2, SHORT))),
+          3),
+         SimTypes.ST_STRUCT, struct.pack("<6h", 1, 2, 3, 4, -5, 6)),
+        ("word", "union word { int i; unsigned char b[4]; } word;",
+         ("union", "word", 4, (("i", 0, INT), ("b", 0, ("array", UCHAR, 4)))),
+         SimTypes.ST_UNION, struct.pack("<i", 0x01020304)),
+        ]
+    for (name, decl, t, vartype, init) in aggregates:
+        data += addGlobal(name, decl, len(init), vartype, t, init)
+    (debugInfo, debugAbbrev) = _debugInfo(described)
+    text = ""
+    rows = []
+    for f in range(functions):
+        source.append("")
+        source.append("void func_%d(void)" % f)
+        source.append("{")
+        start = TEXT + len(text)
+        for l in range(linesPerFunction):
+            source.append("    var_%d += %d;" % ((f + l) % globals, l))
+            rows.append((TEXT + len(text), len(source)))
+            text += struct.pack("<I", 0x24000000 | (f << 8) | l)
+        source.append("}")
+        symbols.append(("func_%d" % f, start, TEXT + len(text) - start,
+                        0x12, 1))
+
+    srcpath = os.path.join(directory, "synthetic.c")
+    f = open(srcpath, "w")
+    f.write("\n".join(source) + "\n")
+    f.close()
+
+    strtab = "\0"
+    symtab = "\0" * 16
+    for (name, value, size, info, shndx) in symbols:
+        symtab += struct.pack("<IIIBBH", len(strtab), value, size, info, 0,
+                              shndx)
+        strtab += name + "\0"
+    sections = [
+        ("", 0, 0, 0, "", 0, 0, 0),
+        (".text", 1, 6, TEXT, text, 0, 0, 0),
+        (".data", 1, 3, DATA, data, 0, 0, 0),
+        (".debug_line", 1, 0, 0,
+         _debugLine(os.path.abspath(directory), "synthetic.c", rows,
+                    TEXT + len(text)), 0, 0, 0),
+        (".debug_info", 1, 0, 0, debugInfo, 0, 0, 0),
+        (".debug_abbrev", 1, 0, 0, debugAbbrev, 0, 0, 0),
+        (".symtab", 2, 0, 0, symtab, 7, 1, 16),
+        (".strtab", 3, 0, 0, strtab, 0, 0, 0),
+        ]
+    image = _elf32(sections, [(1, TEXT, TEXT & 0x1FFFFFFF, 5),
+                              (2, DATA, DATA & 0x1FFFFFFF, 6)], TEXT)
+    elfpath = os.path.join(directory, "synthetic.elf")
+    f = open(elfpath, "wb")
+    f.write(image)
+    f.close()
+    return (elfpath, types)
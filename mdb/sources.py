@@ -0,0 +1,126 @@
+'''
+Source files for listings and stop display.
+
+Each file is memory-mapped (read whole under Jython, which has no mmap)
+and indexed by line start offsets once, so fetching any line is a slice.
+Files are re-read if their size or mtime changes.  PathIndex finds a
+compilation unit's absolute path from the name a user types.
+'''
+
+import os
+import array
+try:
+    import mmap
+except ImportError:
+    mmap = None # not available under Jython
+
+class SourceFile:
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            st = os.fstat(f.fileno())
+            self.stamp = (st.st_size, st.st_mtime)
+            self._data = ""
+            if st.st_size and mmap is not None:
+                try:
+                    self._data = mmap.mmap(f.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+                except (mmap.error, ValueError):
+                    pass
+            if not self._data:
+                self._data = f.read()
+        finally:
+            f.close()
+        self._starts = array.array('L', [0])
+        data = self._data
+        pos = data.find("\n")
+        while pos >= 0:
+            self._starts.append(pos + 1)
+            pos = data.find("\n", pos + 1)
+        if self._starts[-1] == len(data):
+            self._starts.pop() # no partial last line
+
+    def __len__(self):
+        return len(self._starts)
+
+    def line(self, n):
+        '''Return the text of line n (from 1), without its line ending, or
+        None.'''
+        if not 1 <= n <= len(self._starts):
+            return None
+        start = self._starts[n-1]
+        if n < len(self._starts):
+            end = self._starts[n] - 1
+        else:
+            end = len(self._data)
+        return self._data[start:end].rstrip("\r\n")
+
+    def lines(self, first, last):
+        '''Return [(n, text)] for the lines from first to last that exist.'''
+        first = max(first, 1)
+        last = min(last, len(self._starts))
+        return [(n, self.line(n)) for n in range(first, last + 1)]
+
+    def close(self):
+        if mmap is not None and isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+class SourceCache:
+    def __init__(self):
+        self._files = {}
+
+    def get(self, path):
+        '''Return the SourceFile for path, or None if it can't be read.'''
+        cached = self._files.get(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if cached is not None:
+            if cached.stamp == (st.st_size, st.st_mtime):
+                return cached
+            cached.close()
+            del self._files[path]
+        try:
+            source = SourceFile(path)
+        except (IOError, OSError):
+            return None
+        self._files[path] = source
+        return source
+
+    def line(self, path, n):
+        '''Return the text of line n of path, or None.'''
+        source = self.get(path)
+        if source is None:
+            return None
+        return source.line(n)
+
+    def clear(self):
+        for source in self._files.values():
+            source.close()
+        self._files = {}
+
+class PathIndex:
+    '''Finds source paths by basename, falling back to a substring search
+    of the paths for anything else.'''
+    def __init__(self, paths=()):
+        self._paths = []
+        self._byName = {}
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            self._paths.append(path)
+            self._byName.setdefault(os.path.basename(path), []).append(path)
+
+    def find(self, filename):
+        '''Return the absolute path of an existing source file for filename
+        (a basename, or the end of a path), or None.'''
+        for path in self._byName.get(os.path.basename(filename), []):
+            if path == filename or path.endswith("/" + filename) or \
+                    "/" not in filename:
+                return path
+        for path in self._paths:
+            if path.rfind(filename) >= 0:
+                return path
+        return None
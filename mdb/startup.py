@@ -0,0 +1,32 @@
+import time
+
+class StartupProfile:
+    '''
+    Records how long each start-up phase (imports, Java class loading,
+    connecting, loading) took, in the order they happened.
+    '''
+    def __init__(self):
+        self.created = time.time()
+        self.phases = []
+        self._open = {}
+
+    def begin(self, name):
+        self._open[name] = time.time()
+
+    def end(self, name):
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.record(name, time.time() - start)
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def report(self, out):
+        '''Write a table of phases to the file-like object out.'''
+        out.write("Startup profile:\n")
+        for (name, seconds) in self.phases:
+            out.write("  %-40s %8.1f ms\n" % (name, seconds * 1000.0))
+        out.write("  %-40s %8.1f ms\n" % ("total since start",
+                                          (time.time() - self.created) * 1000.0))
+
+profile = StartupProfile()
@@ -0,0 +1,86 @@
+import array
+import bisect
+import fnmatch
+
+from mdb.elf import ElfFile
+
+class Symbol:
+    FUNCTION = "func"
+    OBJECT = "object"
+    OTHER = "other"
+
+    def __init__(self, name, address, size, kind):
+        self.name = name
+        self.address = address
+        self.size = size
+        self.kind = kind
+
+class SymbolIndex:
+    '''
+    Symbol table built once per load.  Names are kept sorted for prefix and
+    glob queries, and functions/objects are kept address-ordered for
+    address -> symbol+offset lookups.
+    '''
+    def __init__(self, symbols=()):
+        self._byName = {}
+        for sym in symbols:
+            # Prefer a sized, typed definition over aliases/labels.
+            old = self._byName.get(sym.name)
+            if old is None or (old.kind == Symbol.OTHER and
+                               sym.kind != Symbol.OTHER):
+                self._byName[sym.name] = sym
+        self.names = sorted(self._byName.keys())
+        located = sorted([(s.address, s.name) for s in self._byName.values()
+                          if s.kind != Symbol.OTHER])
+        self._addrs = array.array('L', [x[0] for x in located])
+        self._addrNames = [x[1] for x in located]
+
+    @classmethod
+    def fromElf(cls, elf):
+        '''Build the index from an ElfFile.'''
+        kinds = {ElfFile.STT_FUNC: Symbol.FUNCTION,
+                 ElfFile.STT_OBJECT: Symbol.OBJECT}
+        return cls([Symbol(name, value, size, kinds.get(stype, Symbol.OTHER))
+                    for (name, value, size, stype) in elf.symbols()])
+
+    def __len__(self):
+        return len(self.names)
+
+    def allSymbols(self):
+        '''Return every indexed symbol, in name order.'''
+        return [self._byName[x] for x in self.names]
+
+    def lookup(self, name):
+        return self._byName.get(name)
+
+    def withPrefix(self, prefix):
+        '''Return the sorted names starting with prefix.'''
+        start = bisect.bisect_left(self.names, prefix)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            end += 1
+        return self.names[start:end]
+
+    def match(self, pattern):
+        '''Return symbols whose names match a glob pattern, or start with
+        pattern if it has no wildcards.'''
+        wild = [pattern.find(c) for c in "*?[" if c in pattern]
+        if not wild:
+            names = self.withPrefix(pattern)
+        else:
+            names = [x for x in self.withPrefix(pattern[:min(wild)])
+                     if fnmatch.fnmatchcase(x, pattern)]
+        return [self._byName[x] for x in names]
+
+    def symbolForAddress(self, addr):
+        '''Return (symbol, offset) of the nearest function or object at or
+        below addr, or None.  Addresses past the end of a sized symbol don't
+        match it.'''
+        i = bisect.bisect_right(self._addrs, addr) - 1
+        if i < 0:
+            return None
+        sym = self._byName[self._addrNames[i]]
+        offset = addr - sym.address
+        if sym.size and offset >= sym.size:
+            return None
+        return (sym, offset)
@@ -0,0 +1,101 @@
+'''
+PC traces recorded while stepping.
+
+A trace file is MAGIC followed by little-endian 32-bit PCs, one per step,
+written in blocks as stepping goes on.  Nothing is looked up while
+recording; Annotator adds function, source line and disassembly
+afterwards, looking up each distinct PC only once.
+'''
+
+import struct
+
+MAGIC = "PICDBTR\x01"
+
+class TraceError(Exception):
+    pass
+
+class TraceWriter:
+    '''Streams PCs to a trace file.'''
+    # PCs buffered before a write to the file.
+    BLOCK = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._buf = []
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def add(self, pc):
+        self._buf.append(pc)
+        self.count += 1
+        if len(self._buf) >= self.BLOCK:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            self._file.write(struct.pack("<%dI" % len(self._buf), *self._buf))
+            self._buf = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+def readTrace(path):
+    '''Return the list of PCs in a trace file.'''
+    f = open(path, "rb")
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if data[:len(MAGIC)] != MAGIC:
+        raise TraceError("%s is not a picdb trace file" % path)
+    data = data[len(MAGIC):]
+    n = len(data) // 4
+    return list(struct.unpack("<%dI" % n, data[:n*4]))
+
+class Annotator:
+    '''Describes PCs, caching the lookups for each distinct PC.'''
+    def __init__(self, dbg):
+        self._dbg = dbg
+        self._cache = {}
+
+    def annotate(self, pc):
+        '''Return (function, offset, file, line, instruction) for pc.
+        function is None if no symbol covers pc.'''
+        info = self._cache.get(pc)
+        if info is None:
+            found = self._dbg.symbolForAddress(pc)
+            (function, offset) = found or (None, 0)
+            (file, line) = self._dbg.addressToSourceLine(pc)
+            info = (function, offset, file, line, self._dbg.disassemble(pc))
+            self._cache[pc] = info
+        return info
+
+    def describe(self, pc):
+        '''Return a one-line description of pc.'''
+        (function, offset, file, line, text) = self.annotate(pc)
+        where = "%s+%d" % (function, offset) if function else "?"
+        return "0x%08X %-24s %s:%d  %s" % (pc, where, file, line, text)
+
+def summarize(pcs, annotator, top=10):
+    '''Return report lines for a trace: step count, then the functions and
+    source lines with the most steps.'''
+    functions = {}
+    lines = {}
+    for pc in pcs:
+        (function, offset, file, line, text) = annotator.annotate(pc)
+        functions[function or "?"] = functions.get(function or "?", 0) + 1
+        key = "%s:%d" % (file, line)
+        lines[key] = lines.get(key, 0) + 1
+    out = ["%d steps, %d distinct PCs, %d functions." %
+           (len(pcs), len(set(pcs)), len(functions))]
+    if not pcs:
+        return out
+    for (title, counts) in [("Functions", functions), ("Lines", lines)]:
+        out.append("%s:" % title)
+        ranked = sorted(counts.items(), key=lambda x: (-x[1], x[0]))
+        for (name, n) in ranked[:top]:
+            out.append("  %7d %5.1f%%  %s" % (n, 100.0 * n / len(pcs), name))
+    return out
@@ -1,38 +1,128 @@
 import os
+import re
 import sys
 import pdb
 import bdb
 import time
-import string
+import struct
 import signal
 import logging
 import operator
+import threading
 from optparse import OptionParser
+try:
+    import readline
+except ImportError:
+    readline = None
 
+from mdb.startup import profile as startupProfile
+startupProfile.begin("import mdb.picdebugger")
 from mdb.picdebugger import picdebugger
+from mdb.backend import Backend, BackendError
+startupProfile.end("import mdb.picdebugger")
+from mdb.layout import formatValue
+from mdb.server import DebugServer, ServerError, TOKEN_VARIABLE
+from mdb.eventloop import EventLoop
+from mdb.trace import TraceWriter, TraceError, readTrace, Annotator, summarize
+from mdb.condition import ConditionError
+from mdb.script import Script, ScriptError
+from mdb.profiler import sample, histograms, report, writeCollapsed
+from mdb.livelog import LogError
+
+_COMMAND_WORD = re.compile(r"\s*([A-Za-z]+)")
 
 class CommandHandler:
-    def __init__(self, quitCB):
-        self.dbg = picdebugger()
+    def __init__(self, quitCB, backend=None):
+        self.dbg = picdebugger(backend)
         self._quitCB = quitCB
         self.log = logging.getLogger("picdb")
         self.log.setLevel(logging.INFO)
+        self._displays = []
+        self._background = False
+        self.scheduler = None
+        self._busy = False
+        self._interrupted = False
+        self._traceWriter = None
+        self._lastTrace = []
+        self._listNext = None
+        # Exit status of the last script run by 'source'; see runScript()
+        self.scriptStatus = None
+        self.allowDebug = True
         self._commandMap = {
-        "connect": {'fn': self.cmdConnect, 'help': "Conects to a PIC target."},
+        "connect": {'fn': self.cmdConnect, 'help': "Conects to a PIC target.", 'target': True},
         "load": {'fn': self.cmdLoad, 'help': "Load ELF file onto target."},
-        "step": {'fn': self.cmdStep, 'help': "Step to next source line."},
-        "stepi": {'fn': self.cmdStepi, 'help': "Step to next assembly instruction."},
-        "next": {'fn': self.cmdNext, 'help': "Step to next source line, over functions."},
+        "step": {'fn': self.cmdStep, 'help': "Step to next source line.", 'target': True},
+        "stepi": {'fn': self.cmdStepi, 'help': "Step to next assembly instruction.", 'target': True},
+        "next": {'fn': self.cmdNext, 'help': "Step to next source line, over functions.", 'target': True},
+        "until": {'fn': self.cmdUntil, 'help': "Step until reaching a location.", 'target': True},
+        "finish": {'fn': self.cmdFinish, 'help': "Step until the current function returns.", 'target': True},
+        "trace": {'fn': self.cmdTrace, 'help': "Record and summarize stepping traces."},
+        "profile": {'fn': self.cmdProfile, 'help': "Sample where the running target spends its time.", 'target': True},
+        "log": {'fn': self.cmdLog, 'help': "Log variables from the running target to a file.", 'target': True},
         "quit": {'fn': self.cmdQuit, 'help': "Quits this program."},
         "help": {'fn': self.cmdHelp, 'help': "Displays this help."},
         "debug": {'fn': self.cmdDebug, 'help': "Drop to Python console."},
-        "break": {'fn': self.cmdBreak, 'help': "Set breakpoint."},
-        "continue": {'fn': self.cmdContinue, 'help': "Continue running target."},
-        "print": {'fn': self.cmdPrint, 'help': "Display variable."},
+        "break": {'fn': self.cmdBreak, 'help': "Set breakpoint.", 'target': True},
+        "continue": {'fn': self.cmdContinue, 'help': "Continue running target.", 'target': True},
+        "halt": {'fn': self.cmdHalt, 'help': "Halt the running target.", 'target': True},
+        "every": {'fn': self.cmdEvery, 'help': "Run a command periodically."},
+        "print": {'fn': self.cmdPrint, 'help': "Display variables."},
+        "display": {'fn': self.cmdDisplay, 'help': "Display variables at every stop."},
+        "undisplay": {'fn': self.cmdUndisplay, 'help': "Remove variables from display list."},
         "breakpoints": {'fn': self.cmdBreakpoints, 'help': "List breakpoints."},
+        "delete": {'fn': self.cmdDelete, 'help': "Delete breakpoints."},
+        "enable": {'fn': self.cmdEnable, 'help': "Enable breakpoints."},
+        "disable": {'fn': self.cmdDisable, 'help': "Disable breakpoints."},
+        "source": {'fn': self.cmdSource, 'help': "Run commands from a file."},
+        "watch": {'fn': self.cmdWatch, 'help': "Stop when a variable is written.", 'target': True},
+        "rwatch": {'fn': self.cmdRwatch, 'help': "Stop when a variable is read.", 'target': True},
+        "awatch": {'fn': self.cmdAwatch, 'help': "Stop when a variable is read or written.", 'target': True},
+        "condition": {'fn': self.cmdCondition, 'help': "Set a breakpoint's condition."},
+        "ignore": {'fn': self.cmdIgnore, 'help': "Ignore a breakpoint's next hits."},
         "list": {'fn': self.cmdList, 'help': "Display source code listing."},
+        "disassemble": {'fn': self.cmdDisassemble, 'help': "Disassemble program memory."},
+        "x": {'fn': self.cmdExamine, 'help': "Examine memory: x/<count><i|x|b> <address>."},
+        "dump": {'fn': self.cmdDump, 'help': "Save target memory to a core file.", 'target': True},
+        "stats": {'fn': self.cmdStats, 'help': "Show time spent in debugger calls."},
+        "info": {'fn': self.cmdInfo, 'help': "Display information about the program."},
+        }
+        self._infoMap = {
+        "symbols": self.infoSymbols,
+        "symbol": self.infoSymbol,
+        "registers": self.infoRegisters,
         }
 
+    def lookupCommand(self, input):
+        '''Return (command, handler, args) for a command line, or None if
+        it doesn't start with a known command: its leading run of
+        letters.'''
+        m = _COMMAND_WORD.match(input)
+        if m is None:
+            return None
+        cmd = m.group(1).lower()
+        info = self._commandMap.get(cmd)
+        if info is None:
+            return None
+        return (cmd, info['fn'], input[m.end():].strip())
+
+    def runCommand(self, cmd, fn, args):
+        '''Run a command found by lookupCommand().'''
+        if self._commandMap[cmd].get('target') and \
+                not self.dbg.backend.hasTarget():
+            self.log.info("No target: debugging a core file.")
+            return
+        self.dbg.stats.beginCommand(cmd)
+        try:
+            fn(args)
+        finally:
+            self.dbg.stats.endCommand()
+
+    def executeCommand(self, input):
+        self.reportPendingStop()
+        found = self.lookupCommand(input)
+        if found is not None:
+            self.runCommand(*found)
+
     def cmdConnect(self, args):
         '''
 Connects to a PIC target.
@@ -47,35 +137,113 @@ ex: connect PIC32MX150F128B
         self.dbg.selectDebugger()
         self.dbg.connect()
 
+    def _printValues(self, exprs):
+        '''Log the value of each expression, reading all symbols at once.'''
+        symbols = [x for x in exprs if x[0] != "$"]
+        values = dict(zip(symbols, self.dbg.getSymbolValues(symbols)))
+        for expr in exprs:
+            if expr.lower() == "$pc":
+                self.log.warning("PC: 0x%X" % self.dbg.getPC())
+            elif expr[0] == "$":
+                try:
+                    value = self.dbg.register(expr[1:])
+                except BackendError, e:
+                    self.log.warning("%s: %s" % (expr, e))
+                    continue
+                if value is None:
+                    self.log.warning("Unknown register: %s" % expr)
+                else:
+                    self.log.warning("%s = 0x%08X" % (expr, value))
+            elif values[expr] is not None:
+                self.log.warning("%s = %s" % (expr, formatValue(values[expr])))
+            else:
+                self.log.warning("%s: Symbol not found." % expr)
+
+    def _showDisplays(self):
+        '''Print the display list.  Called whenever the target stops.'''
+        if self._displays:
+            self._printValues(self._displays)
+
     def cmdPrint(self, args):
         '''
-Prints a variable or register.
-Usage: print <variable or register>
-Supported registers:
- * $pc
+Prints variables or registers.
+Usage: print <variable or register> [<variable or register> ...]
+Arrays can be indexed or sliced:
+    print samples[3]
+    print buf[100:200]
+Registers are written with a '$': $pc, $sp, $ra, $v0, $status ...  See
+'info registers' for the full set.
+Structs and unions are decoded member by member from the ELF's debug
+information, e.g. {baud = 9600, flags = 3}.  Without it they print as
+'<struct not decoded>' followed by their bytes in hex.
+'''
+        exprs = args.replace(",", " ").split()
+        if not exprs:
+            self.log.info("Not enough arguments")
+            return
+        self._printValues(exprs)
+
+    def cmdDisplay(self, args):
+        '''
+Adds variables or registers to the display list, which is printed every time
+the target stops.  Without arguments, prints the display list now.
+Usage: display [<variable or register> ...]
+'''
+        exprs = args.replace(",", " ").split()
+        if not exprs:
+            for (i, expr) in enumerate(self._displays):
+                self.log.info("%d: %s" % (i, expr))
+            self._showDisplays()
+            return
+        for expr in exprs:
+            if expr not in self._displays:
+                self._displays.append(expr)
+        self._printValues(exprs)
+
+    def cmdUndisplay(self, args):
+        '''
+Removes entries from the display list, by number or by name.  Without
+arguments, clears the whole list.
+Usage: undisplay [<number or name> ...]
 '''
-        if args[0] != "$":
-            data = self.dbg.getSymbolValue(args)
-            if data is not None:
-                self.log.warning("%s = %s" % (args, data))
+        items = args.replace(",", " ").split()
+        if not items:
+            self._displays = []
+            return
+        remove = set()
+        for item in items:
+            num = self._safeStrToInt(item)
+            if num is not None and 0 <= num < len(self._displays):
+                remove.add(self._displays[num])
+            elif item in self._displays:
+                remove.add(item)
             else:
-                self.log.warning("Symbol not found.")
-        if args.lower() == "$pc":
-            self.log.warning("PC: 0x%X" % self.dbg.getPC())
+                self.log.info("No display entry: %s" % item)
+        self._displays = [x for x in self._displays if x not in remove]
 
     def cmdDebug(self, args):
         '''
-Drops to a Python prompt for debug-level introspection.
+Drops to a Python prompt for debug-level introspection.  Not available
+through picdbclient.py.
 Usage: debug
 '''
+        if not self.allowDebug:
+            self.log.info("debug is not available over a server connection.")
+            return
         pdb.set_trace()
 
     def cmdLoad(self, args):
         '''
 Load an ELF file onto target board.
-Usage: load <file>
+Usage: load [-f] <file>
 <file> can be a full absolute path, or relative to the working directory.
+Programming is skipped if the target already holds the same image.  -f
+programs the target anyway.
 '''
+        force = False
+        if args.startswith("-f "):
+            force = True
+            args = args[3:].strip()
         fullpath = args
         if fullpath[0] != '/':
             cwd = os.getcwd()
@@ -85,7 +253,9 @@ Usage: load <file>
         if not os.path.exists(fullpath):
             self.log.error("File does not exist.")
             return
-        self.dbg.load(fullpath)
+        self.dbg.load(fullpath, force)
+        if not self.dbg.backend.hasTarget():
+            return
         self.log.info("Resetting target...")
         self.dbg.reset()
         pc = self.dbg.getPC()
@@ -112,17 +282,9 @@ Usage: load <file>
         except ValueError:
             return None
 
-    def cmdBreak(self, args):
-        '''
-Set a breakpoint
-Usage:
-    break *<address>
-    break <file>:<line>
-    break <line>
-    break <function name>
-<address> is a memory address specified in decimal, or hexadecimal with an '0x'
-prefix.
-'''
+    def resolveLocation(self, args):
+        '''Return the address of a location given as *<address>,
+        <file>:<line>, <line> or <function name>, or None.'''
         elems = args.split(":")
         if args[0] == "*": # *<address>
             addr = self._safeStrToInt(args[1:])
@@ -134,13 +296,267 @@ prefix.
                 addr = self._addrLine(num)
             else:
                 addr = self._addrFunction(elems[0])
-        result = self.dbg.setBreakpoint(addr)
+        return addr
+
+    def cmdBreak(self, args):
+        '''
+Set a breakpoint
+Usage:
+    break *<address>
+    break <file>:<line>
+    break <line>
+    break <function name>
+    break <location> if <condition>
+<address> is a memory address specified in decimal, or hexadecimal with an '0x'
+prefix.
+A conditional breakpoint only stops when <condition> is true; otherwise the
+target is resumed at once, without reporting.  Conditions are C expressions
+over global variables, e.g. 'count > 100 && buf[2] != 0'.  See also
+'condition' and 'ignore'.
+'''
+        (location, sep, conditionText) = args.partition(" if ")
+        condition = None
+        if sep:
+            try:
+                condition = self.dbg.compileCondition(conditionText)
+            except ConditionError, e:
+                self.log.info("%s" % e)
+                return
+        addr = self.resolveLocation(location.strip())
+        existing = addr is not None and self.dbg.breakpointAt(addr)
+        if existing:
+            self.log.info("Breakpoint %d is already at 0x%X." %
+                          (existing.number, addr))
+            return
+        result = addr is not None and self.dbg.setBreakpoint(addr)
         if result:
             (file,line) = self.dbg.addressToSourceLine(addr)
             self.log.info("New breakpoint at 0x%X (%s:%d)" % (addr, file, line))
+            if condition is not None:
+                i = self.dbg.breakpointIndexForAddress(addr)
+                self.dbg.getBreakpoint(i).condition = condition
         else:
             self.log.info("Failed to set breakpoint.")
 
+    def _watch(self, access, args):
+        software = False
+        if args.startswith("-s "):
+            software = True
+            args = args[3:].strip()
+        if not args:
+            self.log.info("Usage: watch [-s] <symbol>")
+            return
+        result = self.dbg.setWatchpoint(args, access, software)
+        if isinstance(result, str):
+            self.log.info(result)
+            return
+        wp = self.dbg.getBreakpoint(result)
+        if wp.software and not software:
+            self.log.info("No hardware watchpoint available; 'continue' will "
+                          "single-step instead, which is much slower.")
+        self.log.info("%s%s %d: %s" % ("Software " if wp.software else
+                                       "Hardware ", wp.kind, result, args))
+
+    def cmdWatch(self, args):
+        '''
+Stop the target when a variable is written.
+Usage: watch [-s] <symbol>
+<symbol> may be indexed or sliced, as for 'print', or *<address>.
+Uses a hardware data breakpoint.  With -s, or when the tool has none free,
+a software watchpoint makes 'continue' single-step instead, checking the
+watched memory after each instruction; this is much slower than running.
+^C stops the stepping where it is.
+'''
+        self._watch(Backend.WRITE, args)
+
+    def cmdRwatch(self, args):
+        '''
+Stop the target when a variable is read.  Needs a hardware data breakpoint.
+Usage: rwatch <symbol>
+'''
+        self._watch(Backend.READ, args)
+
+    def cmdAwatch(self, args):
+        '''
+Stop the target when a variable is read or written.  Needs a hardware data
+breakpoint.
+Usage: awatch <symbol>
+'''
+        self._watch(Backend.ACCESS, args)
+
+    def _breakpointArg(self, arg):
+        '''Return the breakpoint numbered by arg, or None after saying why.'''
+        bp = self.dbg.getBreakpoint(self._safeStrToInt(arg))
+        if bp is None:
+            self.log.info("No breakpoint %s." % arg)
+        return bp
+
+    def _breakpointArgs(self, args, usage):
+        '''Return the breakpoints numbered in args, all of them if args is
+        empty, or None after saying why.'''
+        if not args:
+            return [self.dbg.getBreakpoint(x[0])
+                    for x in self.dbg.allBreakpoints()]
+        bps = []
+        for arg in args.replace(",", " ").split():
+            if self._safeStrToInt(arg) is None:
+                self.log.info(usage)
+                return None
+            bp = self._breakpointArg(arg)
+            if bp is None:
+                return None
+            bps.append(bp)
+        return bps
+
+    def cmdDelete(self, args):
+        '''
+Delete breakpoints and watchpoints.
+Usage: delete [<breakpoint> ...]
+Without arguments, deletes all of them.  Numbers aren't reused.
+'''
+        bps = self._breakpointArgs(args, "Usage: delete [<breakpoint> ...]")
+        if not bps:
+            return
+        deleted = 0
+        self.dbg.beginBreakpointBatch()
+        try:
+            for bp in bps:
+                try:
+                    self.dbg.deleteBreakpoint(bp)
+                    deleted += 1
+                except BackendError, e:
+                    self.log.info("Breakpoint %d not deleted: %s" %
+                                  (self.dbg.breakpointIndex(bp), e))
+        finally:
+            self.dbg.endBreakpointBatch()
+        self.log.info("Deleted %d breakpoint%s." %
+                      (deleted, "" if deleted == 1 else "s"))
+
+    def _enable(self, args, enabled, usage):
+        bps = self._breakpointArgs(args, usage)
+        if not bps:
+            return
+        self.dbg.beginBreakpointBatch()
+        try:
+            for bp in bps:
+                self.dbg.enableBreakpoint(bp, enabled)
+        finally:
+            self.dbg.endBreakpointBatch()
+
+    def cmdEnable(self, args):
+        '''
+Enable breakpoints and watchpoints.
+Usage: enable [<breakpoint> ...]
+Without arguments, enables all of them.
+'''
+        self._enable(args, True, "Usage: enable [<breakpoint> ...]")
+
+    def cmdDisable(self, args):
+        '''
+Disable breakpoints and watchpoints.  A disabled breakpoint keeps its
+hardware slot, so enabling it again can't fail.
+Usage: disable [<breakpoint> ...]
+Without arguments, disables all of them.
+'''
+        self._enable(args, False, "Usage: disable [<breakpoint> ...]")
+
+    def cmdSource(self, args):
+        '''
+Run a debug script: commands, one per line, with variables, loops and checks.
+Blank lines and lines starting with '#' are skipped.
+Usage: source <file>
+The whole file is checked before anything runs.  Besides commands, a script
+can have:
+    set $<name> = <expression>
+    if <expression> ... [else ...] end
+    while <expression> ... end
+    repeat <count> ... end
+    expect <expression>        report a failure if false
+    echo <text>
+Expressions are as for 'condition', and can use $<name> variables; ${<name>}
+in a command or echo is replaced by the variable's value.
+Breakpoint changes in the file (break, watch, delete, enable, disable) are
+sent to the debugger together, in one transaction, instead of one at a time;
+they are sent early if a command in the file runs or steps the target.
+'''
+        self.scriptStatus = None
+        if not args:
+            self.log.info("Usage: source <file>")
+            return
+        try:
+            f = open(args, "r")
+            try:
+                lines = f.readlines()
+            finally:
+                f.close()
+        except IOError, e:
+            self.log.warning("Can't read %s: %s" % (args, e.strerror))
+            return
+        self.scriptStatus = self.runScript(lines, args)
+
+    def runScript(self, lines, name):
+        '''
+        Compile and run a debug script.  Returns its exit status: 0 if it
+        ran to the end with every expect met, 1 if an expect failed or an
+        error stopped it, 2 if it doesn't parse.
+        '''
+        try:
+            script = Script(self, lines, name)
+        except ScriptError, e:
+            self.log.warning("%s: %s" % (name, e))
+            return 2
+        self.dbg.beginBreakpointBatch()
+        try:
+            result = script.run()
+        finally:
+            self.dbg.endBreakpointBatch()
+        if result.failures:
+            self.log.warning("%d expectation%s failed." % (
+                len(result.failures), "s" if len(result.failures) > 1 else ""))
+        return 0 if result.passed() else 1
+
+    def cmdCondition(self, args):
+        '''
+Set or remove the condition of a breakpoint.
+Usage: condition <breakpoint> [<condition>]
+Without a condition, the breakpoint becomes unconditional.
+'''
+        splitargs = args.split(None, 1)
+        if not splitargs:
+            self.log.info("Usage: condition <breakpoint> [<condition>]")
+            return
+        bp = self._breakpointArg(splitargs[0])
+        if bp is None:
+            return
+        if len(splitargs) == 1:
+            bp.condition = None
+            self.log.info("Breakpoint %s is now unconditional." % splitargs[0])
+            return
+        try:
+            bp.condition = self.dbg.compileCondition(splitargs[1])
+        except ConditionError, e:
+            self.log.info("%s" % e)
+
+    def cmdIgnore(self, args):
+        '''
+Let the next hits of a breakpoint pass without stopping.
+Usage: ignore <breakpoint> <count>
+Hits where the breakpoint's condition is false don't count.
+'''
+        splitargs = args.split()
+        count = None
+        if len(splitargs) == 2:
+            count = self._safeStrToInt(splitargs[1])
+        if count is None or count < 0:
+            self.log.info("Usage: ignore <breakpoint> <count>")
+            return
+        bp = self._breakpointArg(splitargs[0])
+        if bp is None:
+            return
+        bp.ignoreCount = count
+        self.log.info("Will ignore next %d hits of breakpoint %s." %
+                      (count, splitargs[0]))
+
 
     def cmdBreakpoints(self, args):
         '''
@@ -151,64 +567,781 @@ Usage: breakpoints
         breakpoints = self.dbg.allBreakpoints()
         self.log.info("All breakpoints:")
         for (i,addr,file,line,enabled) in breakpoints:
+            bp = self.dbg.getBreakpoint(i)
+            if bp.kind != "breakpoint":
+                self.log.info("%d: %s%s: %s (0x%X, %d bytes) %c" %
+                              (i, "software " if bp.software else "",
+                               bp.kind, bp.expr, addr, bp.length,
+                               '*' if enabled else ' '))
+                if bp.hits:
+                    self.log.info("    triggered %d time%s" %
+                                  (bp.hits, "s" if bp.hits > 1 else ""))
+                continue
             self.log.info("%d: 0x%X (%s:%d) %c" % (i, addr, file, line,
                                                    '*' if enabled else ' '))
+            if bp.condition is not None:
+                self.log.info("    stop only if %s" % bp.condition.text)
+            if bp.hits:
+                self.log.info("    hit %d time%s" % (bp.hits,
+                                                  "s" if bp.hits > 1 else ""))
+            if bp.ignoreCount:
+                self.log.info("    ignore next %d hits" % bp.ignoreCount)
         
     def cmdContinue(self, args):
         '''
 Continue running target from current PC.
-Usage: continue
+Usage: continue [&]
+With '&', return to the prompt at once; where the target stops is reported
+when it halts, and other commands (print, every, halt) can be used while it
+runs.
 '''
-        self.dbg.run()
-        self.dbg.waitForHalt() # block
+        if args == "&":
+            self._background = True
+            self.dbg.run()
+            self.log.info("Continuing.")
+            return
+        self._background = False
+        # Single-stepping for software watchpoints is stopped by ^C like the
+        # other stepping commands, and reports where it got to.
+        self._busy = self.dbg.continueSteps()
+        self._interrupted = False
+        try:
+            stopped = self.dbg.continueToStop() # block
+        finally:
+            self._busy = False
+        if not stopped and self._interrupted:
+            self.log.info("Interrupted.")
+        elif not stopped:
+            self.log.info("Wait for target cancelled.")
+            return
+        self.reportStop()
+
+    # How long 'halt' waits for the target to stop, in seconds.
+    HALT_TIMEOUT = 5.0
 
+    def cmdHalt(self, args):
+        '''
+Halt the target, after 'continue &'.
+Usage: halt
+'''
+        if self.dbg.isHalted:
+            self.log.info("Target is not running.")
+            return
+        if not self.dbg.halt():
+            return
+        if not self.dbg.waitForHalt(self.HALT_TIMEOUT):
+            self.log.info("Target did not halt.")
+            return
+        self._background = False
+        self.reportStop()
+
+    def pendingStop(self):
+        '''True if a background continue has stopped but isn't reported.'''
+        return self._background and self.dbg.isHalted
+
+    def takeStop(self):
+        '''If a background continue has made a real stop, claim it for
+        reporting and return True.  Stops that only hit a false condition
+        resume the target and return False.'''
+        if not self.pendingStop() or not self.dbg.checkStop():
+            return False
+        self._background = False
+        return True
+
+    def reportPendingStop(self):
+        if self.takeStop():
+            self.reportStop()
+
+    def reportStop(self):
+        '''Log where the target stopped, and the display list.'''
         # It doesn't know where it is immediately after stopping.
         # But it also LIES.
-        # Ask, wait, ask again.  It'll figure it out.
-        # Hopefully.
-        pc = self.dbg.getPC()
-        time.sleep(1.0)
-        pc = self.dbg.getPC()
+        # Ask until two reads agree, unless checkStop() already has.
+        pc = self.dbg.settledPC()
         bp = self.dbg.breakpointIndexForAddress(pc)
         (file,line) = self.dbg.addressToSourceLine(pc)
+        for (wp, old, new, access) in self.dbg.watchHits:
+            i = self.dbg.breakpointIndex(wp)
+            self.log.info("%s %d: %s (%s)" % (wp.kind.capitalize(), i,
+                                              wp.expr, access))
+            if old != new:
+                self.log.info("Old value = %s" % self._formatRaw(wp, old))
+                self.log.info("New value = %s" % self._formatRaw(wp, new))
+            else:
+                self.log.info("Value = %s" % self._formatRaw(wp, new))
         self.log.info("%sStopped at 0x%X (%s:%d)" %
                       ("" if bp < 0 else "Breakpoint %d: " % bp,
                        pc,file,line))
+        text = self.dbg.sourceText(pc)
+        if text is not None:
+            self.log.info("%d\t%s" % text)
+        self._showDisplays()
+
+    def _formatRaw(self, wp, data):
+        if data is None:
+            return "<unreadable>"
+        value = wp.layout.decode(data)
+        if wp.single and isinstance(value, list):
+            value = value[0]
+        return formatValue(value)
+
+    def cmdEvery(self, args):
+        '''
+Run a command periodically, e.g. to watch a variable while the target runs
+after 'continue &'.
+Usage:
+    every <seconds> <command>
+    every
+    every cancel <n>|all
+'every' alone lists the periodic commands.
+'''
+        if self.scheduler is None:
+            self.log.info("Periodic commands need the interactive prompt.")
+            return
+        splitargs = args.split(None, 1)
+        if not splitargs:
+            timers = self.scheduler.timers()
+            if not timers:
+                self.log.info("No periodic commands.")
+            for (id, interval, cmd) in timers:
+                self.log.info("%d: every %gs: %s" % (id, interval, cmd))
+            return
+        if splitargs[0] == "cancel" and len(splitargs) == 2:
+            if splitargs[1] == "all":
+                ids = [x[0] for x in self.scheduler.timers()]
+            else:
+                ids = [self._safeStrToInt(splitargs[1])]
+            for id in ids:
+                if not self.scheduler.cancel(id):
+                    self.log.info("No periodic command %s." % splitargs[1])
+            return
+        try:
+            interval = float(splitargs[0])
+        except ValueError:
+            interval = 0
+        if interval <= 0 or len(splitargs) < 2:
+            self.log.info("Usage: every <seconds> <command>")
+            return
+        cmd = splitargs[1]
+        id = self.scheduler.every(interval,
+                                  lambda: self._runPeriodic(cmd), cmd)
+        self.log.info("%d: every %gs: %s" % (id, interval, cmd))
+
+    def _runPeriodic(self, cmd):
+        try:
+            self.executeCommand(cmd)
+        except Exception, e:
+            self.log.warning("%s: %s" % (cmd, e))
+
+    # Lines shown by 'list'
+    LIST_LINES = 10
 
     def cmdList(self, args):
-        pc = self.dbg.getPC()
-        fname,line = self.dbg.addressToSourceLine(pc, stripdir=False)
-        self.log.info("Listing from: %s" % fname)
-        f = open(fname, "r")
-        for _ in range(line-1):
-            f.readline()
-        for i in range(10):
-            self.log.info("%.3d: %s" % (line+i, f.readline()))
+        '''
+Display source code.
+Usage:
+    list
+    list <file>:<line>
+    list <line>
+    list <function>
+'list' alone continues from the last listing, or starts around the PC.  The
+other forms list around a line of a file (the current one, for a bare line
+number) or the start of a function.  The PC's line is marked with '>'.
+'''
+        args = args.strip()
+        pc = self.dbg.getPC() if self.dbg.isHalted else None
+        if self._listNext is not None and self._listNext[2] != pc:
+            # The target has moved on since the last listing.
+            self._listNext = None
+        if not args and self._listNext is not None:
+            (path, first, _) = self._listNext
+        else:
+            where = self._listLocation(args, pc)
+            if where is None:
+                return
+            (path, line) = where
+            first = max(line - self.LIST_LINES // 2 + 1, 1)
+        source = self.dbg.sources.get(path)
+        if source is None:
+            self.log.info("Can't read %s." % path)
+            return
+        lines = source.lines(first, first + self.LIST_LINES - 1)
+        if not lines:
+            self.log.info("Line %d is past the end of %s (%d lines)." %
+                          (first, path, len(source)))
+            return
+        pcLine = None
+        if pc is not None:
+            (pcPath, pcLine) = self.dbg.addressToSourceLine(pc, stripdir=False)
+            if pcPath != path:
+                pcLine = None
+        for (n, text) in lines:
+            self.log.info("%c%5d  %s" % (">" if n == pcLine else " ", n, text))
+        self._listNext = (path, lines[-1][0] + 1, pc)
+
+    def _listLocation(self, args, pc):
+        '''Return (path, line) for a 'list' argument, or None after saying
+        why.'''
+        if not args:
+            if pc is None:
+                self.log.info("The target is running; give a location.")
+                return None
+            (path, line) = self.dbg.addressToSourceLine(pc, stripdir=False)
+            if not line:
+                self.log.info("No source line for the PC.")
+                return None
+            return (path, line)
+        (file, sep, line) = args.rpartition(":")
+        if not sep:
+            (file, line) = (None, args)
+        num = self._safeStrToInt(line)
+        if num is None:
+            addr = self.dbg.getFunctionAddress(args)
+            if addr is None:
+                self.log.info("No function %s." % args)
+                return None
+            (path, line) = self.dbg.addressToSourceLine(addr, stripdir=False)
+            if not line:
+                self.log.info("No source line for %s." % args)
+                return None
+            return (path, line)
+        if file is None:
+            if self._listNext is not None:
+                return (self._listNext[0], num)
+            where = self._listLocation("", pc)
+            if where is None:
+                return None
+            return (where[0], num)
+        path = self.dbg.findFile(file)
+        if path is None:
+            self.log.info("No source file %s." % file)
+            return None
+        return (path, num)
+
+
+    # Instructions shown when disassembling from a location that isn't the
+    # start of a function.
+    DISASSEMBLE_COUNT = 16
+
+    def cmdDisassemble(self, args):
+        '''
+Disassemble program memory, with the source lines interleaved.
+Usage:
+    disassemble
+    disassemble <location>
+    disassemble <location> <end address>
+    disassemble <location> +<count>
+<location> is as for 'break'.  Without an end or count, a whole function is
+shown if <location> is a function, otherwise 16 instructions; without any
+arguments, the function containing the PC.  Instructions are decoded from a
+snapshot of program memory taken at load, and cached.
+'''
+        splitargs = args.split()
+        if len(splitargs) > 2:
+            self.log.info("Usage: disassemble [<location> [<end>|+<count>]]")
+            return
+        (end, count) = (None, None)
+        if not splitargs:
+            pc = self.dbg.getPC()
+            bounds = self.dbg.functionBounds(pc)
+            if bounds is None:
+                (start, count) = (pc, self.DISASSEMBLE_COUNT)
+            else:
+                (_, start, end) = bounds
+        else:
+            start = self.resolveLocation(splitargs[0])
+            if start is None:
+                self.log.info("Unknown location %s." % splitargs[0])
+                return
+            if len(splitargs) == 2:
+                if splitargs[1].startswith("+"):
+                    count = self._safeStrToInt(splitargs[1][1:])
+                else:
+                    end = self._safeStrToInt(splitargs[1])
+                if count is None and end is None:
+                    self.log.info("Bad end or count: %s" % splitargs[1])
+                    return
+            else:
+                bounds = self.dbg.functionBounds(start)
+                if bounds is not None and bounds[1] == start:
+                    end = bounds[2]
+                else:
+                    count = self.DISASSEMBLE_COUNT
+        self._printInstructions(self.dbg.instructions(start, end, count))
+
+    def _printInstructions(self, instructions):
+        '''Log instructions, each new source line before its code, and the
+        PC marked.'''
+        pc = self.dbg.getPC() if self.dbg.isHalted else None
+        lastLine = None
+        for (addr, size) in instructions:
+            where = self.dbg.addressToSourceLine(addr)
+            if where != lastLine:
+                self.log.info("%s:%d" % where)
+                lastLine = where
+            found = self.dbg.symbolForAddress(addr)
+            self.log.info("%s 0x%08X %-20s %s" %
+                          ("=>" if addr == pc else "  ", addr,
+                           "<%s+%d>" % found if found else "",
+                           self.dbg.disassemble(addr, size)))
+
+    def cmdExamine(self, args):
+        '''
+Examine memory.
+Usage: x/<count><format> <address>
+<format> is i (instructions, with source lines), x (32-bit words in hex) or
+b (bytes in hex); count defaults to 1 and format to x.  <address> is a
+number, a symbol name or $pc.  Program memory is read from the snapshot
+taken at load.
+'''
+        (spec, _, where) = args.partition(" ")
+        where = where.strip()
+        if not spec.startswith("/") or not where:
+            self.log.info("Usage: x/<count><i|x|b> <address>")
+            return
+        spec = spec[1:]
+        fmt = "x"
+        if spec and spec[-1] in "ixb":
+            (spec, fmt) = (spec[:-1], spec[-1])
+        count = self._safeStrToInt(spec) if spec else 1
+        if where.lower() == "$pc":
+            addr = self.dbg.getPC()
+        else:
+            addr = self._safeStrToInt(where)
+            if addr is None:
+                sym = self.dbg.symbols.lookup(where)
+                addr = sym.address if sym else None
+        if count is None or count <= 0 or addr is None:
+            self.log.info("Usage: x/<count><i|x|b> <address>")
+            return
+        if fmt == "i":
+            self._printInstructions(self.dbg.instructions(addr, count=count))
+            return
+        (size, perLine, pack) = {"x": (4, 4, "<%dI"),
+                                 "b": (1, 8, "%dB")}[fmt]
+        data = self.dbg.readMemory(addr, count * size)
+        if data is None:
+            self.log.info("Cannot read memory at 0x%X." % addr)
+            return
+        values = struct.unpack(pack % count, data)
+        for i in range(0, count, perLine):
+            self.log.info("0x%08X: %s" % (addr + i * size, " ".join(
+                ["0x%0*X" % (size * 2, v) for v in values[i:i+perLine]])))
+
+    def cmdDump(self, args):
+        '''
+Save the target's data memory to a core file, for debugging later without
+the target: 'picdb.py --core <file>' serves print, x, list and symbol
+queries from it.
+Usage: dump core <file>
+Data RAM is read in large chunks; parts the device doesn't have are left
+out.  The CPU registers are saved too.  Peripheral registers (SFRs) are not,
+since reading some of them has side effects (e.g. UART receive buffers).
+The target must be halted.
+'''
+        splitargs = args.split(None, 1)
+        if len(splitargs) != 2 or splitargs[0] != "core":
+            self.log.info("Usage: dump core <file>")
+            return
+        if not self.dbg.isHalted:
+            self.log.info("The target is running; halt it first.")
+            return
+        start = time.time()
+        try:
+            (written, missing) = self.dbg.dumpCore(splitargs[1])
+        except (IOError, BackendError), e:
+            self.log.info("Core dump failed: %s" % e)
+            return
+        self.log.info("Wrote %d bytes to %s in %.2fs%s." %
+                      (written, splitargs[1], time.time() - start,
+                       " (%d bytes unreadable)" % missing if missing else ""))
+
+    def cmdStats(self, args):
+        '''
+Show how many calls each command made into the debugger backend (mdbcore,
+or the simulator), and their total and maximum time and bytes read.  Calls
+made by a running 'log' are shown as 'background'.
+Usage:
+    stats                 show the figures since the last reset
+    stats reset           clear them
+    stats trace <file>    also append every call to file, as JSON lines
+    stats trace off       stop writing the trace
+'''
+        splitargs = args.split()
+        stats = self.dbg.stats
+        if not splitargs:
+            for line in stats.report():
+                self.log.info(line)
+        elif splitargs == ["reset"]:
+            stats.reset()
+            self.log.info("Statistics cleared.")
+        elif len(splitargs) == 2 and splitargs[0] == "trace":
+            path = None if splitargs[1] == "off" else splitargs[1]
+            try:
+                stats.traceTo(path)
+            except IOError, e:
+                self.log.info("Can't open %s: %s" % (path, e.strerror))
+                return
+            if path is not None:
+                self.log.info("Tracing backend calls to %s" % path)
+        else:
+            self.log.info("Usage: stats [reset | trace <file>|off]")
 
+    def cmdInfo(self, args):
+        '''
+Display information about the loaded program.
+Usage:
+    info symbols [pattern]
+    info symbol <address>
+    info registers [<register> ...]
+'info symbols' lists symbols whose names start with pattern, or match it as a
+glob if it contains wildcards (*, ?, [...]).  'info symbol' shows which symbol
+contains an address.  'info registers' shows the CPU registers, all of them or
+the ones named; they are read together once per stop.
+'''
+        splitargs = args.split(None, 1)
+        if not splitargs or splitargs[0] not in self._infoMap:
+            self.log.info("Usage: info <%s>" % "|".join(sorted(self._infoMap)))
+            return
+        self._infoMap[splitargs[0]](splitargs[1] if len(splitargs) > 1 else "")
+
+    def infoSymbols(self, args):
+        syms = self.dbg.symbols.match(args.strip())
+        for sym in syms:
+            self.log.info("0x%08X %-6s %6d %s" % (sym.address, sym.kind,
+                                                 sym.size, sym.name))
+        self.log.info("%d symbols." % len(syms))
+
+    def infoSymbol(self, args):
+        addr = self._safeStrToInt(args.strip())
+        if addr is None:
+            self.log.info("Usage: info symbol <address>")
+            return
+        found = self.dbg.symbolForAddress(addr)
+        if found is None:
+            self.log.info("No symbol matches 0x%X." % addr)
+        elif found[1]:
+            self.log.info("%s + %d" % found)
+        else:
+            self.log.info(found[0])
+
+    def infoRegisters(self, args):
+        try:
+            registers = self.dbg.registers()
+        except BackendError, e:
+            self.log.info(str(e))
+            return
+        names = [x.lstrip("$").lower() for x in args.split()]
+        if names:
+            values = dict(registers)
+            for name in names:
+                if name not in values:
+                    self.log.info("Unknown register: $%s" % name)
+                    return
+            registers = [(x, values[x]) for x in names]
+        for i in range(0, len(registers), 4):
+            self.log.info("  ".join(["%-6s 0x%08X" % x
+                                     for x in registers[i:i+4]]))
+
+    def completions(self, line, text):
+        '''Return possible completions of text, the word of line being typed.
+        Completes command names, then info topics, then symbol names.'''
+        words = line.split()
+        if not words:
+            names = self._commandMap.keys()
+        elif words[0] == "help" and len(words) == 1:
+            names = self._commandMap.keys()
+        elif words[0] == "info" and len(words) == 1:
+            names = self._infoMap.keys()
+        else:
+            return self.dbg.symbols.withPrefix(text)
+        return sorted([x for x in names if x.startswith(text)])
+
+    def _stepCount(self, args):
+        '''Parse the optional repeat count of a step command, or None.'''
+        if not args:
+            return 1
+        count = self._safeStrToInt(args)
+        if count is None or count < 1:
+            self.log.info("Usage: <step|stepi|next> [count]")
+            return None
+        return count
+
+    # Most steps 'until' and 'finish' take before giving up.
+    STEP_LIMIT = 100000
+
+    def interrupt(self):
+        '''Stop a multi-step command.  Returns False if none is running.'''
+        if not self._busy:
+            return False
+        self._interrupted = True
+        self.dbg.cancelWait()
+        return True
+
+    def _stepMany(self, type, count=None, stop=None):
+        '''
+        Step up to count times (STEP_LIMIT if None), or until stop(pc) is true,
+        without printing each step.  PCs are kept for 'trace', and streamed
+        to the trace file if one is open.  Reports where stepping ended.
+        '''
+        pcs = []
+        pc = None
+        limit = count or self.STEP_LIMIT
+        reached = stop is None
+        self._busy = True
+        self._interrupted = False
+        try:
+            while len(pcs) < limit and not self._interrupted:
+                pc = self.dbg.stepRaw(type)
+                if pc is None:
+                    break
+                pcs.append(pc)
+                if self._traceWriter:
+                    self._traceWriter.add(pc)
+                if stop is not None and stop(pc):
+                    reached = True
+                    break
+        finally:
+            self._busy = False
+            if self._traceWriter:
+                self._traceWriter.flush()
+        self._lastTrace = pcs
+        if self._interrupted:
+            self.log.info("Interrupted.")
+        elif not reached and pc is not None:
+            self.log.info("Gave up after %d steps." % len(pcs))
+        if pc is not None:
+            self.dbg.printLocation(pc)
+        self.log.info("%d steps." % len(pcs))
+        self._showDisplays()
+
+    def _stepCommand(self, type, args):
+        count = self._stepCount(args)
+        if count is None:
+            return
+        if count == 1:
+            self.dbg.step(type)
+            self._showDisplays()
+        else:
+            self._stepMany(type, count)
 
     def cmdStep(self, args):
         '''
 Step target over one line of source.  Descends into functions.
-Usage: step
+Usage: step [count]
+With a count, steps that many lines and prints only where it ended.  The
+PCs stepped through are recorded; see 'trace'.
 '''
-        self.dbg.step(self.dbg.StepType.IN)
+        self._stepCommand(self.dbg.StepType.IN, args)
 
 
     def cmdStepi(self, args):
         '''
 Step target over one single instruction.
-Usage: stepi
+Usage: stepi [count]
+With a count, steps that many instructions and prints only where it ended.
+The PCs stepped through are recorded; see 'trace'.
 '''
-        self.dbg.step(self.dbg.StepType.INSTR)
+        self._stepCommand(self.dbg.StepType.INSTR, args)
 
 
     def cmdNext(self, args):
         '''
 Step target over one line of source.  If line is a function call, does not
 descend into it.
-Usage: step
+Usage: next [count]
 '''
-        self.dbg.step(self.dbg.StepType.OVER)
+        self._stepCommand(self.dbg.StepType.OVER, args)
+
+    def cmdUntil(self, args):
+        '''
+Step one instruction at a time until the PC reaches a location, recording
+the PCs stepped through.
+Usage: until <location>
+<location> is given as for 'break'.
+'''
+        if not args:
+            self.log.info("Usage: until <location>")
+            return
+        addr = self.resolveLocation(args)
+        if addr is None:
+            self.log.info("Unknown location.")
+            return
+        self._stepMany(self.dbg.StepType.INSTR, stop=lambda pc: pc == addr)
+
+    def cmdFinish(self, args):
+        '''
+Step over lines until the current function returns, recording the PCs
+stepped through.
+Usage: finish
+'''
+        bounds = self.dbg.functionBounds(self.dbg.getPC())
+        if bounds is None:
+            self.log.info("Not in a known function.")
+            return
+        (name, start, end) = bounds
+        self.log.info("Run till exit from %s" % name)
+        self._stepMany(self.dbg.StepType.OVER,
+                       stop=lambda pc: pc < start or pc >= end)
+
+    def cmdTrace(self, args):
+        '''
+Record and examine the PCs stepped through by step/stepi/next with a count,
+until and finish.
+Usage:
+    trace start <file>    stream PCs of later stepping to file
+    trace stop            close the trace file
+    trace summary [file]  steps per function and source line
+    trace show [file] [first [count]]
+                          list the PCs with function, line and instruction
+Without a file, summary and show use the last stepping command's PCs.
+'''
+        splitargs = args.split()
+        if not splitargs:
+            self.log.info("Usage: trace <start|stop|summary|show>")
+            return
+        sub = splitargs[0]
+        if sub == "start" and len(splitargs) == 2:
+            self._closeTrace()
+            try:
+                self._traceWriter = TraceWriter(splitargs[1])
+            except IOError, e:
+                self.log.info("Can't open trace file: %s" % e)
+                return
+            self.log.info("Tracing to %s" % splitargs[1])
+        elif sub == "stop":
+            self._closeTrace()
+        elif sub in ("summary", "show"):
+            rest = splitargs[1:]
+            pcs = self._lastTrace
+            if rest and self._safeStrToInt(rest[0]) is None:
+                try:
+                    pcs = readTrace(rest[0])
+                except (IOError, TraceError), e:
+                    self.log.info("Can't read trace: %s" % e)
+                    return
+                rest = rest[1:]
+            annotator = Annotator(self.dbg)
+            if sub == "summary":
+                for line in summarize(pcs, annotator):
+                    self.log.info(line)
+                return
+            first = 0
+            count = len(pcs)
+            if rest:
+                first = self._safeStrToInt(rest[0]) or 0
+            if len(rest) > 1:
+                count = self._safeStrToInt(rest[1]) or 0
+            for (i, pc) in enumerate(pcs[first:first+count]):
+                self.log.info("%6d %s" % (first + i, annotator.describe(pc)))
+        else:
+            self.log.info("Usage: trace <start|stop|summary|show>")
+
+    def cmdProfile(self, args):
+        '''
+Sample the PC of the running target to see where it spends its time.
+Usage: profile <seconds> <hz> [file]
+Reports the functions and source lines with the most samples.  With a file,
+also writes the samples in collapsed-stack format for flame graph tools.
+If the debugger can't read the PC while the target runs, each sample halts
+the target briefly.  A halted target is resumed for the profile and halted
+again afterwards.
+'''
+        splitargs = args.split()
+        try:
+            seconds = float(splitargs[0])
+            hz = float(splitargs[1])
+        except (IndexError, ValueError):
+            seconds = hz = 0
+        if seconds <= 0 or hz <= 0 or len(splitargs) > 3:
+            self.log.info("Usage: profile <seconds> <hz> [file]")
+            return
+        wasHalted = self.dbg.isHalted
+        if wasHalted:
+            self.dbg.run()
+        self.log.info("Profiling for %gs at %g Hz..." % (seconds, hz))
+        self._busy = True
+        self._interrupted = False
+        try:
+            profile = sample(self.dbg.samplePC, seconds, hz,
+                             lambda: self._interrupted)
+        finally:
+            self._busy = False
+        profile.live = self.dbg.backend.canSamplePC()
+        if wasHalted and self.dbg.halt() and \
+                self.dbg.waitForHalt(self.HALT_TIMEOUT):
+            self.reportStop()
+
+        symbol = self.dbg.symbolForAddress
+        line = lambda pc: self.dbg.addressToSourceLine(pc)
+        (functions, lines) = histograms(profile, symbol, line)
+        for text in report(profile, functions, lines):
+            self.log.info(text)
+        if len(splitargs) == 3:
+            try:
+                f = open(splitargs[2], "w")
+                try:
+                    writeCollapsed(f, profile, symbol, line)
+                finally:
+                    f.close()
+            except IOError, e:
+                self.log.info("Can't write %s: %s" % (splitargs[2], e))
+                return
+            self.log.info("Wrote collapsed stacks to %s" % splitargs[2])
+
+    def cmdLog(self, args):
+        '''
+Log variables to a file at a fixed rate while the target runs, without halting
+it.  Sampling happens in the background; the prompt stays usable.
+Usage:
+    log <variable> [<variable> ...] every <ms> to <file>
+    log             show how the current or last log is going
+    log stop        stop logging and report
+Variables are as for 'print'; ones close together in memory are read in one
+transfer.  A file ending in .csv gets a time column and a column per value;
+any other file gets compact binary records of the raw bytes.  The report gives
+the achieved rate, how late samples were taken (drift), and samples missed
+because the previous one ran late or whose read failed.
+'''
+        splitargs = args.replace(",", " ").split()
+        if not splitargs or splitargs == ["stop"]:
+            log = self.dbg.stopLog() if splitargs else self.dbg.liveLog
+            if log is None:
+                self.log.info("Not logging.")
+                return
+            for line in log.report():
+                self.log.info(line)
+            return
+        try:
+            i = splitargs.index("every")
+            exprs = splitargs[:i]
+            ms = float(splitargs[i+1])
+            if splitargs[i+2] != "to" or len(splitargs) != i + 4:
+                raise ValueError
+            path = splitargs[i+3]
+        except (ValueError, IndexError):
+            exprs = None
+        if not exprs or ms <= 0:
+            self.log.info("Usage: log <variable> [<variable> ...] "
+                          "every <ms> to <file>")
+            return
+        try:
+            self.dbg.startLog(exprs, ms / 1000.0, path)
+        except LogError, e:
+            self.log.info("%s" % e)
+            return
+        except IOError, e:
+            self.log.info("Can't write %s: %s" % (path, e.strerror))
+            return
+        self.log.info("Logging %s every %gms to %s." %
+                      (", ".join(exprs), ms, path))
+
+    def _closeTrace(self):
+        if self._traceWriter:
+            self._traceWriter.close()
+            self.log.info("Wrote %d PCs to %s" % (self._traceWriter.count,
+                                                  self._traceWriter.path))
+            self._traceWriter = None
 
 
     def cmdQuit(self, args):
@@ -241,22 +1374,48 @@ Usage: help [command]
 
 
 class CommandInterpreter:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.running = False
-        self._handler = CommandHandler(self.stopInputLoop)
+        self._handler = CommandHandler(self.stopInputLoop, backend)
+        self._loop = EventLoop()
+        self._handler.dbg.addListener(self._targetEvent)
+        self._inputReady = threading.Event()
+        self._atPrompt = False
         signal.signal(signal.SIGINT, self.sigIntHandler)
+        self._completions = []
+        if readline:
+            readline.set_completer(self._complete)
+            readline.parse_and_bind("tab: complete")
+
+    def _complete(self, text, state):
+        '''readline completer.'''
+        if state == 0:
+            line = readline.get_line_buffer()[:readline.get_begidx()]
+            self._completions = self._handler.completions(line, text)
+        if state < len(self._completions):
+            return self._completions[state]
+        return None
 
     def stopInputLoop(self):
         '''Set main loop to stop running.'''
         self.running = False
+        self._loop.stop()
 
-    def cleanShutdown(self):
+    def cleanShutdown(self, status=0):
         '''Disconnect from debugger and quit.'''
         self._handler.dbg.disconnect()
-        sys.exit(0) # this will interrupt raw_input()
+        sys.exit(status) # this will interrupt raw_input()
 
     def sigIntHandler(self, sig, frame):
-        '''Quit cleanly on ^C.'''
+        '''^C halts a running target, and quits cleanly otherwise.'''
+        dbg = self._handler.dbg
+        if self._handler.interrupt():
+            return
+        if not dbg.isHalted:
+            self._handler.log.info("Halting target...")
+            if not dbg.halt():
+                dbg.cancelWait()
+            return
         self.stopInputLoop()
         self.cleanShutdown()
 
@@ -271,46 +1430,98 @@ class CommandInterpreter:
             user_input = raw_input()
             return user_input.strip()
         except EOFError:
-            self.stopInputLoop()
+            self._loop.post(self.stopInputLoop)
             return ""
 
-    def _stringStartsWithCmd(self, str, cmd):
-        '''Determine if string from user starts with a known command.'''
-        matches = False
-        n = len(cmd)
-        m = len(str)
-        if str[0:n].lower() == cmd.lower():
-            if m == n or (m > n and str[n] not in string.ascii_letters):
-                matches = True
-        return matches
-
     def executeCommand(self, input):
-        for cmd,info in self._handler._commandMap.iteritems():
-            if self._stringStartsWithCmd(input, cmd):
-                info['fn'](input[len(cmd):].strip())
-        
-    
-    def _mainLoop(self):
-        '''Main loop listening for commands from user.'''
+        self._handler.executeCommand(input)
+
+    def scriptStatus(self):
+        '''Exit status of the last script run by 'source', or None.'''
+        return self._handler.scriptStatus
+
+    def disableDebug(self):
+        '''Refuse the 'debug' command from now on.'''
+        self._handler.allowDebug = False
+
+    # Scheduler interface used by CommandHandler for periodic commands
+    def every(self, interval, fn, description):
+        return self._loop.every(interval, lambda: self._async(fn),
+                                description)
+
+    def cancel(self, id):
+        return self._loop.cancel(id)
+
+    def timers(self):
+        return self._loop.timers()
+
+    def _async(self, fn, *args):
+        '''Run fn, which may print, between the user's commands.  Moves off
+        the prompt line first and redraws it afterwards.'''
+        if self._atPrompt:
+            sys.stdout.write("\n")
+        try:
+            fn(*args)
+        except bdb.BdbQuit:
+            raise
+        except Exception:
+            self._handler.log.exception("Background task failed")
+        if self._atPrompt:
+            self._displayPrompt()
+            if readline:
+                sys.stdout.write(readline.get_line_buffer())
+                sys.stdout.flush()
+
+    def _targetEvent(self, event):
+        '''Debugger listener; runs on the backend's thread.'''
+        self._loop.post(self._handleTargetEvent)
+
+    def _handleTargetEvent(self):
+        if self._handler.takeStop():
+            self._async(self._handler.reportStop)
+
+    def _inputLoop(self):
+        '''Input thread: read a command whenever the previous one is done.'''
         while self.running:
+            self._inputReady.wait()
+            self._inputReady.clear()
+            if not self.running:
+                break
+            self._atPrompt = True
             self._displayPrompt()
             user_input = self._readUserInput()
-            if user_input == "":
-                continue
-            self.executeCommand(user_input)
-        print
-        
-    
+            self._atPrompt = False
+            self._loop.post(self._command, user_input)
+
+    def _command(self, user_input):
+        '''Run one command.  A command that fails unexpectedly is reported and
+        the debugger carries on; it doesn't take the event loop with it.'''
+        try:
+            if user_input != "":
+                self.executeCommand(user_input)
+        except bdb.BdbQuit:
+            raise
+        except Exception:
+            self._handler.log.exception("Command failed: %s" % user_input)
+        finally:
+            self._inputReady.set()
+
     def run(self):
         '''Run debugger.'''
         self.running = True
-        # Wrap the whole main loop in an outer loop here so we can catch
+        self._handler.scheduler = self
+        self._inputReady.set()
+        reader = threading.Thread(target=self._inputLoop)
+        reader.setDaemon(True)
+        reader.start()
+        # Wrap the event loop in an outer loop here so we can catch
         # exceptions from the pdb debugger.
         while self.running:
             try:
-                self._mainLoop()
+                self._loop.run()
             except bdb.BdbQuit:
-                pass # pdb quit, but we're still runnin'
+                self._inputReady.set() # pdb quit, but we're still runnin'
+        print
         self.cleanShutdown()
 
 if __name__ == "__main__":
@@ -322,27 +1533,106 @@ if __name__ == "__main__":
                       help="ELF file to load onto target.")
     parser.add_option("-s", "--script", dest="script", metavar="SCRIPT",
                       help="Debug script to execute.")
+    parser.add_option("--server", dest="server", metavar="ADDRESS",
+                      help="Stay resident and take commands from picdbclient.py "
+                      "on a Unix socket path or [host]:port.  Any host but "
+                      "loopback needs a token in $PICDB_TOKEN.")
+    parser.add_option("--simulator", dest="simulator", action="store_true",
+                      default=False,
+                      help="Debug a simulated target instead of hardware.")
+    parser.add_option("--fleet", dest="fleet", action="store_true",
+                      default=False,
+                      help="Load, verify and run the script on every attached "
+                      "debugger at once (with -t, -f and -s).")
+    parser.add_option("--workers", dest="workers", type="int", metavar="N",
+                      help="Targets to work on at a time in fleet mode "
+                      "(default: all).")
+    parser.add_option("--core", dest="core", metavar="CORE",
+                      help="Inspect a core file saved by 'dump core' instead "
+                      "of a target (with -f, or the ELF it names).")
+    parser.add_option("--startup-profile", dest="startup_profile",
+                      action="store_true", default=False,
+                      help="Report time spent in each start-up phase.")
     (options, args) = parser.parse_args()
 
 
-    interp = CommandInterpreter()
-    if hasattr(options, "target"):
+    startupProfile.begin("create interpreter")
+    def makeBackend():
+        if options.simulator:
+            from mdb.simbackend import SimBackend
+            return SimBackend()
+        return None
+
+    if options.fleet:
+        from mdb.fleet import Fleet
+        from mdb.flashcache import FlashCache
+        if not options.target:
+            parser.error("--fleet needs a target (-t).")
+        script = []
+        if options.script:
+            f = open(options.script, "r")
+            script = f.readlines()
+            f.close()
+        # One cache for every target, so its lock covers the shared file.
+        fleet = Fleet(options.target,
+                      lambda: CommandHandler(lambda: None, makeBackend()),
+                      options.workers, flashCache=FlashCache())
+        start = time.time()
+        results = fleet.run(options.file, script,
+                            name=options.script or "script")
+        if not results:
+            print "No debuggers found."
+        for line in fleet.summary(results, time.time() - start):
+            print line
+        sys.exit(0 if results and all([r.passed for r in results]) else 1)
+
+    if options.core:
+        from mdb.core import CoreFile, CoreError
+        from mdb.corebackend import CoreBackend
+        try:
+            core = CoreFile(options.core)
+        except (IOError, CoreError), e:
+            parser.error("Can't open core file: %s" % e)
+        info = makeBackend()
+        if info is None:
+            from mdb.mdbbackend import MdbBackend
+            info = MdbBackend()
+        interp = CommandInterpreter(CoreBackend(core, info))
+        startupProfile.end("create interpreter")
+        elf = options.file or core.elf
+        if elf:
+            interp.executeCommand("load %s" % elf)
+    else:
+        interp = CommandInterpreter(makeBackend())
+        startupProfile.end("create interpreter")
+    if options.target and not options.core:
+        startupProfile.begin("connect")
         interp.executeCommand("connect %s" % options.target)
-        if hasattr(options, "file"):
+        startupProfile.end("connect")
+        if options.file:
+            startupProfile.begin("load")
             interp.executeCommand("load %s" % options.file)
+            startupProfile.end("load")
+    if options.startup_profile:
+        startupProfile.report(sys.stderr)
 
-    if not hasattr(options, "script") or not options.script:
+    if options.server:
+        try:
+            server = DebugServer(interp, options.server,
+                                 os.environ.get(TOKEN_VARIABLE))
+        except ServerError, e:
+            logging.getLogger("picdb").error(str(e))
+            interp.cleanShutdown(1)
+        server.serve()
+    elif not options.script:
         interp.run()
     else:
         log = logging.getLogger("picdb")
         log.setLevel(logging.WARNING)
-        script = open(options.script, "r")
-        for line in script:
-            try:
-                interp.executeCommand(line)
-            except Exception, e:
-                print e
-        script.close()
+        f = open(options.script, "r")
+        lines = f.readlines()
+        f.close()
+        interp.cleanShutdown(interp._handler.runScript(lines, options.script))
 
     interp.cleanShutdown()
     
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+'''
+Benchmark picdb's command paths against the simulated target.
+
+Runs load, break, step, next, print and continue-to-breakpoint through the
+command interpreter, as a user or script would, and reports operations per
+second and p50/p99 latency for each.  With --latency, every probe
+transaction costs that much, so the numbers show how many round trips each
+command makes.  --save writes results as JSON; --compare checks them
+against a saved run and fails if any p50 regressed by more than
+--tolerance, for use in CI.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+from optparse import OptionParser
+
+from picdb import CommandInterpreter
+from mdb.simbackend import SimBackend, makeSyntheticProgram
+from mdb.flashcache import FlashCache
+
+class _NullOutput:
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+def measure(fn, iterations):
+    '''Call fn(i) iterations times.  Returns a dict of statistics, with
+    times in milliseconds.'''
+    samples = []
+    stdout = sys.stdout
+    sys.stdout = _NullOutput()
+    try:
+        for i in range(iterations):
+            start = time.time()
+            fn(i)
+            samples.append(time.time() - start)
+    finally:
+        sys.stdout = stdout
+    total = sum(samples)
+    return {"iterations": iterations,
+            "ops_per_sec": iterations / total if total else 0.0,
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000}
+
+def runBenchmarks(elf, symbolTypes, latency, iterations, workdir):
+    backend = SimBackend(latency=latency, breakpointSlots=iterations + 1,
+                         symbolTypes=symbolTypes)
+    interp = CommandInterpreter(backend)
+    dbg = interp._handler.dbg
+    dbg.flashCache = FlashCache(os.path.join(workdir, "flashcache.json"))
+    logging.getLogger("picdb").setLevel(logging.ERROR)
+    run = interp.executeCommand
+    measure(lambda i: run("connect SIM"), 1)
+
+    results = {}
+    loads = max(3, iterations // 20)
+    results["load"] = measure(lambda i: run("load %s" % elf), loads)
+    functions = [x for x in dbg.symbols.allSymbols() if x.kind == "func"]
+    functions.sort(key=lambda x: x.address)
+    def setBreak(i):
+        run("break *0x%X" % functions[i % len(functions)].address)
+    results["break"] = measure(setBreak, iterations)
+    results["step"] = measure(lambda i: run("step"), iterations)
+    results["next"] = measure(lambda i: run("next"), iterations)
+    objects = [x.name for x in dbg.symbols.allSymbols() if x.kind == "object"]
+    objects.sort()
+    results["print"] = measure(lambda i: run("print %s" % " ".join(objects)),
+                               iterations)
+    results["continue"] = measure(lambda i: run("continue"), iterations)
+    results["transactions"] = backend.transactions
+    dbg.disconnect()
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Return a list of messages for benchmarks slower than baseline.'''
+    regressions = []
+    for name, stats in sorted(results.items()):
+        old = baseline.get(name)
+        if not isinstance(stats, dict) or not old:
+            continue
+        if stats["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append("%s: p50 %.3f ms, was %.3f ms" %
+                               (name, stats["p50_ms"], old["p50_ms"]))
+    return regressions
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--elf", dest="elf", metavar="FILE",
+                      help="ELF file to load (default: generated program).")
+    parser.add_option("--latency", dest="latency", type="float", default=0.0,
+                      metavar="MS", help="Latency of each probe transaction.")
+    parser.add_option("-n", "--iterations", dest="iterations", type="int",
+                      default=200, help="Operations per benchmark.")
+    parser.add_option("--save", dest="save", metavar="FILE",
+                      help="Write results as JSON.")
+    parser.add_option("--compare", dest="compare", metavar="FILE",
+                      help="Fail if slower than the results saved in FILE.")
+    parser.add_option("--tolerance", dest="tolerance", type="float",
+                      default=0.2, help="Allowed p50 slowdown for --compare.")
+    (options, args) = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="picdbbench")
+    try:
+        if options.elf:
+            (elf, symbolTypes) = (options.elf, None)
+        else:
+            (elf, symbolTypes) = makeSyntheticProgram(workdir)
+        results = runBenchmarks(elf, symbolTypes, options.latency / 1000.0,
+                                options.iterations, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    print "%-10s %10s %10s %10s" % ("", "ops/s", "p50 ms", "p99 ms")
+    for name in ["load", "break", "step", "next", "print", "continue"]:
+        stats = results[name]
+        print "%-10s %10.1f %10.3f %10.3f" % (name, stats["ops_per_sec"],
+                                              stats["p50_ms"], stats["p99_ms"])
+    print "%d probe transactions" % results["transactions"]
+
+    if options.save:
+        f = open(options.save, "w")
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    if options.compare:
+        f = open(options.compare, "r")
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(results, baseline, options.tolerance)
+        for msg in regressions:
+            print "Regression: %s" % msg
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
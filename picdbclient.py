@@ -0,0 +1,108 @@
+'''
+Thin client for a resident picdb server (picdb.sh --server ADDRESS).
+
+Runs under plain CPython; it doesn't need Jython or the MPLAB jars, so it
+starts instantly.  Commands come from -c options, a script file, or an
+interactive prompt, in that order of preference.  A script file is run by
+the server with 'source', so the path has to be readable there; the exit
+status is the script's, as for picdb.py --script.  'quit' detaches from the
+server; --shutdown stops it.  If the server needs a token, give it with
+--token or in the PICDB_TOKEN environment variable.
+'''
+
+import os
+import sys
+import socket
+import StringIO
+from optparse import OptionParser
+
+from mdb.server import parseAddress, END_MARKER, TOKEN_VARIABLE
+
+class DebugClient:
+    def __init__(self, address, token=None):
+        (family, addr) = parseAddress(address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.connect(addr)
+        self._in = self._sock.makefile("rb")
+        if token:
+            out = StringIO.StringIO()
+            self.execute("!token %s" % token, out)
+            if out.getvalue():
+                self.close()
+                raise IOError(out.getvalue().strip())
+
+    def execute(self, command, out=sys.stdout):
+        '''Send one command and stream its output to out.'''
+        self._sock.sendall(command.strip() + "\n")
+        while True:
+            line = self._in.readline()
+            if not line:
+                raise IOError("Server closed the connection.")
+            if line.rstrip("\n") == END_MARKER:
+                return
+            out.write(line)
+            out.flush()
+
+    def scriptStatus(self):
+        '''Return the exit status of the last script the server ran with
+        'source', or None if it hasn't run one.'''
+        out = StringIO.StringIO()
+        self.execute("!status", out)
+        status = out.getvalue().strip()
+        if not status:
+            return None
+        return int(status)
+
+    def close(self):
+        self._in.close()
+        self._sock.close()
+
+def main():
+    parser = OptionParser(usage="%prog ADDRESS [options]")
+    parser.add_option("-s", "--script", dest="script", metavar="SCRIPT",
+                      help="Debug script to execute.")
+    parser.add_option("-c", "--command", dest="commands", action="append",
+                      default=[], metavar="COMMAND",
+                      help="Command to execute.  May be repeated.")
+    parser.add_option("--shutdown", dest="shutdown", action="store_true",
+                      default=False,
+                      help="Stop the server after running any commands.")
+    parser.add_option("--token", dest="token", metavar="TOKEN",
+                      default=os.environ.get(TOKEN_VARIABLE),
+                      help="Token the server was started with (default: "
+                      "$%s)." % TOKEN_VARIABLE)
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("server address required")
+
+    client = DebugClient(args[0], options.token)
+    status = 0
+    try:
+        if options.commands:
+            for command in options.commands:
+                client.execute(command)
+        elif options.script:
+            client.execute("!quiet")
+            client.execute("source %s" % os.path.abspath(options.script))
+            status = client.scriptStatus()
+            if status is None:
+                status = 1 # the server couldn't read the file
+        else:
+            while True:
+                sys.stdout.write("PICdb> ")
+                sys.stdout.flush()
+                line = sys.stdin.readline()
+                if not line:
+                    break
+                if line.strip() == "quit":
+                    break
+                if line.strip():
+                    client.execute(line)
+        if options.shutdown:
+            client.execute("!shutdown")
+    finally:
+        client.close()
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()